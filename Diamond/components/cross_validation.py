@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import time
+import queue
+import multiprocessing
+import numpy as np
+from multiprocessing import shared_memory
+from dataclasses import dataclass
+from Diamond.exception import DiamondException
+from Diamond.logger import logging
+from Diamond.utils.instrumentation import metrics
+from Diamond.components.model_search import limit_model_threads, limit_worker_threads
+
+# Views on the shared training matrix, set in every worker by the pool initializer
+_worker_data = {}
+
+
+@dataclass
+class CrossValidationConfig:
+    enabled: bool = os.environ.get('DIAMOND_CROSS_VALIDATION', '0') == '1'
+    n_folds: int = 5
+    n_workers: int = os.cpu_count() or 1
+    threads_per_model: int = 1
+    random_state: int = 42
+    # Seconds to wait for the next fold result, see ModelSearchConfig.result_timeout
+    result_timeout: float = float(os.environ.get('DIAMOND_MODEL_SEARCH_RESULT_TIMEOUT', 7200))
+    report_file_path: str = os.path.join('artifacts', 'model_trainer', 'cross_validation_report.json')
+
+
+def _init_worker(segment_name, n_rows, n_columns, dtype, threads_per_model):
+    limit_worker_threads(threads_per_model)
+    # Pool workers report to the parent's resource tracker, so only the parent unlinks the segment
+    segment = shared_memory.SharedMemory(name=segment_name)
+    # Layout of the segment: the train matrix (features and target) then the fold id of every row
+    data = np.ndarray((n_rows, n_columns), dtype=dtype, buffer=segment.buf)
+    folds = np.ndarray((n_rows,), dtype=np.int16, buffer=segment.buf, offset=data.nbytes)
+    data.flags.writeable = False
+    folds.flags.writeable = False
+    _worker_data.update(segment=segment, data=data, folds=folds, threads_per_model=threads_per_model)
+
+
+def _fit_fold(name, model, fold):
+    try:
+        limit_model_threads(model, _worker_data['threads_per_model'])
+        data, folds = _worker_data['data'], _worker_data['folds']
+        test_rows = folds == fold
+        # Fancy indexing copies only this fold's rows out of the shared matrix
+        train, test = data[~test_rows], data[test_rows]
+
+        start = time.perf_counter()
+        model.fit(train[:, :-1], train[:, -1])
+        fit_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        y_pred = model.predict(test[:, :-1])
+        predict_time = time.perf_counter() - start
+
+        y_true = test[:, -1]
+        residuals = y_true - y_pred
+        return {
+            'name': name,
+            'fold': fold,
+            'r2': float(1 - np.sum(residuals ** 2) / np.sum((y_true - y_true.mean()) ** 2)),
+            'rmse': float(np.sqrt(np.mean(residuals ** 2))),
+            'mae': float(np.mean(np.abs(residuals))),
+            'fit_time': fit_time,
+            'predict_time': predict_time
+        }
+    except Exception as e:
+        return {'name': name, 'fold': fold, 'error': f'{type(e).__name__}: {e}'}
+
+
+class CrossValidation:
+    def __init__(self, cross_validation_config=None):
+        """
+        CrossValidation scores every candidate with K-fold cross-validation. The training
+        matrix is copied once into shared memory and every worker process maps the same
+        read-only pages, so running the K x models fits in parallel costs one copy of the data.
+
+        :param cross_validation_config: CrossValidationConfig
+        """
+        self.cross_validation_config = cross_validation_config or CrossValidationConfig()
+
+    def _fold_ids(self, n_rows):
+        config = self.cross_validation_config
+        order = np.random.default_rng(config.random_state).permutation(n_rows)
+        folds = np.empty(n_rows, dtype=np.int16)
+        folds[order] = np.arange(n_rows) % config.n_folds
+        return folds
+
+    def evaluate(self, train_array, models):
+        """
+        evaluate runs K-fold cross-validation of every model on train_array
+        Args: train_array with the target in the last column, models dict of name -> unfitted estimator
+        Returns: report dict of name -> mean/std r2, rmse, mae and per fold results
+        Raises: DiamondException
+        """
+        try:
+            config = self.cross_validation_config
+            n_rows, n_columns = train_array.shape
+            dtype = np.dtype(train_array.dtype)
+            data_bytes = n_rows * n_columns * dtype.itemsize
+            segment = shared_memory.SharedMemory(create=True, size=data_bytes + n_rows * 2)
+            try:
+                np.ndarray((n_rows, n_columns), dtype=dtype, buffer=segment.buf)[:] = train_array
+                np.ndarray((n_rows,), dtype=np.int16, buffer=segment.buf, offset=data_bytes)[:] = self._fold_ids(n_rows)
+                tasks = [(name, model, fold) for name, model in models.items() for fold in range(config.n_folds)]
+                n_workers = max(1, min(config.n_workers, len(tasks)))
+                logging.info(f'{config.n_folds}-fold cross-validation of {len(models)} models with {n_workers} workers, '
+                             f'{data_bytes / 2 ** 20:.0f} MB shared')
+
+                results = queue.Queue()
+                pool = multiprocessing.Pool(
+                    processes=n_workers,
+                    initializer=_init_worker,
+                    initargs=(segment.name, n_rows, n_columns, dtype.str, config.threads_per_model)
+                )
+                try:
+                    for task in tasks:
+                        pool.apply_async(_fit_fold, task, callback=results.put,
+                                         error_callback=lambda e, task=task: results.put(
+                                             {'name': task[0], 'fold': task[2], 'error': str(e)}))
+                    fold_results = []
+                    for _ in tasks:
+                        try:
+                            fold_results.append(results.get(timeout=config.result_timeout))
+                        except queue.Empty:
+                            logging.warning(f'No fold result within {config.result_timeout}s, a worker may have died')
+                            break
+                    finished = {(result['name'], result['fold']) for result in fold_results}
+                    fold_results += [{'name': name, 'fold': fold, 'error': f'no result within {config.result_timeout}s'}
+                                     for name, _, fold in tasks if (name, fold) not in finished]
+                finally:
+                    pool.terminate()
+                    pool.join()
+            finally:
+                segment.close()
+                segment.unlink()
+
+            report = {}
+            for name in models:
+                folds = sorted((result for result in fold_results if result['name'] == name),
+                               key=lambda result: result['fold'])
+                errors = [result['error'] for result in folds if 'error' in result]
+                if errors:
+                    logging.warning(f'Cross-validation of {name} failed on {len(errors)} of {len(folds)} folds: {errors[0]}')
+                    report[name] = {'status': 'failed', 'error': errors[0]}
+                    continue
+                report[name] = {'status': 'completed', 'folds': folds}
+                for metric in ('r2', 'rmse', 'mae', 'fit_time', 'predict_time'):
+                    values = np.array([result[metric] for result in folds])
+                    report[name][f'{metric}_mean'] = float(values.mean())
+                    report[name][f'{metric}_std'] = float(values.std())
+                for result in folds:
+                    metrics.observe(f'cross_validation.{name}.fit', result['fit_time'])
+                    metrics.observe(f'cross_validation.{name}.predict', result['predict_time'])
+                logging.info(f'{name}: CV R2 {report[name]["r2_mean"]:.4f} +/- {report[name]["r2_std"]:.4f}, '
+                             f'RMSE {report[name]["rmse_mean"]:.2f}, MAE {report[name]["mae_mean"]:.2f}')
+
+            os.makedirs(os.path.dirname(config.report_file_path), exist_ok=True)
+            with open(config.report_file_path, 'w') as report_file:
+                json.dump(report, report_file, indent=4)
+            return report
+
+        except Exception as e:
+            logging.info('Exception occured during cross-validation')
+            raise DiamondException(e, sys)
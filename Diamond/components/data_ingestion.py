@@ -5,18 +5,45 @@ from dataclasses import dataclass
 from pathlib import Path
 from Diamond.logger import logging
 from Diamond.exception import DiamondException
+from Diamond.constants import DATASET_DTYPES, ID_COLUMN
+from Diamond.utils.artifact_store import get_artifact_store
+from Diamond.utils.instrumentation import metrics
 import sys
 import os
 
 class DataIngestionConfig:
-    def __init__(self):
+    def __init__(self, artifact_format: str = os.environ.get('DIAMOND_ARTIFACT_FORMAT', 'parquet')):
+        # Source dataset read by the ingestion stage
+        self.source_data_path: str = os.path.join('notebook', 'data', 'gemstone.csv')
+
         # Create artifact directories without timestamp
         self.artifacts_dir = os.path.join('artifacts', 'data_ingestion')
-        
+
+        # Storage format of the raw/train/test artifacts: csv, parquet or feather
+        self.artifact_format: str = artifact_format
+        self.artifact_store = get_artifact_store(artifact_format)
+
         # Define paths using the consistent directory
-        self.raw_data_path: str = os.path.join(self.artifacts_dir, 'feature_store', 'raw.csv')
-        self.train_data_path: str = os.path.join(self.artifacts_dir, 'ingested', 'train.csv')
-        self.test_data_path: str = os.path.join(self.artifacts_dir, 'ingested', 'test.csv')
+        self.raw_data_path: str = self.artifact_store.path(os.path.join(self.artifacts_dir, 'feature_store'), 'raw')
+        self.train_data_path: str = self.artifact_store.path(os.path.join(self.artifacts_dir, 'ingested'), 'train')
+        self.test_data_path: str = self.artifact_store.path(os.path.join(self.artifacts_dir, 'ingested'), 'test')
+
+        # Fraction of rows assigned to the test split
+        self.test_size: float = 0.25
+
+        # Streaming mode reads the source in chunks and splits rows by a hash of 'id',
+        # so peak memory is bounded by chunk_size instead of the dataset size
+        self.streaming: bool = os.environ.get('DIAMOND_STREAMING_INGESTION', '0') == '1'
+        self.chunk_size: int = int(os.environ.get('DIAMOND_INGESTION_CHUNK_SIZE', 1_000_000))
+
+
+def is_test_row(ids, test_size):
+    """
+    Deterministically assign rows to the test split from a hash of their id,
+    so the split does not depend on chunking or row order
+    """
+    buckets = pd.util.hash_array(np.asarray(ids)) % np.uint64(10_000)
+    return buckets < np.uint64(round(test_size * 10_000))
 
 
 class DataIngestion:
@@ -24,11 +51,14 @@ class DataIngestion:
         self.ingestion_config = DataIngestionConfig()
 
     def initiate_data_ingestion(self):
+        if self.ingestion_config.streaming:
+            return self.initiate_streaming_data_ingestion()
         logging.info('Data ingestion process has started')
         try:
             # Step 1: Read the raw data
             logging.info('Attempting to read raw data from gemstone.csv...')
-            data = pd.read_csv(Path(os.path.join('notebook/data', 'gemstone.csv')))
+            with metrics.timer('ingestion.read_csv'):
+                data = pd.read_csv(Path(self.ingestion_config.source_data_path), dtype=DATASET_DTYPES)
             logging.info(f"Successfully read raw data with {data.shape[0]} rows and {data.shape[1]} columns")
 
             # Step 2: Create directories for feature store and ingested if they don't exist
@@ -39,21 +69,21 @@ class DataIngestion:
             
             # Step 3: Save raw data to the feature store
             logging.info(f'Saving raw data to {self.ingestion_config.raw_data_path}...')
-            data.to_csv(self.ingestion_config.raw_data_path, index=False)
+            self.ingestion_config.artifact_store.write(data, self.ingestion_config.raw_data_path)
             logging.info("Raw data saved successfully to the feature store")
 
             # Step 4: Split the data into train and test sets
             logging.info("Splitting the data into train and test sets with a 75%/25% ratio...")
-            train_data, test_data = train_test_split(data, test_size=0.25, random_state=42)
+            train_data, test_data = train_test_split(data, test_size=self.ingestion_config.test_size, random_state=42)
             logging.info(f"Train set: {train_data.shape[0]} rows, Test set: {test_data.shape[0]} rows")
             
             # Step 5: Save train and test data
             logging.info(f'Saving train data to {self.ingestion_config.train_data_path}...')
-            train_data.to_csv(self.ingestion_config.train_data_path, index=False)
+            self.ingestion_config.artifact_store.write(train_data, self.ingestion_config.train_data_path)
             logging.info(f"Train data saved successfully at {self.ingestion_config.train_data_path}")
 
             logging.info(f'Saving test data to {self.ingestion_config.test_data_path}...')
-            test_data.to_csv(self.ingestion_config.test_data_path, index=False)
+            self.ingestion_config.artifact_store.write(test_data, self.ingestion_config.test_data_path)
             logging.info(f"Test data saved successfully at {self.ingestion_config.test_data_path}")
 
             logging.info('Data ingestion process completed successfully')
@@ -64,3 +94,41 @@ class DataIngestion:
         except Exception as e:
             logging.error(f"Exception occurred during data ingestion: {str(e)}")
             raise DiamondException(e, sys)
+
+    def initiate_streaming_data_ingestion(self):
+        logging.info('Streaming data ingestion process has started')
+        try:
+            config = self.ingestion_config
+            os.makedirs(os.path.dirname(config.raw_data_path), exist_ok=True)
+            os.makedirs(os.path.dirname(config.train_data_path), exist_ok=True)
+
+            raw_writer = config.artifact_store.open_writer(config.raw_data_path)
+            train_writer = config.artifact_store.open_writer(config.train_data_path)
+            test_writer = config.artifact_store.open_writer(config.test_data_path)
+            n_train = n_test = 0
+            try:
+                logging.info(f'Reading {config.source_data_path} in chunks of {config.chunk_size} rows...')
+                reader = pd.read_csv(Path(config.source_data_path), dtype=DATASET_DTYPES, chunksize=config.chunk_size)
+                for chunk in reader:
+                    metrics.increment('ingestion.rows', len(chunk))
+                    raw_writer.write(chunk)
+                    test_mask = is_test_row(chunk[ID_COLUMN], config.test_size)
+                    train_writer.write(chunk[~test_mask])
+                    test_writer.write(chunk[test_mask])
+                    n_test += int(test_mask.sum())
+                    n_train += len(chunk) - int(test_mask.sum())
+                    logging.info(f'Ingested {n_train + n_test} rows so far')
+            finally:
+                raw_writer.close()
+                train_writer.close()
+                test_writer.close()
+
+            logging.info(f"Train set: {n_train} rows, Test set: {n_test} rows")
+            logging.info('Streaming data ingestion process completed successfully')
+            return (
+                config.train_data_path,
+                config.test_data_path
+            )
+        except Exception as e:
+            logging.error(f"Exception occurred during streaming data ingestion: {str(e)}")
+            raise DiamondException(e, sys)
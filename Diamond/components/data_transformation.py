@@ -12,10 +12,24 @@ from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import OrdinalEncoder, StandardScaler
 
 from Diamond.utils import save_object
+from Diamond.utils.artifact_store import read_artifact, save_numpy_array, numpy_array_writer, load_numpy_array
+from Diamond.utils.compiled_preprocessor import compile_preprocessor
+from Diamond.utils.instrumentation import metrics
+from Diamond.constants import (NUMERICAL_COLUMNS, CATEGORICAL_COLUMNS, CUT_CATEGORIES,
+                               COLOR_CATEGORIES, CLARITY_CATEGORIES, TARGET_COLUMN, FEATURE_COLUMNS)
 
 @dataclass
 class DataTransformationConfig:
     preprocessor_obj_file_path: str = os.path.join('artifacts', 'data_transformation', "preprocessor.pkl")
+    # Transformed arrays saved as .npy so later stages can reopen them memory-mapped
+    train_array_file_path: str = os.path.join('artifacts', 'data_transformation', "train_arr.npy")
+    test_array_file_path: str = os.path.join('artifacts', 'data_transformation', "test_arr.npy")
+    # Memory-lean mode transforms in row chunks straight into the saved arrays instead of
+    # building transformed copies and concatenating the target with np.c_
+    memory_lean: bool = os.environ.get('DIAMOND_LEAN_TRANSFORMATION', '1') == '1'
+    # float32 halves the size of the arrays, float64 keeps them identical to the original mode
+    array_dtype: str = os.environ.get('DIAMOND_ARRAY_DTYPE', 'float64')
+    transform_chunk_size: int = 500_000
 
 class DataTransformation:
     def __init__(self):
@@ -32,13 +46,13 @@ class DataTransformation:
             logging.info('Data Transformation initiated')
 
             # Define which columns should be ordinal-encoded and which should be scaled
-            categorical_cols = ['cut', 'color', 'clarity']
-            numerical_cols = ['carat', 'depth', 'table', 'x', 'y', 'z']
+            categorical_cols = CATEGORICAL_COLUMNS
+            numerical_cols = NUMERICAL_COLUMNS
 
             # Define the custom ranking for each ordinal variable
-            cut_categories = ['Fair', 'Good', 'Very Good', 'Premium', 'Ideal']
-            color_categories = ['D', 'E', 'F', 'G', 'H', 'I', 'J']
-            clarity_categories = ['I1', 'SI2', 'SI1', 'VS2', 'VS1', 'VVS2', 'VVS1', 'IF']
+            cut_categories = CUT_CATEGORIES
+            color_categories = COLOR_CATEGORIES
+            clarity_categories = CLARITY_CATEGORIES
 
             logging.info('Creating numerical and categorical pipelines.')
 
@@ -71,12 +85,79 @@ class DataTransformation:
             logging.error("Exception occurred in get_data_transformation.")
             raise DiamondException(e, sys)
 
+    def _write_array(self, file_path, features, target, transform=None):
+        """
+        Write features and target into a preallocated array saved at file_path, the target
+        being the last column as in the np.c_ layout. With transform, features is the raw
+        DataFrame and is transformed chunk by chunk straight into the array.
+        Returns: the saved array reopened memory-mapped
+        """
+        config = self.data_transformation_config
+        n_features = features.shape[1]
+        with numpy_array_writer(file_path, (len(features), n_features + 1), dtype=config.array_dtype) as array:
+            if transform is None:
+                array[:, :-1] = features
+            else:
+                for start in range(0, len(features), config.transform_chunk_size):
+                    chunk = features.iloc[start:start + config.transform_chunk_size]
+                    array[start:start + len(chunk), :-1] = transform(chunk)
+            array[:, -1] = target
+        return load_numpy_array(file_path)
+
+    def initialize_lean_data_transformation(self, train_path, test_path):
+        """
+        Memory-lean variant of initialize_data_transformation: the train and test sets are
+        processed one after the other, the target is popped instead of dropping a copy of
+        the features, and the outputs are written in place into preallocated .npy buffers
+        Returns: (train_arr, test_arr) memory-mapped, features are arr[:, :-1] and the target arr[:, -1]
+        """
+        try:
+            config = self.data_transformation_config
+            columns = FEATURE_COLUMNS + [TARGET_COLUMN]
+            preprocessing_obj = self.get_data_transformation()
+
+            logging.info(f"Reading training data from: {train_path}")
+            train_df = read_artifact(train_path, columns=columns)
+            # pop removes the target without copying the feature columns
+            train_target = train_df.pop(TARGET_COLUMN).to_numpy()
+            logging.info("Fitting and transforming training features.")
+            with metrics.timer('transformation.fit_transform'):
+                # ColumnTransformer.fit computes the transformed output anyway, keep it
+                input_feature_train_arr = preprocessing_obj.fit_transform(train_df)
+            del train_df
+            train_arr = self._write_array(config.train_array_file_path, input_feature_train_arr, train_target)
+            del input_feature_train_arr, train_target
+
+            logging.info(f"Reading test data from: {test_path}")
+            test_df = read_artifact(test_path, columns=columns)
+            test_target = test_df.pop(TARGET_COLUMN).to_numpy()
+            compiled_preprocessor = compile_preprocessor(preprocessing_obj)
+            transform = compiled_preprocessor.transform if compiled_preprocessor is not None else preprocessing_obj.transform
+            logging.info("Transforming testing features.")
+            with metrics.timer('transformation.transform'):
+                test_arr = self._write_array(config.test_array_file_path, test_df, test_target, transform=transform)
+            del test_df, test_target
+
+            save_object(file_path=config.preprocessor_obj_file_path, obj=preprocessing_obj)
+            logging.info(f"Saved {train_arr.shape} train and {test_arr.shape} test arrays as {config.array_dtype}")
+            return train_arr, test_arr
+
+        except Exception as e:
+            logging.error("Exception occurred in initialize_lean_data_transformation.")
+            raise DiamondException(e, sys)
+
     def initialize_data_transformation(self, train_path, test_path):
+        if self.data_transformation_config.memory_lean:
+            return self.initialize_lean_data_transformation(train_path, test_path)
         try:
+            target_column_name = TARGET_COLUMN
+            # Only the feature and target columns are read, 'id' is never loaded
+            columns = FEATURE_COLUMNS + [target_column_name]
+
             logging.info(f"Reading training data from: {train_path}")
-            train_df = pd.read_csv(train_path)
+            train_df = read_artifact(train_path, columns=columns)
             logging.info(f"Reading test data from: {test_path}")
-            test_df = pd.read_csv(test_path)
+            test_df = read_artifact(test_path, columns=columns)
 
             logging.info("Read train and test data complete")
             logging.info(f'Train DataFrame Head:\n{train_df.head().to_string()}')
@@ -84,8 +165,7 @@ class DataTransformation:
 
             preprocessing_obj = self.get_data_transformation()
 
-            target_column_name = 'price'
-            drop_columns = [target_column_name, 'id']
+            drop_columns = [target_column_name]
 
             logging.info(f"Dropping columns: {drop_columns}")
             input_feature_train_df = train_df.drop(columns=drop_columns, axis=1)
@@ -95,9 +175,11 @@ class DataTransformation:
             target_feature_test_df = test_df[target_column_name]
 
             logging.info("Transforming training features.")
-            input_feature_train_arr = preprocessing_obj.fit_transform(input_feature_train_df)
+            with metrics.timer('transformation.fit_transform'):
+                input_feature_train_arr = preprocessing_obj.fit_transform(input_feature_train_df)
             logging.info("Transforming testing features.")
-            input_feature_test_arr = preprocessing_obj.transform(input_feature_test_df)
+            with metrics.timer('transformation.transform'):
+                input_feature_test_arr = preprocessing_obj.transform(input_feature_test_df)
 
             logging.info("Applying preprocessing object on training and testing datasets.")
 
@@ -112,6 +194,10 @@ class DataTransformation:
 
             logging.info("Preprocessing pickle file saved successfully.")
 
+            logging.info("Saving transformed train and test arrays.")
+            save_numpy_array(self.data_transformation_config.train_array_file_path, train_arr)
+            save_numpy_array(self.data_transformation_config.test_array_file_path, test_arr)
+
             return (
                 train_arr,
                 test_arr
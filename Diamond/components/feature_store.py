@@ -0,0 +1,307 @@
+import os
+import sys
+import json
+import time
+import numpy as np
+from dataclasses import dataclass
+from Diamond.exception import DiamondException
+from Diamond.logger import logging
+from Diamond.constants import ID_COLUMN, TARGET_COLUMN, FEATURE_COLUMNS, NUMERICAL_COLUMNS, CATEGORICAL_COLUMNS
+from Diamond.components.data_ingestion import is_test_row
+from Diamond.utils import load_object
+from Diamond.utils.artifact_cache import file_digest
+from Diamond.utils.artifact_store import iter_artifact, save_numpy_array, numpy_array_writer, load_numpy_array
+from Diamond.utils.compiled_preprocessor import compile_preprocessor
+from Diamond.utils.instrumentation import metrics
+
+MANIFEST_FORMAT_VERSION = 1
+
+
+@dataclass
+class FeatureStoreConfig:
+    root_dir: str = os.path.join('artifacts', 'feature_store')
+    manifest_file_path: str = os.path.join('artifacts', 'feature_store', 'manifest.json')
+    # Rows per partition, the last partition is refilled by the next append
+    partition_rows: int = int(os.environ.get('DIAMOND_FEATURE_STORE_PARTITION_ROWS', 1_000_000))
+    # Rows of the source read and transformed at a time
+    read_chunk_size: int = 500_000
+    array_dtype: str = os.environ.get('DIAMOND_ARRAY_DTYPE', 'float64')
+
+
+class FeatureStore:
+    def __init__(self, feature_store_config=None):
+        """
+        FeatureStore keeps the transformed feature matrix of the source on disk, so training
+        does not transform every row again. Rows are stored in .npy partitions laid out
+        like train_arr.npy (features then target), each with the ids of its rows, in id
+        order. manifest.json lists the partitions with their id range and column
+        statistics, the id watermark and the digest of the preprocessor the features were
+        transformed with; a different preprocessor invalidates the store.
+        Appends only transform the rows above the watermark, and train/test matrices are
+        assembled by copying from the memory-mapped partitions, split by the id hash used
+        by the streaming ingestion.
+
+        :param feature_store_config: FeatureStoreConfig
+        """
+        self.feature_store_config = feature_store_config or FeatureStoreConfig()
+
+    def _partition_path(self, file_name):
+        return os.path.join(self.feature_store_config.root_dir, 'partitions', file_name)
+
+    def read_manifest(self):
+        """
+        Return the manifest as a dict, None when the store is empty
+        """
+        if not os.path.exists(self.feature_store_config.manifest_file_path):
+            return None
+        with open(self.feature_store_config.manifest_file_path) as manifest_file:
+            return json.load(manifest_file)
+
+    def _write_manifest(self, manifest):
+        # Replaced atomically, readers see either the old or the new set of partitions
+        file_path = self.feature_store_config.manifest_file_path
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_file_path = f'{file_path}.{os.getpid()}.tmp'
+        with open(tmp_file_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(tmp_file_path, file_path)
+
+    def _new_manifest(self, preprocessor_digest):
+        return {
+            'format_version': MANIFEST_FORMAT_VERSION,
+            'preprocessor_digest': preprocessor_digest,
+            'columns': NUMERICAL_COLUMNS + CATEGORICAL_COLUMNS + [TARGET_COLUMN],
+            'dtype': self.feature_store_config.array_dtype,
+            'last_id': -1,
+            'rows': 0,
+            'next_partition': 0,
+            'partitions': []
+        }
+
+    def reset(self):
+        """
+        reset deletes the manifest and every partition
+        """
+        if os.path.exists(self.feature_store_config.manifest_file_path):
+            os.remove(self.feature_store_config.manifest_file_path)
+        partitions_dir = self._partition_path('')
+        if os.path.isdir(partitions_dir):
+            for file_name in os.listdir(partitions_dir):
+                os.remove(os.path.join(partitions_dir, file_name))
+
+    def is_current(self, preprocessor_file_path):
+        """
+        Return True when the store holds rows transformed with the preprocessor saved at preprocessor_file_path
+        """
+        manifest = self.read_manifest()
+        return (manifest is not None and os.path.exists(preprocessor_file_path)
+                and manifest['preprocessor_digest'] == file_digest(preprocessor_file_path))
+
+    def _count_missing(self, manifest, ids):
+        # ids at or below the watermark that no partition holds, partitions are sorted by id
+        # and their id ranges do not overlap
+        partitions = manifest['partitions']
+        if not partitions:
+            return len(ids)
+        index = np.searchsorted(np.array([entry['min_id'] for entry in partitions]), ids, side='right') - 1
+        missing = int((index < 0).sum())
+        for i in np.unique(index[index >= 0]):
+            candidates = ids[index == i]
+            partition_ids = load_numpy_array(self._partition_path(partitions[i]['ids_file_name']))
+            position = np.minimum(np.searchsorted(partition_ids, candidates), len(partition_ids) - 1)
+            missing += int((partition_ids[position] != candidates).sum())
+        return missing
+
+    def _open_manifest(self, preprocessor_digest):
+        manifest = self.read_manifest()
+        if manifest is not None and (manifest['preprocessor_digest'] != preprocessor_digest
+                                     or manifest['dtype'] != self.feature_store_config.array_dtype
+                                     or manifest.get('format_version') != MANIFEST_FORMAT_VERSION):
+            logging.info('Feature store was built with another preprocessor or layout, rebuilding it')
+            manifest = None
+        if manifest is None:
+            self.reset()
+            manifest = self._new_manifest(preprocessor_digest)
+        return manifest
+
+    @staticmethod
+    def _partition_statistics(array):
+        values = np.asarray(array, dtype=np.float64)
+        return {
+            'sum': values.sum(axis=0).tolist(),
+            'sum_sq': np.square(values).sum(axis=0).tolist(),
+            'min': values.min(axis=0).tolist(),
+            'max': values.max(axis=0).tolist()
+        }
+
+    def _commit_partition(self, manifest, array, ids, replaced):
+        # The partition is written before the manifest names it, a crash leaves only an orphan file
+        index = manifest['next_partition']
+        file_name, ids_file_name = f'part-{index:05d}.npy', f'part-{index:05d}.ids.npy'
+        save_numpy_array(self._partition_path(file_name), array)
+        save_numpy_array(self._partition_path(ids_file_name), ids)
+        partition = {
+            'file_name': file_name,
+            'ids_file_name': ids_file_name,
+            'rows': len(ids),
+            'min_id': int(ids.min()),
+            'max_id': int(ids.max()),
+            'statistics': self._partition_statistics(array)
+        }
+        manifest['partitions'] = [entry for entry in manifest['partitions'] if entry not in replaced] + [partition]
+        manifest['next_partition'] = index + 1
+        manifest['last_id'] = max(manifest['last_id'], partition['max_id'])
+        manifest['rows'] = sum(entry['rows'] for entry in manifest['partitions'])
+        self._write_manifest(manifest)
+        for entry in replaced:
+            os.remove(self._partition_path(entry['file_name']))
+            os.remove(self._partition_path(entry['ids_file_name']))
+
+    def append(self, batches, preprocessor, preprocessor_digest):
+        """
+        append transforms the rows above the id watermark and stores them
+        Args: batches iterable of DataFrames with the id, feature and target columns,
+              preprocessor fitted ColumnTransformer and the digest of its saved file
+        Returns: (rows appended, rows skipped because their id is at or below the watermark
+                  without being stored)
+        """
+        config = self.feature_store_config
+        manifest = self._open_manifest(preprocessor_digest)
+        compiled_preprocessor = compile_preprocessor(preprocessor)
+        transform = compiled_preprocessor.transform if compiled_preprocessor is not None else preprocessor.transform
+
+        # An underfilled last partition is merged with the new rows instead of leaving small files behind
+        pending_arrays, pending_ids, replaced = [], [], []
+        if manifest['partitions'] and manifest['partitions'][-1]['rows'] < config.partition_rows:
+            tail = manifest['partitions'][-1]
+            pending_arrays.append(load_numpy_array(self._partition_path(tail['file_name'])))
+            pending_ids.append(load_numpy_array(self._partition_path(tail['ids_file_name'])))
+            replaced.append(tail)
+        pending_rows = sum(len(ids) for ids in pending_ids)
+
+        def flush(n_rows):
+            nonlocal pending_arrays, pending_ids, pending_rows, replaced
+            array, ids = np.concatenate(pending_arrays), np.concatenate(pending_ids)
+            # batches are sorted one by one, the partition must be sorted as a whole
+            order = np.argsort(ids, kind='stable')
+            array, ids = array[order], ids[order]
+            self._commit_partition(manifest, array[:n_rows], ids[:n_rows], replaced)
+            pending_arrays, pending_ids, replaced = [array[n_rows:]], [ids[n_rows:]], []
+            pending_rows -= n_rows
+
+        appended = skipped = 0
+        for batch in batches:
+            new_rows = batch[ID_COLUMN].to_numpy() > manifest['last_id']
+            if not new_rows.all():
+                # rows behind the watermark are expected when they are stored already
+                skipped += self._count_missing(manifest, batch[ID_COLUMN].to_numpy(dtype=np.int64)[~new_rows])
+            batch = batch[new_rows]
+            if not len(batch):
+                continue
+            batch = batch.sort_values(ID_COLUMN, kind='stable')
+            array = np.empty((len(batch), len(FEATURE_COLUMNS) + 1), dtype=config.array_dtype)
+            with metrics.timer('feature_store.transform'):
+                array[:, :-1] = transform(batch[FEATURE_COLUMNS])
+            array[:, -1] = batch[TARGET_COLUMN].to_numpy()
+            pending_arrays.append(array)
+            pending_ids.append(batch[ID_COLUMN].to_numpy(dtype=np.int64))
+            pending_rows += len(batch)
+            appended += len(batch)
+            while pending_rows >= config.partition_rows:
+                flush(config.partition_rows)
+        if appended and pending_rows:
+            flush(pending_rows)
+        metrics.increment('feature_store.appended_rows', appended)
+        if skipped:
+            logging.warning(f'{skipped} source rows have an id at or below the watermark {manifest["last_id"]} '
+                            f'and are not in the feature store, they were skipped; reset the store to include them')
+            metrics.increment('feature_store.skipped_rows', skipped)
+        return appended, skipped
+
+    def update(self, source_path, preprocessor_file_path):
+        """
+        update appends the rows added to the source since the last update
+        Args: source_path csv/parquet/feather dataset, preprocessor_file_path of the fitted preprocessor
+        Returns: dict with appended_rows, skipped_rows, rows, partitions, last_id and seconds
+        Raises: DiamondException
+        """
+        try:
+            start = time.perf_counter()
+            preprocessor = load_object(preprocessor_file_path)
+            batches = iter_artifact(source_path, columns=[ID_COLUMN] + FEATURE_COLUMNS + [TARGET_COLUMN],
+                                    batch_size=self.feature_store_config.read_chunk_size)
+            appended, skipped = self.append(batches, preprocessor, file_digest(preprocessor_file_path))
+            manifest = self.read_manifest()
+            report = {
+                'appended_rows': appended,
+                'skipped_rows': skipped,
+                'rows': manifest['rows'] if manifest else 0,
+                'partitions': len(manifest['partitions']) if manifest else 0,
+                'last_id': manifest['last_id'] if manifest else -1,
+                'seconds': time.perf_counter() - start
+            }
+            logging.info(f'Feature store updated: {report}')
+            return report
+        except Exception as e:
+            logging.info('Exception occured while updating the feature store')
+            raise DiamondException(e, sys)
+
+    def assemble(self, test_size, train_array_file_path, test_array_file_path):
+        """
+        assemble writes the train and test matrices from the stored partitions, a row goes
+        to the test set when is_test_row selects its id
+        Args: test_size fraction of rows in the test set, output paths of the .npy matrices
+        Returns: (train_arr, test_arr) memory-mapped, features are arr[:, :-1] and the target arr[:, -1]
+        Raises: DiamondException
+        """
+        try:
+            manifest = self.read_manifest()
+            if manifest is None or not manifest['partitions']:
+                raise ValueError('The feature store is empty, run update first')
+            partitions = manifest['partitions']
+            test_masks = [is_test_row(load_numpy_array(self._partition_path(entry['ids_file_name'])), test_size)
+                          for entry in partitions]
+            n_test = int(sum(mask.sum() for mask in test_masks))
+            n_train = manifest['rows'] - n_test
+            n_columns = len(manifest['columns'])
+
+            with metrics.timer('feature_store.assemble'), \
+                    numpy_array_writer(train_array_file_path, (n_train, n_columns), dtype=manifest['dtype']) as train_arr, \
+                    numpy_array_writer(test_array_file_path, (n_test, n_columns), dtype=manifest['dtype']) as test_arr:
+                train_position = test_position = 0
+                for entry, test_mask in zip(partitions, test_masks):
+                    # one partition is copied at a time, memory stays bounded by partition_rows
+                    partition = load_numpy_array(self._partition_path(entry['file_name']))
+                    n_partition_test = int(test_mask.sum())
+                    test_arr[test_position:test_position + n_partition_test] = partition[test_mask]
+                    train_arr[train_position:train_position + entry['rows'] - n_partition_test] = partition[~test_mask]
+                    test_position += n_partition_test
+                    train_position += entry['rows'] - n_partition_test
+            logging.info(f'Assembled {n_train} train and {n_test} test rows from {len(partitions)} feature store partitions')
+            return load_numpy_array(train_array_file_path), load_numpy_array(test_array_file_path)
+        except Exception as e:
+            logging.info('Exception occured while assembling arrays from the feature store')
+            raise DiamondException(e, sys)
+
+    def statistics(self):
+        """
+        statistics aggregates the partition statistics of every stored column
+        Returns: dict column -> mean, std, min and max, empty when the store is empty
+        """
+        manifest = self.read_manifest()
+        if manifest is None or not manifest['partitions']:
+            return {}
+        partitions = [entry['statistics'] for entry in manifest['partitions']]
+        rows = manifest['rows']
+        total = np.sum([entry['sum'] for entry in partitions], axis=0)
+        total_sq = np.sum([entry['sum_sq'] for entry in partitions], axis=0)
+        mean = total / rows
+        std = np.sqrt(np.maximum(total_sq / rows - np.square(mean), 0.0))
+        minimum = np.min([entry['min'] for entry in partitions], axis=0)
+        maximum = np.max([entry['max'] for entry in partitions], axis=0)
+        return {
+            column: {'mean': float(mean[i]), 'std': float(std[i]), 'min': float(minimum[i]), 'max': float(maximum[i])}
+            for i, column in enumerate(manifest['columns'])
+        }
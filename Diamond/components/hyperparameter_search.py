@@ -0,0 +1,285 @@
+import os
+import sys
+import json
+import math
+import time
+import queue
+import hashlib
+import multiprocessing
+import numpy as np
+from dataclasses import dataclass, field, asdict
+from typing import List, Optional
+from Diamond.exception import DiamondException
+from Diamond.logger import logging
+from Diamond.utils.instrumentation import metrics
+from Diamond.utils.tracking import tracker
+from Diamond.components.model_search import _init_worker, _fit_candidate, wait_timeout
+
+# Search space of each ModelTrainer candidate. A list is a choice, a tuple is
+# ('uniform' | 'log_uniform' | 'int', low, high). Candidates without an entry keep their defaults.
+SEARCH_SPACES = {
+    'Lasso': {'alpha': ('log_uniform', 1e-3, 1e2)},
+    'Ridge': {'alpha': ('log_uniform', 1e-3, 1e2)},
+    'Elasticnet': {'alpha': ('log_uniform', 1e-3, 1e2), 'l1_ratio': ('uniform', 0.05, 0.95)},
+    'DecisionTree': {'max_depth': [4, 6, 8, 12, 16, None], 'min_samples_leaf': ('int', 1, 20)},
+    'RandomForest': {'n_estimators': [100, 200, 400], 'max_depth': [None, 10, 20, 30],
+                     'max_features': [1.0, 'sqrt', 0.5], 'min_samples_leaf': ('int', 1, 10)},
+    'AdaBoost': {'n_estimators': [50, 100, 200], 'learning_rate': ('log_uniform', 0.01, 1.0)},
+    'GradientBoosting': {'n_estimators': [100, 200, 400], 'learning_rate': ('log_uniform', 0.01, 0.3),
+                         'max_depth': ('int', 2, 6), 'subsample': ('uniform', 0.6, 1.0)},
+    'XGBoost': {'n_estimators': [100, 300, 600], 'learning_rate': ('log_uniform', 0.01, 0.3),
+                'max_depth': ('int', 3, 10), 'subsample': ('uniform', 0.6, 1.0),
+                'colsample_bytree': ('uniform', 0.6, 1.0), 'min_child_weight': ('log_uniform', 1.0, 20.0),
+                'reg_lambda': ('log_uniform', 1e-3, 10.0)},
+    'CatBoost': {'iterations': [300, 600, 1000], 'learning_rate': ('log_uniform', 0.01, 0.3),
+                 'depth': ('int', 4, 10), 'l2_leaf_reg': ('log_uniform', 1.0, 10.0)},
+    'KNeighbors': {'n_neighbors': ('int', 3, 30), 'weights': ['uniform', 'distance']},
+    'SGDRegressor': {'alpha': ('log_uniform', 1e-6, 1e-2), 'penalty': ['l2', 'l1', 'elasticnet']},
+}
+
+
+@dataclass
+class HyperparameterSearchConfig:
+    enabled: bool = os.environ.get('DIAMOND_HYPERPARAMETER_SEARCH', '0') == '1'
+    n_workers: int = os.cpu_count() or 1
+    threads_per_model: int = 1
+    # Hyperband: each rung keeps the best 1/eta trials and gives them eta times more rows
+    eta: int = 3
+    # Fraction of the search rows given to a trial on the lowest rung
+    min_fraction: float = 1 / 9
+    # Training rows held out to score the trials, the test set stays untouched
+    validation_fraction: float = 0.2
+    # Wall-clock budget in seconds for the whole search, None for no limit
+    time_budget: Optional[float] = None
+    # Seconds to wait for the next trial result before stopping the search, see ModelSearchConfig
+    result_timeout: float = float(os.environ.get('DIAMOND_MODEL_SEARCH_RESULT_TIMEOUT', 7200))
+    random_state: int = 42
+    candidates: Optional[List[str]] = field(default=None)
+    journal_file_path: str = os.path.join('artifacts', 'hyperparameter_search', 'trials.jsonl')
+    mlflow_experiment: str = 'hyperparameter_search'
+    log_to_mlflow: bool = True
+
+
+def sample_params(space, rng):
+    """
+    Function to draw one configuration from a search space
+
+    space: dict of parameter name -> list of choices or (kind, low, high) tuple
+    rng: numpy Generator
+
+    Returns:
+        dict: parameter values as plain Python types
+    """
+    params = {}
+    for name, spec in space.items():
+        if isinstance(spec, list):
+            value = spec[rng.integers(len(spec))]
+        elif spec[0] == 'int':
+            value = int(rng.integers(spec[1], spec[2] + 1))
+        elif spec[0] == 'log_uniform':
+            value = float(math.exp(rng.uniform(math.log(spec[1]), math.log(spec[2]))))
+        elif spec[0] == 'uniform':
+            value = float(rng.uniform(spec[1], spec[2]))
+        else:
+            raise ValueError(f'Unknown search space entry {spec!r} for {name}')
+        params[name] = value.item() if isinstance(value, np.generic) else value
+    return params
+
+
+class HyperparameterSearch:
+    def __init__(self, hyperparameter_search_config=None):
+        """
+        HyperparameterSearch tunes the ModelTrainer candidates with Hyperband: every
+        bracket starts many sampled configurations on a small subsample of the rows and
+        promotes the best 1/eta of them, across all candidates, to eta times more rows.
+        Finished trials are appended to a journal so an interrupted search resumes
+        where it stopped, and each trial is logged as an MLflow run.
+
+        :param hyperparameter_search_config: HyperparameterSearchConfig
+        """
+        self.hyperparameter_search_config = hyperparameter_search_config or HyperparameterSearchConfig()
+        self.report = {}
+
+    def _search_key(self, X_train, y_train, models):
+        # The journal is only reused for the same data, candidates and search settings
+        config = asdict(self.hyperparameter_search_config)
+        for name in ('enabled', 'n_workers', 'threads_per_model', 'time_budget', 'log_to_mlflow'):
+            config.pop(name)
+        digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode())
+        digest.update(json.dumps(sorted(models)).encode())
+        digest.update(str(X_train.shape).encode())
+        digest.update(np.ascontiguousarray(y_train).tobytes())
+        return digest.hexdigest()
+
+    def _read_journal(self, search_key):
+        journal_file_path = self.hyperparameter_search_config.journal_file_path
+        trials = {}
+        if os.path.exists(journal_file_path):
+            with open(journal_file_path) as journal:
+                lines = [json.loads(line) for line in journal if line.strip()]
+            if lines and lines[0].get('search_key') == search_key:
+                trials = {trial['trial_id']: trial for trial in lines[1:]}
+                logging.info(f'Resuming hyperparameter search, {len(trials)} trials already finished')
+                return trials
+        os.makedirs(os.path.dirname(journal_file_path), exist_ok=True)
+        with open(journal_file_path, 'w') as journal:
+            journal.write(json.dumps({'search_key': search_key}) + '\n')
+        return trials
+
+    def _append_journal(self, trial):
+        with open(self.hyperparameter_search_config.journal_file_path, 'a') as journal:
+            journal.write(json.dumps(trial) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def _log_trial(self, trial):
+        if not self.hyperparameter_search_config.log_to_mlflow:
+            return
+        # Queued for the async tracker, its own run so the active run of the process is left alone
+        run = tracker.start_run(experiment_name=self.hyperparameter_search_config.mlflow_experiment,
+                                run_name=trial['trial_id'],
+                                tags={'candidate': trial['candidate'], 'bracket': str(trial['bracket']),
+                                      'rung': str(trial['rung'])})
+        values = {'r2': trial['r2'], 'fit_time': trial.get('fit_time'), 'rows': trial['rows']}
+        tracker.log_metrics(run, {key: value for key, value in values.items() if value is not None})
+        tracker.log_params(run, trial['params'])
+        tracker.end_run(run, 'FINISHED' if trial['r2'] is not None else 'FAILED')
+
+    def _run_rung(self, pool, trials, models, rows, deadline, journal):
+        from sklearn.base import clone
+
+        results = queue.Queue()
+        pending = {}
+        for trial in trials:
+            if trial['trial_id'] in journal:
+                continue
+            # a fresh estimator per trial, the pool pickles arguments after apply_async returns
+            model = clone(models[trial['candidate']]).set_params(**trial['params'])
+            pending[trial['trial_id']] = trial
+            pool.apply_async(_fit_candidate, (trial['trial_id'], model, rows, False),
+                             callback=results.put,
+                             error_callback=lambda e, trial_id=trial['trial_id']: results.put(
+                                 {'name': trial_id, 'error': str(e)}))
+
+        while pending:
+            try:
+                result = results.get(timeout=wait_timeout(deadline, self.hyperparameter_search_config.result_timeout))
+            except queue.Empty:
+                if deadline is not None and time.monotonic() >= deadline:
+                    logging.info(f'Hyperparameter search budget exhausted with {len(pending)} trials running')
+                else:
+                    logging.warning(f'No trial result within {self.hyperparameter_search_config.result_timeout}s, '
+                                    f'stopping the search with {len(pending)} trials running')
+                return False
+            trial = dict(pending.pop(result['name']))
+            if 'error' in result:
+                logging.info(f'Trial {trial["trial_id"]} failed: {result["error"]}')
+                trial.update(r2=None, error=result['error'])
+            else:
+                trial.update(r2=result['r2'], fit_time=result['fit_time'])
+            journal[trial['trial_id']] = trial
+            self._append_journal(trial)
+            self._log_trial(trial)
+        return True
+
+    def _brackets(self):
+        config = self.hyperparameter_search_config
+        s_max = max(0, int(round(math.log(1 / config.min_fraction, config.eta))))
+        for s in range(s_max, -1, -1):
+            n_configs = int(math.ceil((s_max + 1) / (s + 1) * config.eta ** s))
+            yield s, n_configs
+
+    def tune(self, X_train, y_train, models):
+        """
+        tune searches the hyperparameters of every candidate on a validation split of
+        the training rows
+        Args: X_train, y_train, models dict of name -> unfitted estimator
+        Returns: dict of name -> unfitted estimator set to the best configuration found
+        Raises: DiamondException
+        """
+        from sklearn.base import clone
+
+        try:
+            config = self.hyperparameter_search_config
+            if config.candidates is not None:
+                models = {name: model for name, model in models.items() if name in config.candidates}
+
+            rng = np.random.default_rng(config.random_state)
+            order = rng.permutation(len(X_train))
+            n_validation = int(len(X_train) * config.validation_fraction)
+            validation_rows, search_rows = np.sort(order[:n_validation]), np.sort(order[n_validation:])
+            X_search, y_search = X_train[search_rows], y_train[search_rows]
+            X_validation, y_validation = X_train[validation_rows], y_train[validation_rows]
+
+            journal = self._read_journal(self._search_key(X_train, y_train, models))
+            deadline = None if config.time_budget is None else time.monotonic() + config.time_budget
+            n_workers = max(1, config.n_workers)
+            logging.info(f'Hyperparameter search over {len(models)} candidates with {n_workers} workers, '
+                         f'eta {config.eta}, time budget {config.time_budget}')
+
+            finished = True
+            pool = multiprocessing.Pool(
+                processes=n_workers,
+                initializer=_init_worker,
+                initargs=(X_search, y_search, X_validation, y_validation, config.threads_per_model)
+            )
+            try:
+                with metrics.timer('hyperparameter_search'):
+                    for bracket, n_configs in self._brackets():
+                        # Trials are generated from a per-bracket seed so a resumed search
+                        # recreates the same trial ids and skips those in the journal
+                        bracket_rng = np.random.default_rng([config.random_state, bracket])
+                        trials = []
+                        for name in models:
+                            space = SEARCH_SPACES.get(name, {})
+                            configurations = [{}] + [sample_params(space, bracket_rng)
+                                                     for _ in range(n_configs - 1 if space else 0)]
+                            for index, params in enumerate(configurations):
+                                trials.append({'trial_id': f'{name}-b{bracket}-{index}', 'candidate': name,
+                                               'bracket': bracket, 'params': params})
+
+                        for rung in range(bracket + 1):
+                            n_rows = max(1, int(len(X_search) * min(1.0, config.eta ** (rung - bracket))))
+                            rows = None if n_rows >= len(X_search) else np.sort(
+                                np.random.default_rng([config.random_state, bracket, rung])
+                                .choice(len(X_search), n_rows, replace=False))
+                            rung_trials = [dict(trial, trial_id=f'{trial["trial_id"]}-r{rung}', rung=rung,
+                                                rows=n_rows) for trial in trials]
+                            finished = self._run_rung(pool, rung_trials, models, rows, deadline, journal)
+                            if not finished:
+                                break
+                            # Promote the best 1/eta of the rung, whatever candidate they belong to
+                            scored = sorted(
+                                (index for index, trial in enumerate(rung_trials)
+                                 if journal[trial['trial_id']]['r2'] is not None),
+                                key=lambda index: journal[rung_trials[index]['trial_id']]['r2'], reverse=True)
+                            logging.info(f'Bracket {bracket} rung {rung}: {len(rung_trials)} trials on {n_rows} rows, '
+                                         f'best {rung_trials[scored[0]]["trial_id"] if scored else None}')
+                            trials = [trials[index] for index in scored[:max(1, len(trials) // config.eta)]]
+                        if not finished:
+                            break
+            finally:
+                pool.terminate()
+                pool.join()
+
+            tuned_models = {}
+            self.report = {}
+            for name, model in models.items():
+                # Best configuration of the candidate on the largest subsample it reached
+                candidate_trials = [trial for trial in journal.values()
+                                    if trial['candidate'] == name and trial['r2'] is not None]
+                if not candidate_trials:
+                    tuned_models[name] = model
+                    continue
+                best = max(candidate_trials, key=lambda trial: (trial['rows'], trial['r2']))
+                tuned_models[name] = clone(model).set_params(**best['params'])
+                self.report[name] = {'params': best['params'], 'validation_r2': best['r2'],
+                                     'rows': best['rows'], 'trials': len(candidate_trials)}
+                logging.info(f'{name}: best params {best["params"]}, validation R2 {best["r2"]:.4f}')
+            logging.info(f'Hyperparameter search {"finished" if finished else "stopped by the time budget"}, '
+                         f'{len(journal)} trials in {config.journal_file_path}')
+            return tuned_models
+
+        except Exception as e:
+            logging.info('Exception occured during hyperparameter search')
+            raise DiamondException(e, sys)
@@ -0,0 +1,223 @@
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from dataclasses import dataclass
+from Diamond.exception import DiamondException
+from Diamond.logger import logging
+from Diamond.constants import DATASET_DTYPES, ID_COLUMN, TARGET_COLUMN, FEATURE_COLUMNS
+from Diamond.components.data_ingestion import DataIngestionConfig, is_test_row
+from Diamond.components.data_transformation import DataTransformationConfig
+from Diamond.components.model_trainer import ModelTrainerConfig, publish_model
+from Diamond.utils import load_object
+from Diamond.utils.artifact_store import read_artifact
+
+
+# Boosting models that can continue training from their fitted state
+WARM_START_MODELS = ('XGBRegressor', 'CatBoostRegressor', 'GradientBoostingRegressor')
+
+
+@dataclass
+class IncrementalTrainerConfig:
+    state_file_path: str = os.path.join('artifacts', 'incremental', 'state.json')
+    # Boosting rounds added per incremental update
+    n_new_estimators: int = 50
+    chunk_size: int = 1_000_000
+
+
+class IncrementalTrainer:
+    """
+    IncrementalTrainer updates the best model with only the rows added to the source
+    since the last run. The source is read from the byte offset where the previous run
+    stopped, so a run costs time proportional to the delta. The preprocessor stays
+    frozen: the fitted trees and coefficients keep receiving the inputs they were
+    trained on. Boosted and SGD models continue training on the delta; other model
+    families need a full retrain, which also refits the preprocessor.
+    """
+    def __init__(self):
+        self.incremental_trainer_config = IncrementalTrainerConfig()
+        self.ingestion_config = DataIngestionConfig()
+        self.data_transformation_config = DataTransformationConfig()
+        self.model_trainer_config = ModelTrainerConfig()
+
+    def _read_state(self):
+        if os.path.exists(self.incremental_trainer_config.state_file_path):
+            with open(self.incremental_trainer_config.state_file_path) as state_file:
+                return json.load(state_file)
+        return None
+
+    def _write_state(self, state):
+        os.makedirs(os.path.dirname(self.incremental_trainer_config.state_file_path), exist_ok=True)
+        with open(self.incremental_trainer_config.state_file_path, 'w') as state_file:
+            json.dump(state, state_file, indent=4)
+
+    def reset(self):
+        """
+        reset drops the incremental state so the next run bootstraps from a full training
+        """
+        if os.path.exists(self.incremental_trainer_config.state_file_path):
+            os.remove(self.incremental_trainer_config.state_file_path)
+
+    def _bootstrap(self):
+        # First incremental run: take the id watermark from the last full training
+        logging.info('No incremental state found, bootstrapping from the ingested artifacts')
+        last_id = -1
+        for file_path in (self.ingestion_config.train_data_path, self.ingestion_config.test_data_path):
+            df = read_artifact(file_path, columns=[ID_COLUMN])
+            last_id = max(last_id, int(df[ID_COLUMN].max()))
+        return {'last_id': last_id}
+
+    @staticmethod
+    def _complete_end(source_file):
+        # End of the last complete line, a row still being appended is left for the next run
+        position = source_file.seek(0, os.SEEK_END)
+        while position > 0:
+            block_start = max(0, position - (1 << 16))
+            source_file.seek(block_start)
+            newline = source_file.read(position - block_start).rfind(b'\n')
+            if newline >= 0:
+                return block_start + newline + 1
+            position = block_start
+        return 0
+
+    @staticmethod
+    def _tail_digest(source_file, offset, size=4096):
+        # Fingerprint of the bytes before offset, detects a source rewritten since the last run
+        source_file.seek(max(0, offset - size))
+        return hashlib.sha256(source_file.read(offset - max(0, offset - size))).hexdigest()
+
+    def read_new_rows(self, last_id, source_offset=None, source_digest=None):
+        """
+        read_new_rows returns the rows with an id above the watermark. When the source is
+        a CSV still ending with the bytes seen at source_offset, only the bytes appended
+        after it are parsed; otherwise the whole source is scanned once.
+        Returns: (DataFrame of new rows, dict with the source_offset and source_digest of the next run)
+        """
+        source_path = self.ingestion_config.source_data_path
+        position = {}
+        if source_path.endswith('.csv'):
+            with open(source_path, 'rb') as source_file:
+                header = source_file.readline()
+                end = self._complete_end(source_file)
+                position = {'source_offset': end, 'source_digest': self._tail_digest(source_file, end)}
+                if (source_offset is not None and len(header) <= source_offset <= end
+                        and self._tail_digest(source_file, source_offset) == source_digest):
+                    source_file.seek(source_offset)
+                    data = source_file.read(end - source_offset)
+                    logging.info(f'Reading {len(data)} bytes appended to {source_path} after offset {source_offset}')
+                    delta = pd.read_csv(io.BytesIO(header + data), dtype=DATASET_DTYPES)
+                    return delta[delta[ID_COLUMN] > last_id].reset_index(drop=True), position
+
+        logging.info(f'Scanning the whole of {source_path} for ids above {last_id}')
+        chunks = []
+        reader = pd.read_csv(Path(source_path), dtype=DATASET_DTYPES,
+                             chunksize=self.incremental_trainer_config.chunk_size)
+        for chunk in reader:
+            chunk = chunk[chunk[ID_COLUMN] > last_id]
+            if len(chunk):
+                chunks.append(chunk)
+        if not chunks:
+            return pd.DataFrame(columns=list(DATASET_DTYPES)), position
+        return pd.concat(chunks, ignore_index=True), position
+
+    @staticmethod
+    def can_warm_start(model):
+        return type(model).__name__ in WARM_START_MODELS or hasattr(model, 'partial_fit')
+
+    def warm_start(self, model, X, y):
+        """
+        warm_start continues training model on X, y, see can_warm_start
+        Returns: updated model
+        """
+        model_type = type(model).__name__
+        n_new = self.incremental_trainer_config.n_new_estimators
+        if model_type == 'XGBRegressor':
+            model.set_params(n_estimators=n_new)
+            model.fit(X, y, xgb_model=model.get_booster())
+            # n_estimators reports every round of the booster, old and new
+            model.set_params(n_estimators=model.get_booster().num_boosted_rounds())
+            return model
+        if model_type == 'CatBoostRegressor':
+            updated = model.copy()
+            updated.set_params(iterations=n_new)
+            updated.fit(X, y, init_model=model)
+            updated.set_params(iterations=updated.tree_count_)
+            return updated
+        if model_type == 'GradientBoostingRegressor':
+            model.set_params(warm_start=True, n_estimators=model.n_estimators_ + n_new)
+            model.fit(X, y)
+            return model
+        if hasattr(model, 'partial_fit'):
+            # SGD-style linear models
+            model.partial_fit(X, y)
+            return model
+        raise ValueError(f'{model_type} cannot be warm-started')
+
+    def initiate_incremental_training(self):
+        """
+        initiate_incremental_training updates the model with the new rows
+        Returns: dict describing the update, with mode 'incremental', 'noop' or 'full_retrain_required'
+        Raises: DiamondException
+        """
+        try:
+            start = time.perf_counter()
+            state = self._read_state() or self._bootstrap()
+            delta, position = self.read_new_rows(state['last_id'], state.get('source_offset'),
+                                                 state.get('source_digest'))
+            logging.info(f'Found {len(delta)} new rows since id {state["last_id"]}')
+            if delta.empty:
+                state.update(position)
+                self._write_state(state)
+                return {'mode': 'noop', 'rows': 0}
+
+            model = load_object(self.model_trainer_config.trained_model_file_path)
+            test_mask = is_test_row(delta[ID_COLUMN], self.ingestion_config.test_size)
+            delta_train, delta_test = delta[~test_mask], delta[test_mask]
+            if len(delta_train) and not self.can_warm_start(model):
+                logging.info(f'{type(model).__name__} cannot be warm-started, a full retrain is required')
+                return {'mode': 'full_retrain_required', 'rows': len(delta), 'model': type(model).__name__}
+
+            # frozen, refitting it would change the inputs of the already fitted model
+            preprocessor = load_object(self.data_transformation_config.preprocessor_obj_file_path)
+            report = {'mode': 'incremental', 'rows': len(delta), 'model': type(model).__name__}
+            if len(delta_train):
+                X_train = preprocessor.transform(delta_train[FEATURE_COLUMNS])
+                y_train = delta_train[TARGET_COLUMN].to_numpy()
+                model = self.warm_start(model, X_train, y_train)
+                logging.info(f'{type(model).__name__} updated with {len(delta_train)} rows')
+            else:
+                # every new row falls in the test split, the model is kept and only the watermark moves
+                logging.info('No new training rows, the model is not updated')
+                report['mode'] = 'noop'
+
+            if len(delta_test):
+                from sklearn.metrics import r2_score
+                prediction = model.predict(preprocessor.transform(delta_test[FEATURE_COLUMNS]))
+                report['delta_test_r2'] = float(r2_score(delta_test[TARGET_COLUMN], prediction))
+
+            if len(delta_train):
+                # the updated model reaches serving through a new registry version like a full retrain
+                report['model_version'] = publish_model(
+                    model=model,
+                    preprocessor_path=self.data_transformation_config.preprocessor_obj_file_path,
+                    metadata={'model_name': type(model).__name__, 'r2': report.get('delta_test_r2'),
+                              'mode': 'incremental'},
+                    X_check=X_train[:self.model_trainer_config.export_parity_rows],
+                    model_trainer_config=self.model_trainer_config
+                )
+            state['last_id'] = int(np.max(delta[ID_COLUMN]))
+            state.update(position)
+            self._write_state(state)
+
+            report['seconds'] = time.perf_counter() - start
+            logging.info(f'Incremental training report: {report}')
+            return report
+
+        except Exception as e:
+            logging.info('Exception occured during incremental training')
+            raise DiamondException(e, sys)
@@ -1,11 +1,10 @@
 import os
 import sys
-from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 from urllib.parse import urlparse
-import mlflow
-import mlflow.sklearn
 import numpy as np
 from Diamond.utils import load_object
+from Diamond.utils.instrumentation import metrics
+from Diamond.utils.tracking import tracker
 from Diamond.exception import DiamondException
 import logging
 
@@ -17,19 +16,26 @@ class ModelEvaluation:
         pass
     
     def eval_metrics(self, actual, predicted):
+        from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+
         rmse = np.sqrt(mean_squared_error(actual, predicted))
         mae = mean_absolute_error(actual, predicted)
         r2 = r2_score(actual, predicted)
         return rmse, mae, r2
     
-    def initiate_model_evaluation(self, train_array, test_array):
+    def initiate_model_evaluation(self, train_array, test_array, model_path=None):
+        """
+        initiate_model_evaluation scores the saved model on the test set and records the
+        run in MLflow through the async tracker, the pipeline does not wait for the writes
+        model_path: model to score, the registry version just trained; artifacts/model_trainer/model.pkl by default
+        """
         try:
             # Log the shapes of train and test arrays
             logging.info("Train array shape: %s", train_array.shape)
             logging.info("Test array shape: %s", test_array.shape)
 
             X_test, y_test = test_array[:, :-1], test_array[:, -1]
-            model_path = os.path.join("artifacts", "model_trainer", "model.pkl")
+            model_path = model_path or os.path.join("artifacts", "model_trainer", "model.pkl")
             model = load_object(file_path=model_path)
             logging.info("Model has been loaded successfully from %s.", model_path)
 
@@ -37,34 +43,30 @@ class ModelEvaluation:
             if hasattr(model, 'get_params'):
                 params = model.get_params()
                 logging.info("Model parameters: %s", params)
-            
-            # Check if there's an active MLflow run and end it
-            active_run = mlflow.active_run()
-            if active_run is not None:
-                logging.warning("Ending active run with ID: %s", active_run.info.run_id)
-                mlflow.end_run()
-            
-            # Start a new MLflow run
-            with mlflow.start_run():
+
+            run = tracker.start_run(run_name='model_evaluation', tags={'model': type(model).__name__})
+            with metrics.timer('evaluation.predict'):
                 prediction = model.predict(X_test)
 
-                # Log predictions and their shape
-                logging.info("Predictions made for test data. Shape of predictions: %s", prediction.shape)
-                logging.info("Predictions: %s", prediction[:10])  # Log the first 10 predictions
+            # Log predictions and their shape
+            logging.info("Predictions made for test data. Shape of predictions: %s", prediction.shape)
+            logging.info("Predictions: %s", prediction[:10])  # Log the first 10 predictions
+
+            rmse, mae, r2 = self.eval_metrics(y_test, prediction)
+            logging.info("Computed metrics: RMSE: %f, MAE: %f, R^2: %f", rmse, mae, r2)
 
-                rmse, mae, r2 = self.eval_metrics(y_test, prediction)
-                logging.info("Computed metrics: RMSE: %f, MAE: %f, R^2: %f", rmse, mae, r2)
+            tracker.log_metrics(run, {'rmse': rmse, 'r2': r2})
+            tracker.log_params(run, {'mae': mae})
 
-                mlflow.log_metric('rmse', rmse)
-                mlflow.log_metric('r2', r2)
-                mlflow.log_param('mae', mae)
+            # Stage and step timings collected by Diamond.utils.instrumentation
+            tracker.log_metrics(run, metrics.as_mlflow_metrics())
 
-                tracking_url_type_store = urlparse(mlflow.get_artifact_uri()).scheme
-                if tracking_url_type_store != 'file':
-                    mlflow.sklearn.log_model(model, 'model', registered_model_name='Diamond')
-                else:
-                    mlflow.sklearn.log_model(model, 'model')
-                logging.info("Model and metrics logged successfully.")
+            # Only a tracking server has a model registry, the local mlruns file store does not
+            tracking_url_type_store = urlparse(os.environ.get('MLFLOW_TRACKING_URI', 'file:')).scheme
+            tracker.log_model(run, model, 'model',
+                              registered_model_name=None if tracking_url_type_store in ('', 'file') else 'Diamond')
+            tracker.end_run(run)
+            logging.info("Model and metrics queued for MLflow.")
 
         except Exception as e:
             logging.error("Error occurred during model evaluation: %s", str(e))
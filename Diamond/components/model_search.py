@@ -0,0 +1,207 @@
+import os
+import sys
+import time
+import queue
+import multiprocessing
+import numpy as np
+from dataclasses import dataclass, field
+from typing import List, Optional
+from Diamond.exception import DiamondException
+from Diamond.logger import logging
+from Diamond.utils.instrumentation import metrics
+
+# Estimator parameters that control the number of threads a single fit may use
+THREAD_PARAMS = ('n_jobs', 'thread_count', 'nthread')
+# Thread parameter of the model libraries whose get_params omits parameters left at their
+# default, CatBoostRegressor(verbose=False).get_params() has no thread_count
+THREAD_PARAMS_BY_TYPE = {
+    'CatBoostRegressor': 'thread_count',
+    'CatBoostClassifier': 'thread_count',
+    'XGBRegressor': 'n_jobs',
+    'XGBClassifier': 'n_jobs',
+    'LGBMRegressor': 'n_jobs',
+}
+
+# Arrays shared with the worker processes through the pool initializer
+_worker_data = {}
+
+
+@dataclass
+class ModelSearchConfig:
+    n_workers: int = os.cpu_count() or 1
+    threads_per_model: int = 1
+    # Wall-clock budget in seconds for the whole search, None for no limit
+    time_budget: Optional[float] = None
+    # Fraction of the training rows used to screen candidates before the full fit
+    screening_fraction: float = 0.2
+    # Candidates whose screening R2 is further than this behind the leader are dropped
+    screening_margin: float = 0.05
+    # Screening is skipped when the subsample would be smaller than this
+    screening_min_rows: int = 1000
+    candidates: Optional[List[str]] = field(default=None)
+    # Seconds to wait for the next result before giving up on the running fits, a worker
+    # killed by the OS never reports back
+    result_timeout: float = float(os.environ.get('DIAMOND_MODEL_SEARCH_RESULT_TIMEOUT', 7200))
+
+
+def limit_model_threads(model, n_threads):
+    """
+    Set every thread parameter of model to n_threads, so parallel fits do not oversubscribe the CPU
+    """
+    params = model.get_params()
+    limits = {param: n_threads for param in THREAD_PARAMS if param in params}
+    if type(model).__name__ in THREAD_PARAMS_BY_TYPE:
+        limits[THREAD_PARAMS_BY_TYPE[type(model).__name__]] = n_threads
+    if limits:
+        model.set_params(**limits)
+    return model
+
+
+def wait_timeout(deadline, result_timeout):
+    """
+    Seconds to wait for the next pool result, bounded by the budget deadline and result_timeout
+    """
+    if deadline is None:
+        return result_timeout
+    return max(min(deadline - time.monotonic(), result_timeout), 0)
+
+
+def limit_worker_threads(threads_per_model):
+    """
+    Limit the OpenMP/BLAS thread pools of a pool worker, so parallel fits do not oversubscribe the cores
+    """
+    for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[var] = str(threads_per_model)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(threads_per_model)
+    except ImportError:
+        pass
+
+
+def _init_worker(X_train, y_train, X_test, y_test, threads_per_model):
+    limit_worker_threads(threads_per_model)
+    _worker_data.update(X_train=X_train, y_train=y_train, X_test=X_test, y_test=y_test,
+                        threads_per_model=threads_per_model)
+
+
+def _fit_candidate(name, model, rows, return_model):
+    from sklearn.metrics import r2_score
+
+    try:
+        limit_model_threads(model, _worker_data['threads_per_model'])
+
+        X_train, y_train = _worker_data['X_train'], _worker_data['y_train']
+        if rows is not None:
+            X_train, y_train = X_train[rows], y_train[rows]
+
+        start = time.perf_counter()
+        model.fit(X_train, y_train)
+        fit_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        y_test_pred = model.predict(_worker_data['X_test'])
+        predict_time = time.perf_counter() - start
+
+        return {
+            'name': name,
+            'r2': float(r2_score(_worker_data['y_test'], y_test_pred)),
+            'fit_time': fit_time,
+            'predict_time': predict_time,
+            'model': model if return_model else None
+        }
+    except Exception as e:
+        return {'name': name, 'error': f'{type(e).__name__}: {e}'}
+
+
+class ModelSearch:
+    def __init__(self, model_search_config=None):
+        self.model_search_config = model_search_config or ModelSearchConfig()
+
+    def _run_round(self, pool, models, rows, return_model, deadline, report, round_name):
+        results = queue.Queue()
+        for name, model in models.items():
+            pool.apply_async(_fit_candidate, (name, model, rows, return_model),
+                             callback=results.put,
+                             error_callback=lambda e, name=name: results.put({'name': name, 'error': str(e)}))
+
+        finished = {}
+        while len(finished) < len(models):
+            try:
+                result = results.get(timeout=wait_timeout(deadline, self.model_search_config.result_timeout))
+            except queue.Empty:
+                break
+            name = result['name']
+            finished[name] = result
+            if 'error' in result:
+                logging.info(f'{round_name}: {name} failed: {result["error"]}')
+                report[name] = {'status': 'failed', 'error': result['error']}
+            else:
+                # Fits run in worker processes, their timings are recorded here in the parent
+                metric_prefix = f'model_search.{round_name.lower().replace(" ", "_")}.{name}'
+                metrics.observe(f'{metric_prefix}.fit', result['fit_time'])
+                metrics.observe(f'{metric_prefix}.predict', result['predict_time'])
+                logging.info(f'{round_name}: {name} R2 {result["r2"]:.4f}, '
+                             f'fit {result["fit_time"]:.2f}s, predict {result["predict_time"]:.2f}s')
+        for name in models:
+            if name not in finished:
+                logging.warning(f'{round_name}: {name} did not finish within the time budget '
+                                f'or result_timeout, its worker may have died')
+                report[name] = {'status': 'timeout'}
+        return {name: result for name, result in finished.items() if 'error' not in result}
+
+    def search(self, X_train, y_train, X_test, y_test, models):
+        """
+        search fits every candidate in a process pool and scores it on the test set
+        Args: X_train, y_train, X_test, y_test, models dict of name -> unfitted estimator
+        Returns: (report dict of name -> r2/fit_time/predict_time/status, dict of fitted models)
+        Raises: DiamondException
+        """
+        try:
+            config = self.model_search_config
+            if config.candidates is not None:
+                models = {name: model for name, model in models.items() if name in config.candidates}
+
+            deadline = None if config.time_budget is None else time.monotonic() + config.time_budget
+            n_workers = max(1, min(config.n_workers, len(models)))
+            logging.info(f'Model search over {len(models)} candidates with {n_workers} workers, '
+                         f'{config.threads_per_model} threads per model, time budget {config.time_budget}')
+
+            report = {}
+            fitted_models = {}
+            pool = multiprocessing.Pool(
+                processes=n_workers,
+                initializer=_init_worker,
+                initargs=(X_train, y_train, X_test, y_test, config.threads_per_model)
+            )
+            try:
+                # Round 1: screen candidates on a subsample and drop the clear losers
+                n_screen = int(len(X_train) * config.screening_fraction)
+                if len(models) > 1 and config.screening_fraction < 1 and n_screen >= config.screening_min_rows:
+                    rows = np.sort(np.random.default_rng(42).choice(len(X_train), n_screen, replace=False))
+                    screened = self._run_round(pool, models, rows, False, deadline, report, 'Screening')
+                    if screened:
+                        leader = max(result['r2'] for result in screened.values())
+                        for name, result in screened.items():
+                            if result['r2'] < leader - config.screening_margin:
+                                logging.info(f'Dropping {name}: screening R2 {result["r2"]:.4f} vs leader {leader:.4f}')
+                                report[name] = {'status': 'dropped', 'screening_r2': result['r2'],
+                                                'fit_time': result['fit_time'], 'predict_time': result['predict_time']}
+                    models = {name: models[name] for name in screened if name not in report}
+
+                # Round 2: full fit of the remaining candidates
+                finished = self._run_round(pool, models, None, True, deadline, report, 'Full fit')
+                for name, result in finished.items():
+                    fitted_models[name] = result['model']
+                    report[name] = {'status': 'completed', 'r2': result['r2'],
+                                    'fit_time': result['fit_time'], 'predict_time': result['predict_time']}
+            finally:
+                # terminate also stops fits still running when the budget ran out
+                pool.terminate()
+                pool.join()
+
+            return report, fitted_models
+
+        except Exception as e:
+            logging.info('Exception occured during model search')
+            raise DiamondException(e, sys)
@@ -1,23 +1,122 @@
 import os
 import sys
+import json
+import shutil
+import tempfile
 from Diamond.exception import DiamondException
 from Diamond.logger import logging
 from dataclasses import dataclass
-from Diamond.utils import save_object,evaluate_model
-from sklearn.linear_model import LinearRegression,Ridge,Lasso,ElasticNet
-from sklearn.tree import DecisionTreeRegressor
-from catboost import CatBoostRegressor
-from sklearn.neighbors import KNeighborsRegressor
-from sklearn.ensemble import RandomForestRegressor,AdaBoostRegressor,GradientBoostingRegressor 
-from xgboost import XGBRegressor
+from Diamond.utils import save_object,load_object
+from Diamond.utils.model_export import export_inference_artifacts
+from Diamond.utils.model_registry import ModelRegistry
+from Diamond.components.data_transformation import DataTransformationConfig
+from Diamond.components.model_search import ModelSearch,ModelSearchConfig
+from Diamond.components.hyperparameter_search import HyperparameterSearch,HyperparameterSearchConfig
+from Diamond.components.cross_validation import CrossValidation,CrossValidationConfig
+
+
+def get_models():
+    """
+    get_models returns the candidate regressors, the model libraries are imported
+    here so only training pays for loading catboost and xgboost
+    """
+    from sklearn.linear_model import LinearRegression,Ridge,Lasso,ElasticNet,SGDRegressor
+    from sklearn.tree import DecisionTreeRegressor
+    from catboost import CatBoostRegressor
+    from sklearn.neighbors import KNeighborsRegressor
+    from sklearn.ensemble import RandomForestRegressor,AdaBoostRegressor,GradientBoostingRegressor
+    from xgboost import XGBRegressor
+
+    return {
+        'LinearRegression':LinearRegression(),
+        'Lasso':Lasso(),
+        'Ridge':Ridge(),
+        'Elasticnet':ElasticNet(),
+        'DecisionTree':DecisionTreeRegressor(),
+        'RandomForest':RandomForestRegressor(),
+        'AdaBoost':AdaBoostRegressor(),
+        'GradientBoosting':GradientBoostingRegressor(),
+        'XGBoost':XGBRegressor(),
+        'CatBoost':CatBoostRegressor(verbose=False),
+        'KNeighbors':KNeighborsRegressor(),
+        'SGDRegressor':SGDRegressor(random_state=42)
+    }
+
+
+def publish_file(source_path,file_path):
+    """
+    publish_file copies source_path to file_path through a temporary file, so serving
+    processes never read a partially copied artifact
+    """
+    os.makedirs(os.path.dirname(file_path),exist_ok=True)
+    tmp_file_path = f'{file_path}.{os.getpid()}.tmp'
+    shutil.copyfile(source_path,tmp_file_path)
+    os.replace(tmp_file_path,file_path)
+
+
+def publish_model(model,preprocessor_path,metadata,X_check,model_trainer_config=None,model_registry=None):
+    """
+    publish_model makes a trained model servable, shared by every trainer: model.pkl and
+    the compact export replace the unversioned artifacts, and the model is stored with
+    its preprocessor as a new registry version that is activated or made the candidate
+    following registry_activation
+    Args: fitted model, preprocessor_path of the preprocessor it was trained with, registry
+          metadata, X_check transformed rows for the export parity check
+    Returns: registry version, None when the registry is disabled
+    """
+    config = model_trainer_config or ModelTrainerConfig()
+    with tempfile.TemporaryDirectory() as staging_dir:
+        model_path = os.path.join(staging_dir,'model.pkl')
+        export_path = os.path.join(staging_dir,'model_export.pkl')
+        save_object(file_path=model_path,obj=model)
+        exported = export_inference_artifacts(
+            model=model,
+            preprocessor=load_object(preprocessor_path),
+            file_path=export_path,
+            X_check=X_check
+        )
+        publish_file(model_path,config.trained_model_file_path)
+        if exported:
+            publish_file(export_path,config.exported_model_file_path)
+        elif os.path.exists(config.exported_model_file_path):
+            os.remove(config.exported_model_file_path)
+        logging.info(f'{config.trained_model_file_path} published')
+
+        if not config.register_model:
+            return None
+        registry = model_registry or ModelRegistry()
+        files = {'model.pkl':model_path,'preprocessor.pkl':preprocessor_path}
+        if exported:
+            files['model_export.pkl'] = export_path
+        version = registry.register(files,metadata=metadata)
+        if config.registry_activation == 'active' or registry.active_version() is None:
+            registry.activate(version)
+        else:
+            registry.set_candidate(version)
+        return version
 
 
 @dataclass
 class ModelTrainerConfig:
     trained_model_file_path = os.path.join('artifacts','model_trainer','model.pkl')
+    model_report_file_path = os.path.join('artifacts','model_trainer','model_report.json')
+    # compact NumPy form of the preprocessor and the best model, served by PredictPipeline
+    exported_model_file_path = os.path.join('artifacts','model_trainer','model_export.pkl')
+    export_parity_rows = 10000
+    # every trained model is also stored as an immutable version of the model registry
+    register_model = os.environ.get('DIAMOND_MODEL_REGISTRY','1') == '1'
+    # 'candidate' scores a new version in shadow next to the active one, 'active' serves it at once
+    registry_activation = os.environ.get('DIAMOND_REGISTRY_ACTIVATION','candidate')
 class ModelTrainer:
-    def __init__(self):
+    def __init__(self,model_search_config=None,hyperparameter_search_config=None,cross_validation_config=None):
         self.model_trainer_config = ModelTrainerConfig()
+        self.model_search = ModelSearch(model_search_config or ModelSearchConfig())
+        self.hyperparameter_search = HyperparameterSearch(hyperparameter_search_config or HyperparameterSearchConfig())
+        self.cross_validation = CrossValidation(cross_validation_config or CrossValidationConfig())
+        self.model_registry = ModelRegistry()
+        self.model_report = {}
+        # registry version of the last trained model, None when the registry is disabled
+        self.model_version = None
         
     def initiate_model_trainer(self,train_array, test_array):
         try:
@@ -28,33 +127,56 @@ class ModelTrainer:
                 test_array[:,:-1],
                 test_array[:,-1]
             )
-            models = {
-                'LinearRegression':LinearRegression(),
-                'Lasso':Lasso(),
-                'Ridge':Ridge(),
-                'Elasticnet':ElasticNet(),
-                'DecisionTree':DecisionTreeRegressor(),
-                'RandomForest':RandomForestRegressor(),
-                'AdaBoost':AdaBoostRegressor(),
-                'GradientBoosting':GradientBoostingRegressor(),
-                'XGBoost':XGBRegressor(),
-                'CatBoost':CatBoostRegressor(verbose=False),
-                'KNeighbors':KNeighborsRegressor()
-            }
-            model_report = evaluate_model(X_train=X_train,y_train=y_train,X_test=X_test,y_test=y_test,models=models)
+            models = get_models()
+            if self.hyperparameter_search.hyperparameter_search_config.enabled:
+                # tuned configurations replace the default ones, the test set is not used for tuning
+                models = self.hyperparameter_search.tune(X_train=X_train,y_train=y_train,models=models)
+            cross_validation_report = {}
+            if self.cross_validation.cross_validation_config.enabled:
+                cross_validation_report = self.cross_validation.evaluate(train_array=train_array,models=models)
+            model_report,fitted_models = self.model_search.search(X_train=X_train,y_train=y_train,X_test=X_test,y_test=y_test,models=models)
+            for name,tuning in self.hyperparameter_search.report.items():
+                if name in model_report:
+                    model_report[name]['tuning'] = tuning
+            for name,result in cross_validation_report.items():
+                if name in model_report:
+                    model_report[name]['cross_validation'] = {key:value for key,value in result.items() if key != 'folds'}
+            self.model_report = model_report
+            for name,result in model_report.items():
+                logging.info(f'{name}: {result}')
+            os.makedirs(os.path.dirname(self.model_trainer_config.model_report_file_path),exist_ok=True)
+            with open(self.model_trainer_config.model_report_file_path,'w') as report_file:
+                json.dump(model_report,report_file,indent=4)
+            if not fitted_models:
+                raise Exception('No candidate model finished training')
             ## To get best model score from each model
-            best_model_score = max(sorted(model_report.values()))
-            best_model_name = list(model_report.keys())[
-                list(model_report.values()).index(best_model_score)
-            ]
-            best_model = models[best_model_name]
-            logging.info(f'Best model found, Model Name: {best_model_name}, R2 Score: {best_model_score}')
-            logging.info(f'Checking if {os.path.exists(self.model_trainer_config.trained_model_file_path)}')
-            if not os.path.exists(self.model_trainer_config.trained_model_file_path):
-                logging.info(f'{self.model_trainer_config.trained_model_file_path} created')
-                save_object(file_path=self.model_trainer_config.trained_model_file_path,obj=best_model)
+            cross_validated = [name for name in fitted_models if cross_validation_report.get(name,{}).get('status') == 'completed']
+            if cross_validated and len(cross_validated) < len(fitted_models):
+                excluded = sorted(set(fitted_models) - set(cross_validated))
+                logging.warning(f'Cross-validation failed for {excluded}, they are excluded from the model selection '
+                                f'(see cross_validation in {self.model_trainer_config.model_report_file_path})')
+            if cross_validated:
+                # the mean fold R2 is a steadier ranking than a single test split
+                best_model_name = max(cross_validated,key=lambda name:cross_validation_report[name]['r2_mean'])
+                best_model_score = cross_validation_report[best_model_name]['r2_mean']
             else:
-                logging.info(f'{self.model_trainer_config.trained_model_file_path} is already present')
+                best_model_name = max(fitted_models,key=lambda name:model_report[name]['r2'])
+                best_model_score = model_report[best_model_name]['r2']
+            best_model = fitted_models[best_model_name]
+            logging.info(f'Best model found, Model Name: {best_model_name}, R2 Score: {best_model_score}')
+            self.model_version = publish_model(
+                model=best_model,
+                preprocessor_path=DataTransformationConfig().preprocessor_obj_file_path,
+                metadata={
+                    'model_name':best_model_name,
+                    'r2':model_report[best_model_name]['r2'],
+                    'cross_validation_r2':cross_validation_report.get(best_model_name,{}).get('r2_mean')
+                },
+                X_check=X_test[:self.model_trainer_config.export_parity_rows],
+                model_trainer_config=self.model_trainer_config,
+                model_registry=self.model_registry
+            )
+            return self.model_version
 
         except Exception as e:
             logging.info('Exception occured during model training')
@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import shutil
+import numpy as np
+from dataclasses import dataclass, field
+from typing import List
+from Diamond.exception import DiamondException
+from Diamond.logger import logging
+from Diamond.constants import NUMERICAL_COLUMNS, CATEGORICAL_COLUMNS, FEATURE_COLUMNS, TARGET_COLUMN
+from Diamond.components.data_transformation import DataTransformation, DataTransformationConfig
+from Diamond.components.model_trainer import ModelTrainerConfig, publish_model
+from Diamond.utils import save_object
+from Diamond.utils.artifact_store import iter_artifact, numpy_array_writer, load_numpy_array
+from Diamond.utils.compiled_preprocessor import compile_preprocessor
+from Diamond.utils.instrumentation import metrics
+from Diamond.utils.streaming_stats import StreamingPreprocessorStatistics
+
+# Candidates that can learn from mini-batches without holding X_train in memory
+OUT_OF_CORE_MODELS = ('SGDRegressor', 'XGBoost')
+
+
+@dataclass
+class OutOfCoreTrainerConfig:
+    batch_size: int = int(os.environ.get('DIAMOND_OUT_OF_CORE_BATCH_SIZE', 100_000))
+    candidates: List[str] = field(default_factory=lambda: list(OUT_OF_CORE_MODELS))
+    # Passes of SGDRegressor.partial_fit over the training batches
+    sgd_epochs: int = 5
+    xgboost_rounds: int = 200
+    xgboost_params: dict = field(default_factory=lambda: {
+        'objective': 'reg:squarederror', 'tree_method': 'hist', 'max_depth': 6, 'eta': 0.1
+    })
+    # XGBoost external memory pages are written here and removed after training
+    cache_dir: str = os.path.join('artifacts', 'out_of_core', 'xgboost_cache')
+    report_file_path: str = os.path.join('artifacts', 'out_of_core', 'report.json')
+    random_state: int = 42
+
+
+def iter_array_batches(array, batch_size, order=None):
+    """
+    Yield (X, y) mini-batches of a memory-mapped train/test array, batches in the given order
+    """
+    n_batches = int(np.ceil(len(array) / batch_size))
+    for index in (range(n_batches) if order is None else order):
+        batch = np.asarray(array[index * batch_size:(index + 1) * batch_size], dtype=np.float64)
+        yield batch[:, :-1], batch[:, -1]
+
+
+class OutOfCoreTrainer:
+    def __init__(self, out_of_core_trainer_config=None):
+        """
+        OutOfCoreTrainer trains on datasets larger than memory. The preprocessor is fitted
+        from streamed batches, the transformed rows are written to memory-mapped .npy
+        files, and the incremental candidates learn from mini-batches read back from them,
+        so resident memory is bounded by the batch size rather than the dataset size.
+
+        :param out_of_core_trainer_config: OutOfCoreTrainerConfig
+        """
+        self.out_of_core_trainer_config = out_of_core_trainer_config or OutOfCoreTrainerConfig()
+        self.data_transformation_config = DataTransformationConfig()
+        self.model_trainer_config = ModelTrainerConfig()
+
+    def _batches(self, file_path, columns):
+        return iter_artifact(file_path, columns=columns, batch_size=self.out_of_core_trainer_config.batch_size)
+
+    def _count_rows(self, file_path):
+        return sum(len(batch) for batch in self._batches(file_path, [TARGET_COLUMN]))
+
+    def fit_preprocessor(self, train_path):
+        """
+        fit_preprocessor fits the DataTransformation preprocessor with two passes over the
+        training batches: exact value counts for the imputers, then StandardScaler.partial_fit
+        Returns: fitted ColumnTransformer
+        """
+        statistics = StreamingPreprocessorStatistics(NUMERICAL_COLUMNS, CATEGORICAL_COLUMNS)
+        first_batch = None
+        for batch in self._batches(train_path, FEATURE_COLUMNS):
+            statistics.update(batch)
+            if first_batch is None:
+                first_batch = batch
+
+        # Fitting on the first batch only builds the fitted structure, every statistic is replaced below
+        preprocessor = DataTransformation().get_data_transformation().fit(first_batch)
+        statistics.reset_scalers(preprocessor)
+        for batch in self._batches(train_path, FEATURE_COLUMNS):
+            statistics.update_preprocessor(preprocessor, batch)
+        logging.info(f'Preprocessor fitted out-of-core on {statistics.n_rows} rows')
+        return preprocessor
+
+    def transform_to_array(self, preprocessor, file_path, array_file_path):
+        """
+        transform_to_array writes the transformed features and the target of an artifact
+        batch by batch into a memory-mapped .npy array laid out like DataTransformation's
+        Returns: the array reopened memory-mapped
+        """
+        compiled_preprocessor = compile_preprocessor(preprocessor)
+        transform = compiled_preprocessor.transform if compiled_preprocessor is not None else preprocessor.transform
+        n_rows = self._count_rows(file_path)
+        shape = (n_rows, len(preprocessor.get_feature_names_out()) + 1)
+        with numpy_array_writer(array_file_path, shape, dtype=self.data_transformation_config.array_dtype) as array:
+            start = 0
+            for batch in self._batches(file_path, FEATURE_COLUMNS + [TARGET_COLUMN]):
+                stop = start + len(batch)
+                array[start:stop, -1] = batch.pop(TARGET_COLUMN).to_numpy()
+                array[start:stop, :-1] = transform(batch)
+                start = stop
+        return load_numpy_array(array_file_path)
+
+    def initiate_out_of_core_transformation(self, train_path, test_path):
+        """
+        initiate_out_of_core_transformation produces the same preprocessor.pkl, train_arr.npy
+        and test_arr.npy as DataTransformation without loading the datasets
+        Returns: (train_arr, test_arr) memory-mapped
+        """
+        try:
+            config = self.data_transformation_config
+            with metrics.timer('out_of_core.fit_preprocessor'):
+                preprocessor = self.fit_preprocessor(train_path)
+            with metrics.timer('out_of_core.transform'):
+                train_arr = self.transform_to_array(preprocessor, train_path, config.train_array_file_path)
+                test_arr = self.transform_to_array(preprocessor, test_path, config.test_array_file_path)
+            save_object(file_path=config.preprocessor_obj_file_path, obj=preprocessor)
+            return train_arr, test_arr
+        except Exception as e:
+            logging.info('Exception occured during out-of-core transformation')
+            raise DiamondException(e, sys)
+
+    def _train_sgd(self, train_arr):
+        from sklearn.linear_model import SGDRegressor
+
+        config = self.out_of_core_trainer_config
+        model = SGDRegressor(random_state=config.random_state)
+        rng = np.random.default_rng(config.random_state)
+        n_batches = int(np.ceil(len(train_arr) / config.batch_size))
+        for epoch in range(config.sgd_epochs):
+            for X, y in iter_array_batches(train_arr, config.batch_size, order=rng.permutation(n_batches)):
+                model.partial_fit(X, y)
+        return model
+
+    def _train_xgboost(self, train_arr):
+        import xgboost
+        from xgboost import XGBRegressor
+
+        config = self.out_of_core_trainer_config
+
+        class ArrayBatchIterator(xgboost.DataIter):
+            # XGBoost pulls the batches itself and keeps its external memory pages on disk
+            def __init__(self):
+                self.batches = None
+                super().__init__(cache_prefix=os.path.join(config.cache_dir, 'train'))
+
+            def next(self, input_data):
+                if self.batches is None:
+                    self.batches = iter_array_batches(train_arr, config.batch_size)
+                batch = next(self.batches, None)
+                if batch is None:
+                    return False
+                input_data(data=batch[0], label=batch[1])
+                return True
+
+            def reset(self):
+                self.batches = None
+
+        os.makedirs(config.cache_dir, exist_ok=True)
+        try:
+            dtrain = xgboost.DMatrix(ArrayBatchIterator())
+            booster = xgboost.train(dict(config.xgboost_params, seed=config.random_state), dtrain,
+                                    num_boost_round=config.xgboost_rounds)
+            # release the cache pages before their directory is removed
+            del dtrain
+        finally:
+            shutil.rmtree(config.cache_dir, ignore_errors=True)
+        # Load the booster into the sklearn wrapper so serving and export see the usual model
+        model = XGBRegressor()
+        model.load_model(bytearray(booster.save_raw(raw_format='ubj')))
+        return model
+
+    def score(self, model, test_arr):
+        """
+        score computes the test R2 batch by batch
+        """
+        batch_size = self.out_of_core_trainer_config.batch_size
+        n, total, total_squares, residual_squares = 0, 0.0, 0.0, 0.0
+        for X, y in iter_array_batches(test_arr, batch_size):
+            residual_squares += float(np.sum((y - model.predict(X)) ** 2))
+            n += len(y)
+            total += float(np.sum(y))
+            total_squares += float(np.sum(y ** 2))
+        return 1 - residual_squares / (total_squares - total ** 2 / n)
+
+    def initiate_out_of_core_training(self, train_arr, test_arr):
+        """
+        initiate_out_of_core_training fits the incremental candidates from mini-batches,
+        scores them on the test batches and saves the best one like ModelTrainer
+        Returns: report dict of name -> r2/fit_time
+        """
+        try:
+            config = self.out_of_core_trainer_config
+            trainers = {'SGDRegressor': self._train_sgd, 'XGBoost': self._train_xgboost}
+            report, fitted_models = {}, {}
+            for name in config.candidates:
+                if name not in trainers:
+                    logging.info(f'{name} has no out-of-core training path, skipped')
+                    report[name] = {'status': 'unsupported'}
+                    continue
+                start = time.perf_counter()
+                with metrics.timer(f'out_of_core.fit.{name}'):
+                    model = trainers[name](train_arr)
+                fit_time = time.perf_counter() - start
+                r2 = self.score(model, test_arr)
+                fitted_models[name] = model
+                report[name] = {'status': 'completed', 'r2': r2, 'fit_time': fit_time}
+                logging.info(f'{name}: out-of-core R2 {r2:.4f}, fit {fit_time:.2f}s')
+
+            os.makedirs(os.path.dirname(config.report_file_path), exist_ok=True)
+            with open(config.report_file_path, 'w') as report_file:
+                json.dump(report, report_file, indent=4)
+            if not fitted_models:
+                raise Exception('No out-of-core candidate finished training')
+
+            best_model_name = max(fitted_models, key=lambda name: report[name]['r2'])
+            best_model = fitted_models[best_model_name]
+            logging.info(f'Best out-of-core model: {best_model_name}, R2 {report[best_model_name]["r2"]:.4f}')
+            report['model_version'] = publish_model(
+                model=best_model,
+                preprocessor_path=self.data_transformation_config.preprocessor_obj_file_path,
+                metadata={'model_name': best_model_name, 'r2': report[best_model_name]['r2'],
+                          'mode': 'out_of_core'},
+                X_check=np.asarray(test_arr[:self.model_trainer_config.export_parity_rows, :-1]),
+                model_trainer_config=self.model_trainer_config
+            )
+            return report
+        except Exception as e:
+            logging.info('Exception occured during out-of-core training')
+            raise DiamondException(e, sys)
@@ -0,0 +1,43 @@
+# Column layout of the gemstone dataset
+ID_COLUMN = 'id'
+TARGET_COLUMN = 'price'
+NUMERICAL_COLUMNS = ['carat', 'depth', 'table', 'x', 'y', 'z']
+CATEGORICAL_COLUMNS = ['cut', 'color', 'clarity']
+FEATURE_COLUMNS = NUMERICAL_COLUMNS + CATEGORICAL_COLUMNS
+
+# Custom ranking for each ordinal variable
+CUT_CATEGORIES = ['Fair', 'Good', 'Very Good', 'Premium', 'Ideal']
+COLOR_CATEGORIES = ['D', 'E', 'F', 'G', 'H', 'I', 'J']
+CLARITY_CATEGORIES = ['I1', 'SI2', 'SI1', 'VS2', 'VS1', 'VVS2', 'VVS1', 'IF']
+
+CATEGORIES = {
+    'cut': CUT_CATEGORIES,
+    'color': COLOR_CATEGORIES,
+    'clarity': CLARITY_CATEGORIES
+}
+
+# Accepted (min, max) of each numerical feature for prediction inputs, both inclusive.
+# depth and table are percentages, x/y/z are millimetres
+NUMERICAL_RANGES = {
+    'carat': (0.01, 10.0),
+    'depth': (0.0, 100.0),
+    'table': (0.0, 100.0),
+    'x': (0.0, 60.0),
+    'y': (0.0, 60.0),
+    'z': (0.0, 60.0)
+}
+
+# Explicit dtypes used when the dataset is stored as an artifact
+DATASET_DTYPES = {
+    'id': 'int64',
+    'carat': 'float64',
+    'cut': 'category',
+    'color': 'category',
+    'clarity': 'category',
+    'depth': 'float64',
+    'table': 'float64',
+    'x': 'float64',
+    'y': 'float64',
+    'z': 'float64',
+    'price': 'float64'
+}
@@ -1,6 +1,10 @@
 import os
 import sys
+import queue
+import atexit
 import logging
+import threading
+import logging.handlers
 from datetime import datetime
 
 # Define the log format
@@ -9,24 +13,103 @@ logging_str = "[%(asctime)s: %(levelname)s: %(module)s]: %(message)s]"
 # Define the log directory
 log_dir = 'logs'
 
-# Generate a timestamp for the log file name
-timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-# Create the log file path with the timestamp
-log_filepath = os.path.join(log_dir, f'Diamond_{timestamp}.log')
+# One log file per process group: the first process picks the file name and exports it,
+# so forked or spawned workers (gunicorn, multiprocessing pools) append to the same sink
+# instead of opening a new timestamped file at every import
+log_filepath = os.environ.get('DIAMOND_LOG_FILE')
+if log_filepath is None:
+    # Generate a timestamp for the log file name
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    process_group = os.getpgid(0) if hasattr(os, 'getpgid') else os.getpid()
+    log_filepath = os.path.join(log_dir, f'Diamond_{timestamp}_{process_group}.log')
+    os.environ['DIAMOND_LOG_FILE'] = log_filepath
 
 # Create the log directory if it doesn't exist
-os.makedirs(log_dir, exist_ok=True)
-
-# Configure the logging settings
-logging.basicConfig(
-    level=logging.INFO,
-    format=logging_str,
-    handlers=[
-        logging.FileHandler(log_filepath),   # Log to file
-        logging.StreamHandler(sys.stdout)    # Log to console
-    ]
-)
+os.makedirs(os.path.dirname(log_filepath) or '.', exist_ok=True)
+
+# Records are written by a background thread unless DIAMOND_LOG_ASYNC=0
+async_logging = os.environ.get('DIAMOND_LOG_ASYNC', '1') == '1'
+
+handlers = [
+    logging.FileHandler(log_filepath),   # Log to file
+    logging.StreamHandler(sys.stdout)    # Log to console
+]
+
+queue_listener = None
+
+if async_logging:
+    formatter = logging.Formatter(logging_str)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+
+    def _start_listener():
+        global queue_listener
+        queue_listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        queue_listener.start()
+
+    def _restart_listener_after_fork():
+        # The writer thread does not survive fork, give the child its own queue and thread
+        queue_handler.queue = queue.SimpleQueue()
+        _start_listener()
+
+    def _stop_listener():
+        # Flush every queued record before the interpreter exits, stop() may only run once per start()
+        global queue_listener
+        if queue_listener is not None:
+            queue_listener.stop()
+            queue_listener = None
+
+    _start_listener()
+    atexit.register(_stop_listener)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_restart_listener_after_fork)
+
+    # Configure the logging settings, records are formatted by the handlers behind the queue
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(message)s",
+        handlers=[queue_handler]
+    )
+else:
+    # Configure the logging settings
+    logging.basicConfig(
+        level=logging.INFO,
+        format=logging_str,
+        handlers=handlers
+    )
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, sample_every):
+        """
+        SamplingFilter lets one record in sample_every through for each message template,
+        used for messages emitted on every request
+
+        :param sample_every: keep one record out of this many
+        """
+        super().__init__()
+        self.sample_every = max(1, sample_every)
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        with self._lock:
+            seen = self._seen.get(record.msg, 0)
+            self._seen[record.msg] = seen + 1
+        if seen % self.sample_every:
+            return False
+        if self.sample_every > 1:
+            record.msg = f'{record.msg} (sampled 1/{self.sample_every}, {seen + 1} so far)'
+        return True
+
 
 # Create a logger instance
 logger = logging.getLogger('Diamond')
+
+# Logger for messages on the prediction hot path, sampled to keep logging out of request latency
+hot_path_logger = logging.getLogger('Diamond.hot_path')
+hot_path_logger.addFilter(SamplingFilter(int(os.environ.get('DIAMOND_LOG_SAMPLE_EVERY', 1000))))
@@ -0,0 +1,154 @@
+import os
+import sys
+import time
+import multiprocessing
+import pandas as pd
+from collections import deque
+from dataclasses import dataclass
+from Diamond.exception import DiamondException
+from Diamond.logger import logging
+from Diamond.constants import FEATURE_COLUMNS, NUMERICAL_COLUMNS
+from Diamond.utils.artifact_store import iter_artifact, get_artifact_store_for_path
+from Diamond.utils.instrumentation import metrics
+from Diamond.pipelines.prediction_pipeline import PredictPipeline, preload_inference_artifacts
+
+# PredictPipeline of the worker process, created once by the pool initializer
+_worker_pipeline = None
+
+
+@dataclass
+class BatchPredictionConfig:
+    chunk_size: int = int(os.environ.get('DIAMOND_BATCH_CHUNK_SIZE', 100_000))
+    n_workers: int = int(os.environ.get('DIAMOND_BATCH_WORKERS', os.cpu_count() or 1))
+    # Chunks submitted ahead of the writer, bounds memory to a few chunks per worker
+    max_pending_per_worker: int = 2
+    prediction_column: str = 'prediction'
+    # Validation message of rows that were not scored, their prediction is NaN
+    error_column: str = 'prediction_error'
+    # Log progress every this many rows
+    log_every: int = 1_000_000
+    # Seconds to wait for a chunk, a worker killed mid-chunk (e.g. out of memory) never returns it
+    result_timeout: float = float(os.environ.get('DIAMOND_BATCH_RESULT_TIMEOUT', 3600))
+
+
+def _init_worker():
+    global _worker_pipeline
+    preload_inference_artifacts()
+    _worker_pipeline = PredictPipeline()
+
+
+def _predict_chunk(chunk):
+    return _worker_pipeline.predict_validated(chunk[FEATURE_COLUMNS])
+
+
+class _InlinePool:
+    # Same interface as the apply_async results used below, for n_workers <= 1
+    class _Result:
+        def __init__(self, value):
+            self.value = value
+
+        def get(self, timeout=None):
+            return self.value
+
+    def apply_async(self, func, args):
+        return self._Result(func(*args))
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class BatchPredictionPipeline:
+    def __init__(self, batch_prediction_config=None):
+        """
+        BatchPredictionPipeline scores a whole CSV/Parquet/Feather file. The input is streamed
+        in chunks that are fanned out to a process pool, each worker loading the inference
+        artifacts once, and the predictions are appended to the output in input order.
+        Rows failing validation get a NaN prediction and an error message instead of
+        aborting the file.
+        Only max_pending_per_worker chunks per worker are in flight, so files larger than
+        memory are scored with bounded memory.
+
+        :param batch_prediction_config: BatchPredictionConfig
+        """
+        self.batch_prediction_config = batch_prediction_config or BatchPredictionConfig()
+
+    def _open_pool(self):
+        n_workers = self.batch_prediction_config.n_workers
+        if n_workers <= 1:
+            _init_worker()
+            return _InlinePool()
+        # Loaded before forking so the workers share the artifact pages copy-on-write
+        preload_inference_artifacts()
+        return multiprocessing.Pool(processes=n_workers, initializer=_init_worker)
+
+    def predict_file(self, input_path, output_path):
+        """
+        predict_file writes the rows of input_path with an extra prediction column to output_path
+        Args: input_path and output_path of csv, parquet or feather files, formats taken from the extension
+        Returns: dict with rows, seconds and rows_per_second
+        Raises: DiamondException
+        """
+        try:
+            config = self.batch_prediction_config
+            output_store = get_artifact_store_for_path(output_path)
+            if os.path.dirname(output_path):
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            # Written next to the destination and moved into place once complete
+            tmp_path = f'{output_path}.tmp'
+            writer = output_store.open_writer(tmp_path)
+
+            max_pending = max(1, config.n_workers) * config.max_pending_per_worker
+            pending = deque()
+            rows = 0
+            next_log = config.log_every
+            start = time.perf_counter()
+
+            def write_oldest():
+                nonlocal rows, next_log
+                chunk, result = pending.popleft()
+                try:
+                    predictions, errors = result.get(timeout=config.result_timeout)
+                except multiprocessing.TimeoutError:
+                    raise TimeoutError(f'No predictions for the chunk after row {rows} within '
+                                       f'{config.result_timeout}s, its worker may have died') from None
+                # Malformed numbers were reported by the validator, written as NaN so the column stays numeric
+                for column in NUMERICAL_COLUMNS:
+                    chunk[column] = pd.to_numeric(chunk[column], errors='coerce')
+                chunk[config.prediction_column] = predictions
+                # string dtype keeps the column type stable in parquet/feather when a chunk has no errors
+                chunk[config.error_column] = pd.array(errors, dtype='string')
+                writer.write(chunk)
+                rows += len(chunk)
+                metrics.increment('batch_predict.rows', len(chunk))
+                if rows >= next_log:
+                    elapsed = time.perf_counter() - start
+                    logging.info(f'Batch prediction: {rows} rows scored, {rows / elapsed:.0f} rows/s')
+                    next_log += config.log_every
+
+            pool = self._open_pool()
+            try:
+                for chunk in iter_artifact(input_path, batch_size=config.chunk_size, dtypes=False):
+                    pending.append((chunk, pool.apply_async(_predict_chunk, (chunk,))))
+                    if len(pending) >= max_pending:
+                        write_oldest()
+                while pending:
+                    write_oldest()
+            finally:
+                pool.terminate()
+                pool.join()
+                writer.close()
+
+            os.replace(tmp_path, output_path)
+            seconds = time.perf_counter() - start
+            summary = {'rows': rows, 'seconds': seconds, 'rows_per_second': rows / seconds if seconds else 0.0}
+            logging.info(f'Batch prediction of {input_path} written to {output_path}: {rows} rows in '
+                         f'{seconds:.1f}s, {summary["rows_per_second"]:.0f} rows/s')
+            return summary
+        except Exception as e:
+            logging.info('Exception occured during batch prediction')
+            if 'tmp_path' in locals() and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise DiamondException(e, sys)
@@ -0,0 +1,100 @@
+import sys
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from Diamond.exception import DiamondException
+from Diamond.logger import logging
+from Diamond.constants import FEATURE_COLUMNS
+from Diamond.utils.instrumentation import metrics
+
+
+class MicroBatcher:
+    def __init__(self, predict_pipeline, max_batch_size=64, max_wait_ms=5.0, executor=None):
+        """
+        MicroBatcher collects single-row predictions from concurrent requests and
+        scores them with one vectorized PredictPipeline.predict call in a worker thread.
+
+        :param predict_pipeline: PredictPipeline instance
+        :param max_batch_size: flush the batch as soon as it holds this many rows
+        :param max_wait_ms: longest time the first row of a batch waits for company
+        :param executor: executor running predict, a single thread by default
+        """
+        self.predict_pipeline = predict_pipeline
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix='micro_batcher')
+        self._queue = None
+        self._task = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logging.info(f'Micro-batcher started, max batch {self.max_batch_size} rows, max wait {self.max_wait * 1000:.1f} ms')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.executor.shutdown(wait=True)
+
+    async def predict(self, row):
+        """
+        predict queues one diamond and waits for its price
+        Args: row dict with the FEATURE_COLUMNS of one diamond
+        Returns: predicted price
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _predict_rows(self, rows):
+        columns = {column: [row[column] for row in rows] for column in FEATURE_COLUMNS}
+        return self.predict_pipeline.predict(columns, shadow=True)
+
+    async def _score(self, batch):
+        loop = asyncio.get_running_loop()
+        rows = [row for row, _ in batch]
+        metrics.increment('micro_batcher.batches')
+        metrics.increment('micro_batcher.rows', len(rows))
+        try:
+            predictions = await loop.run_in_executor(self.executor, self._predict_rows, rows)
+            for (_, future), prediction in zip(batch, predictions):
+                if not future.done():
+                    future.set_result(float(prediction))
+        except Exception:
+            # One bad row must not fail its neighbours, score the batch row by row
+            for row, future in batch:
+                try:
+                    prediction = await loop.run_in_executor(self.executor, self._predict_rows, [row])
+                    if not future.done():
+                        future.set_result(float(prediction[0]))
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _run(self):
+        try:
+            while True:
+                batch = await self._collect()
+                await self._score(batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f'Micro-batcher stopped: {e}')
+            raise DiamondException(e, sys)
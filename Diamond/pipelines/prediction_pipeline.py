@@ -1,24 +1,297 @@
 import os
 import sys
+import time
+import threading
 from Diamond.exception import DiamondException
-from Diamond.logger import logging
-import pandas as pd
-from Diamond.utils import load_object
+from Diamond.logger import logging, hot_path_logger
+from Diamond.constants import FEATURE_COLUMNS
+from Diamond.utils.artifact_cache import ArtifactCache
+from Diamond.utils.compiled_preprocessor import compile_preprocessor
+from Diamond.utils.instrumentation import metrics
+from Diamond.utils.model_registry import ModelRegistry
+from Diamond.utils.validation import validator
+from Diamond.pipelines.shadow_scorer import ShadowScorer
+from Diamond.utils.prediction_cache import PredictionCache, SqlitePredictionStore
+
+_artifact_caches = {}
+_artifact_cache_lock = threading.Lock()
+_prediction_cache = None
+_model_registry = None
+_shadow_scorer = None
+
+PREPROCESSOR_FILE_PATH = os.path.join("artifacts","data_transformation","preprocessor.pkl")
+MODEL_FILE_PATH = os.path.join("artifacts","model_trainer","model.pkl")
+EXPORTED_MODEL_FILE_PATH = os.path.join("artifacts","model_trainer","model_export.pkl")
+
+
+def load_inference_artifacts(preprocessor, model):
+    """
+    Loader used by the artifact cache, compiles the preprocessor once per model version
+    Returns: (preprocessor, compiled_preprocessor or None, model)
+    """
+    return preprocessor, compile_preprocessor(preprocessor), model
+
+
+def load_exported_artifacts(exported):
+    """
+    Loader for the compact export written by ModelTrainer, which needs neither sklearn
+    nor the model library
+    Returns: (None, compiled_preprocessor, exported_model)
+    """
+    return None, exported['preprocessor'], exported['model']
+
+
+def get_model_registry():
+    """
+    Return the process wide model registry, or None when DIAMOND_MODEL_REGISTRY=0.
+    Serving follows the registry's active version and falls back to the artifacts
+    written directly by ModelTrainer when no version is active.
+    """
+    global _model_registry
+    if os.environ.get('DIAMOND_MODEL_REGISTRY', '1') != '1':
+        return None
+    if _model_registry is None:
+        with _artifact_cache_lock:
+            if _model_registry is None:
+                _model_registry = ModelRegistry()
+    return _model_registry
+
+
+def get_version_artifact_cache(version):
+    """
+    Return the cache holding the preprocessor and the model of a registry version, or of
+    the unversioned artifacts when version is None. The compact export is served when it
+    exists, unless DIAMOND_USE_MODEL_EXPORT=0.
+    """
+    if version is None:
+        preprocessor_path, model_path, export_path = PREPROCESSOR_FILE_PATH, MODEL_FILE_PATH, EXPORTED_MODEL_FILE_PATH
+    else:
+        registry = get_model_registry()
+        preprocessor_path, model_path, export_path = (
+            registry.path(version, file_name) for file_name in ('preprocessor.pkl', 'model.pkl', 'model_export.pkl')
+        )
+    use_export = (os.environ.get('DIAMOND_USE_MODEL_EXPORT', '1') == '1'
+                  and os.path.exists(export_path))
+    key = ('export' if use_export else 'pickle', version)
+    if key not in _artifact_caches:
+        with _artifact_cache_lock:
+            if key not in _artifact_caches:
+                # the other mode of the same version is not served any more
+                _artifact_caches.pop(('pickle' if use_export else 'export', version), None)
+                if use_export:
+                    _artifact_caches[key] = ArtifactCache(
+                        file_paths=[export_path],
+                        loader=load_exported_artifacts
+                    )
+                else:
+                    _artifact_caches[key] = ArtifactCache(
+                        file_paths=[preprocessor_path, model_path],
+                        loader=load_inference_artifacts
+                    )
+                # versions that are neither active nor candidate any more are released
+                registry = get_model_registry()
+                if registry is not None:
+                    live = {None, version, registry.active_version(), registry.candidate_version()}
+                    for stale in [stale for stale in _artifact_caches if stale[1] not in live]:
+                        del _artifact_caches[stale]
+    return _artifact_caches[key]
+
+
+def get_version_artifacts(version):
+    """
+    Return (artifacts, cache version) of a registry version, or of the unversioned artifacts
+    when version is None. ModelTrainer removes model_export.pkl when the new best model cannot
+    be exported; if that happens after the export cache was picked, the pickles are served.
+    """
+    cache = get_version_artifact_cache(version)
+    try:
+        return cache.get_versioned()
+    except DiamondException:
+        if all(os.path.exists(file_path) for file_path in cache.file_paths):
+            raise
+        return get_version_artifact_cache(version).get_versioned()
+
+
+def get_active_version():
+    registry = get_model_registry()
+    return registry.active_version() if registry is not None else None
+
+
+def get_artifact_cache():
+    """
+    Return the process wide cache holding the preprocessor and the model that are served
+    """
+    return get_version_artifact_cache(get_active_version())
+
+
+def predict_with_artifacts(artifacts, features, codes=None):
+    """
+    Score features with (preprocessor, compiled_preprocessor or None, model) artifacts.
+    codes are the validator's ordinal codes of features, reused by the compiled
+    preprocessor when its encoder has the same label order.
+    """
+    preprocessor, compiled_preprocessor, model = artifacts
+    with metrics.timer('predict.transform'):
+        if compiled_preprocessor is not None:
+            if codes is not None and not compiled_preprocessor.encodes_like(validator.categories):
+                codes = None
+            data_scaled = compiled_preprocessor.transform(features, codes=codes)
+        else:
+            import pandas as pd
+            if not isinstance(features, pd.DataFrame):
+                features = pd.DataFrame(features)
+            data_scaled = preprocessor.transform(features)
+    with metrics.timer('predict.model'):
+        return model.predict(data_scaled)
+
+
+def predict_with_version(version, features):
+    return predict_with_artifacts(get_version_artifacts(version)[0], features)
+
+
+def get_shadow_scorer():
+    """
+    Return the process wide shadow scorer, or None unless DIAMOND_SHADOW_SAMPLE_RATE is
+    above 0. A sampled fraction of live predictions is replayed on the registry's
+    candidate version in a background thread.
+    """
+    global _shadow_scorer
+    sample_rate = float(os.environ.get('DIAMOND_SHADOW_SAMPLE_RATE', 0))
+    registry = get_model_registry()
+    if sample_rate <= 0 or registry is None:
+        return None
+    if _shadow_scorer is None:
+        with _artifact_cache_lock:
+            if _shadow_scorer is None:
+                _shadow_scorer = ShadowScorer(registry, predict_with_version, sample_rate)
+    return _shadow_scorer
+
+
+def preload_inference_artifacts():
+    """
+    Load the preprocessor and the model into the process wide cache ahead of the first
+    request. Called in the serving master before forking so every worker shares the
+    same pages copy-on-write instead of unpickling its own copy.
+    Returns: version of the loaded artifacts
+    """
+    try:
+        _, version = get_version_artifacts(get_active_version())
+        logging.info(f'Inference artifacts preloaded, version {version}')
+        if get_shadow_scorer() is not None and get_model_registry().candidate_version() is not None:
+            # the shadow thread would otherwise pay for loading the candidate on its first sample
+            get_version_artifacts(get_model_registry().candidate_version())
+        return version
+    except Exception as e:
+        raise DiamondException(e, sys)
+
+
+def get_prediction_cache():
+    """
+    Return the process wide prediction cache, or None when DIAMOND_PREDICTION_CACHE_SIZE is 0.
+    DIAMOND_PREDICTION_CACHE_PATH enables a SQLite file shared by the workers on the host,
+    holding at most DIAMOND_PREDICTION_CACHE_SHARED_SIZE rows.
+    """
+    global _prediction_cache
+    max_entries = int(os.environ.get('DIAMOND_PREDICTION_CACHE_SIZE', 100_000))
+    if max_entries <= 0:
+        return None
+    if _prediction_cache is None:
+        with _artifact_cache_lock:
+            if _prediction_cache is None:
+                shared_path = os.environ.get('DIAMOND_PREDICTION_CACHE_PATH')
+                shared_store = None
+                if shared_path:
+                    shared_store = SqlitePredictionStore(
+                        shared_path,
+                        max_entries=int(os.environ.get('DIAMOND_PREDICTION_CACHE_SHARED_SIZE', 1_000_000))
+                    )
+                _prediction_cache = PredictionCache(
+                    max_entries=max_entries,
+                    ttl_seconds=float(os.environ.get('DIAMOND_PREDICTION_CACHE_TTL', 3600)),
+                    shared_store=shared_store
+                )
+    return _prediction_cache
+
 
 class PredictPipeline:
     def __init__(self):
-        pass
-    def predict(self,features):
+        self.prediction_cache = get_prediction_cache()
+        self.shadow_scorer = get_shadow_scorer()
+
+    @property
+    def artifact_cache(self):
+        # resolved on every call so a switch of the registry's active version is picked up
+        return get_artifact_cache()
+
+    def predict(self,features,shadow=False,codes=None):
+        """
+        predict scores features given as a DataFrame or as a dict of column lists
+        (see DiamondData.get_data_as_dict). The compiled preprocessor is used when
+        available and produces the same values as the sklearn ColumnTransformer.
+        Live traffic passes shadow=True so a sample of it is replayed on the candidate model.
+        Validated batches pass their ValidationResult codes so labels are encoded once.
+        """
         try:
-            preprocessor_path = os.path.join("artifacts","data_transformation","preprocessor.pkl")
-            model_path = os.path.join("artifacts","model_trainer","model.pkl")
-            preprocessor = load_object(preprocessor_path)
-            model = load_object(model_path)
-            data_scaled = preprocessor.transform(features)
-            pred = model.predict(data_scaled)
+            version = get_active_version()
+            start = time.perf_counter()
+            pred = predict_with_artifacts(get_version_artifacts(version)[0], features, codes=codes)
+            if shadow and self.shadow_scorer is not None:
+                self.shadow_scorer.submit(version, features, pred, time.perf_counter() - start)
+            metrics.increment('predict.rows', len(pred))
             return pred
         except Exception as e:
             raise DiamondException(e, sys)
+
+    def predict_validated(self,features,shadow=False):
+        """
+        predict_validated checks the batch with the vectorized validator and scores only
+        its valid rows, so bad rows never abort the batch
+        Args: features DataFrame or dict of column lists
+        Returns: (predictions array with NaN for invalid rows, list of error messages with None for valid rows)
+        """
+        try:
+            import numpy as np
+
+            result = validator.validate(features)
+            invalid_rows = len(result) - int(result.valid.sum())
+            hot_path_logger.info('Batch validated with %d rows, %d invalid', len(result), invalid_rows)
+            predictions = np.full(len(result), np.nan)
+            if result.valid.any():
+                predictions[result.valid] = self.predict(result.valid_features(),shadow=shadow,
+                                                         codes=result.valid_codes())
+            metrics.increment('predict.invalid_rows', invalid_rows)
+            return predictions, result.errors
+        except Exception as e:
+            raise DiamondException(e, sys)
+
+    def predict_data(self,data):
+        """
+        predict_data returns the price of one DiamondData, served from the prediction
+        cache when the same rounded features were scored by the current model version
+        """
+        try:
+            if self.prediction_cache is None:
+                return float(self.predict(data.get_data_as_dict(),shadow=True)[0])
+            key = data.cache_key()
+            _, version = get_version_artifacts(get_active_version())
+            price = self.prediction_cache.get(version, key)
+            if price is None:
+                price = float(self.predict(data.get_data_as_dict(),shadow=True)[0])
+                self.prediction_cache.put(version, key, price)
+            return price
+        except Exception as e:
+            raise DiamondException(e, sys)
+
+    def cache_stats(self):
+        stats = self.artifact_cache.stats()
+        if self.prediction_cache is not None:
+            stats['predictions'] = self.prediction_cache.stats()
+        registry = get_model_registry()
+        if registry is not None:
+            stats['model_version'] = registry.active_version()
+        if self.shadow_scorer is not None:
+            stats['shadow'] = self.shadow_scorer.stats()
+        return stats
         
 
 class DiamondData:
@@ -42,7 +315,36 @@ class DiamondData:
         self.color = color
         self.clarity = clarity
 
+    def cache_key(self):
+        """
+        cache_key returns the feature tuple of the diamond built from exactly the values
+        that are scored: numbers as the float64 the preprocessor sees and labels unchanged,
+        so an input that would fail, like ' Ideal', never hits the entry of a valid one
+        """
+        numbers = tuple(float(value) for value in (self.carat, self.depth, self.table, self.x, self.y, self.z))
+        labels = (self.cut, self.color, self.clarity)
+        return numbers + labels
+
+    def get_data_as_dict(self):
+        """
+        get_data_as_dict returns the diamond as a dict of single element lists,
+        accepted directly by PredictPipeline.predict without building a DataFrame
+        """
+        return {
+            "carat": [self.carat],
+            "depth": [self.depth],
+            "table": [self.table],
+            "x": [self.x],
+            "y": [self.y],
+            "z": [self.z],
+            "cut": [self.cut],
+            "color": [self.color],
+            "clarity": [self.clarity]
+        }
+
     def get_data_as_dataframe(self):
+        import pandas as pd
+
         try:
             custom_data_input_dict = {
                 "carat": [self.carat],
@@ -58,8 +360,16 @@ class DiamondData:
 
 
             df = pd.DataFrame(custom_data_input_dict)
-            logging.info('Dataframe Created')
+            hot_path_logger.info('Dataframe Created')
             return df
         except Exception as e:
             logging.info('Exception Occured in prediction pipeline')
-            raise DiamondException(e,sys)
\ No newline at end of file
+            raise DiamondException(e,sys)
+
+    @staticmethod
+    def records_as_columns(records):
+        """
+        records_as_columns turns a list of diamond dicts into a dict of column lists,
+        missing fields become None and are reported by the validator
+        """
+        return {column: [record.get(column) for record in records] for column in FEATURE_COLUMNS}
@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+import queue
+import random
+import threading
+import numpy as np
+from Diamond.exception import DiamondException
+from Diamond.logger import logging
+from Diamond.utils.instrumentation import Histogram
+
+
+class ShadowScorer:
+    def __init__(self, registry, predict_version, sample_rate, max_queue=1000):
+        """
+        ShadowScorer replays a sampled fraction of live predictions against the candidate
+        model of the registry in a background thread. The request only pays for a random
+        draw and a non blocking queue put; when the queue is full the sample is dropped.
+        Latency and price differences against the active model are aggregated per
+        candidate version and reported by stats().
+
+        :param registry: ModelRegistry naming the active and candidate versions
+        :param predict_version: callable (version, features) -> predictions
+        :param sample_rate: fraction of predict calls replayed on the candidate
+        :param max_queue: samples waiting for the background thread
+        """
+        self.registry = registry
+        self.predict_version = predict_version
+        self.sample_rate = sample_rate
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.dropped = 0
+        self._reset(None, None)
+
+    def _reset(self, active, candidate):
+        self.active = active
+        self.candidate = candidate
+        self.requests = 0
+        self.rows = 0
+        self.errors = 0
+        self.active_latency = Histogram()
+        self.candidate_latency = Histogram()
+        self.abs_delta_sum = 0.0
+        self.relative_delta_sum = 0.0
+        self.max_abs_delta = 0.0
+
+    def _ensure_started(self):
+        # Threads do not survive fork, every serving worker starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                    self._thread = threading.Thread(target=self._run, name='shadow_scorer', daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def submit(self, active_version, features, predictions, seconds):
+        """
+        submit offers one live predict call for shadow scoring
+        Args: active_version that produced predictions, features passed to predict,
+              predictions of the active model, seconds the active predict call took
+        """
+        if random.random() >= self.sample_rate:
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((active_version, features, predictions, seconds))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            active, features, predictions, active_seconds = self._queue.get()
+            try:
+                candidate = self.registry.candidate_version()
+                if candidate is None or candidate == active:
+                    continue
+                start = time.perf_counter()
+                candidate_predictions = np.asarray(self.predict_version(candidate, features), dtype=np.float64)
+                candidate_seconds = time.perf_counter() - start
+                self._record(active, candidate, np.asarray(predictions, dtype=np.float64),
+                             candidate_predictions, active_seconds, candidate_seconds)
+            except Exception as e:
+                self.errors += 1
+                logging.info(f'Shadow scoring failed: {DiamondException(e, sys)}')
+
+    def _record(self, active, candidate, predictions, candidate_predictions, active_seconds, candidate_seconds):
+        deltas = np.abs(candidate_predictions - predictions)
+        with self._lock:
+            if (active, candidate) != (self.active, self.candidate):
+                self._reset(active, candidate)
+            self.requests += 1
+            self.rows += len(deltas)
+            self.active_latency.observe(active_seconds)
+            self.candidate_latency.observe(candidate_seconds)
+            self.abs_delta_sum += float(deltas.sum())
+            self.relative_delta_sum += float((deltas / np.maximum(np.abs(predictions), 1.0)).sum())
+            self.max_abs_delta = max(self.max_abs_delta, float(deltas.max()) if len(deltas) else 0.0)
+
+    def stats(self):
+        """
+        stats compares the candidate with the active model on the replayed traffic
+        Returns: dict with versions, sampled requests/rows, latency of both models and price deltas
+        """
+        with self._lock:
+            stats = {
+                'sample_rate': self.sample_rate,
+                'active_version': self.active,
+                'candidate_version': self.candidate,
+                'requests': self.requests,
+                'rows': self.rows,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'queued': self._queue.qsize(),
+                'active_latency': self.active_latency.as_dict(),
+                'candidate_latency': self.candidate_latency.as_dict(),
+                'mean_abs_price_delta': self.abs_delta_sum / self.rows if self.rows else 0.0,
+                'mean_relative_price_delta': self.relative_delta_sum / self.rows if self.rows else 0.0,
+                'max_abs_price_delta': self.max_abs_delta
+            }
+        if stats['active_version'] is None:
+            # nothing replayed yet, report the versions the registry currently names
+            stats['active_version'] = self.registry.active_version()
+            stats['candidate_version'] = self.registry.candidate_version()
+        for name in ('active', 'candidate'):
+            version = stats[f'{name}_version']
+            if version is not None:
+                # test R2 recorded by ModelTrainer when the version was registered
+                stats[f'{name}_r2'] = self.registry.metadata(version).get('r2')
+        return stats
@@ -0,0 +1,121 @@
+import os
+import sys
+import json
+import hashlib
+from dataclasses import dataclass
+from Diamond.logger import logging
+from Diamond.exception import DiamondException
+from Diamond.utils.artifact_cache import file_digest
+
+
+@dataclass
+class StageCacheConfig:
+    manifest_file_path: str = os.path.join('artifacts', 'stage_cache', 'manifest.json')
+    report_file_path: str = os.path.join('artifacts', 'stage_cache', 'report.json')
+    enabled: bool = os.environ.get('DIAMOND_STAGE_CACHE', '1') == '1'
+
+
+def _config_fingerprint(obj):
+    # Class level defaults (e.g. ModelTrainerConfig paths) are part of the configuration too
+    values = {name: value for name, value in vars(type(obj)).items()
+              if not name.startswith('_') and not callable(value)}
+    values.update(vars(obj))
+    # Non JSON values (e.g. the artifact store instance) are identified by their type only
+    return json.dumps(values, default=lambda value: type(value).__name__, sort_keys=True)
+
+
+class StageCache:
+    def __init__(self, stage_cache_config=None):
+        """
+        StageCache skips pipeline stages whose inputs, configuration and code are
+        unchanged since the run that produced their artifacts.
+
+        :param stage_cache_config: StageCacheConfig
+        """
+        self.stage_cache_config = stage_cache_config or StageCacheConfig()
+        self.manifest = self._read_manifest()
+        self.report = {}
+        self._digests = {}
+
+    def _read_manifest(self):
+        if os.path.exists(self.stage_cache_config.manifest_file_path):
+            with open(self.stage_cache_config.manifest_file_path) as manifest_file:
+                return json.load(manifest_file)
+        return {}
+
+    def _write_json(self, file_path, obj):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_file_path = f'{file_path}.{os.getpid()}.tmp'
+        with open(tmp_file_path, 'w') as file_obj:
+            json.dump(obj, file_obj, indent=4)
+        os.replace(tmp_file_path, file_path)
+
+    def digest(self, file_path):
+        """
+        Content hash of a file, memoized on (mtime, size) so outputs of one stage
+        are not hashed again when they become the inputs of the next one
+        """
+        st = os.stat(file_path)
+        memo_key = (file_path, st.st_mtime_ns, st.st_size)
+        if memo_key not in self._digests:
+            self._digests[memo_key] = file_digest(file_path)
+        return self._digests[memo_key]
+
+    def stage_key(self, input_paths, configs, code_modules):
+        """
+        stage_key hashes the stage inputs, configuration and source code
+        Args: input_paths list of files, configs list of config objects, code_modules list of modules
+        Returns: hex digest identifying this version of the stage
+        """
+        key = hashlib.sha256()
+        for file_path in input_paths:
+            key.update(f'input:{file_path}:{self.digest(file_path)}'.encode())
+        for config in configs:
+            key.update(f'config:{type(config).__name__}:{_config_fingerprint(config)}'.encode())
+        for module in code_modules:
+            key.update(f'code:{module.__name__}:{self.digest(module.__file__)}'.encode())
+        return key.hexdigest()
+
+    def is_hit(self, stage_name, key):
+        if not self.stage_cache_config.enabled:
+            return False
+        entry = self.manifest.get(stage_name)
+        if entry is None or entry['key'] != key:
+            return False
+        # The artifacts must still be the ones this stage produced
+        for file_path, digest in entry['outputs'].items():
+            if not os.path.exists(file_path) or self.digest(file_path) != digest:
+                return False
+        return True
+
+    def run(self, stage_name, key, output_paths, func, optional_paths=()):
+        """
+        run executes func unless the stage is a cache hit, then records its outputs
+        Args: stage_name, key from stage_key, output_paths list of artifacts written by func, func callable,
+              optional_paths artifacts func may skip, recorded only when they were written
+        Returns: the value returned by func, or None on a cache hit
+        Raises: DiamondException
+        """
+        try:
+            if self.is_hit(stage_name, key):
+                logging.info(f'Stage cache hit for {stage_name}, reusing artifacts')
+                self.report[stage_name] = 'hit'
+                return None
+
+            logging.info(f'Stage cache miss for {stage_name}, running stage')
+            result = func()
+            written = list(output_paths) + [file_path for file_path in optional_paths if os.path.exists(file_path)]
+            self.manifest[stage_name] = {
+                'key': key,
+                'outputs': {file_path: self.digest(file_path) for file_path in written}
+            }
+            self._write_json(self.stage_cache_config.manifest_file_path, self.manifest)
+            self.report[stage_name] = 'ran'
+            return result
+        except Exception as e:
+            raise DiamondException(e, sys)
+
+    def write_report(self):
+        logging.info(f'Stage cache report: {self.report}')
+        self._write_json(self.stage_cache_config.report_file_path, self.report)
+        return self.report
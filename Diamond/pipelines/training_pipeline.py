@@ -4,6 +4,18 @@ from Diamond.logger import logging
 from Diamond.exception import DiamondException
 from Diamond.components.model_trainer import ModelTrainer
 from Diamond.components.model_evaluation import ModelEvaluation
+from Diamond.components.incremental_trainer import IncrementalTrainer
+from Diamond.components.out_of_core_trainer import OutOfCoreTrainer
+from Diamond.components.feature_store import FeatureStore
+from Diamond.components import (data_ingestion, data_transformation, model_trainer, model_search,
+                                hyperparameter_search, cross_validation, model_evaluation)
+from Diamond.pipelines.stage_cache import StageCache
+from Diamond.utils.artifact_store import load_numpy_array
+from Diamond.utils.instrumentation import metrics, profile_stage
+import Diamond.utils
+import Diamond.utils.artifact_store
+import Diamond.utils.model_export
+import Diamond.constants
 import os
 import sys
 import pandas as pd
@@ -21,6 +33,11 @@ class TrainingPipeline:
             self.data_transformation = DataTransformation()
             self.model_trainer = ModelTrainer()
             self.model_evaluation = ModelEvaluation()
+            self.stage_cache = StageCache()
+            self.incremental_trainer = IncrementalTrainer()
+            self.out_of_core_trainer = OutOfCoreTrainer()
+            self.feature_store = FeatureStore()
+            self.metrics_file_path = os.path.join('artifacts', 'instrumentation', 'metrics.json')
 
         except Exception as e:
             raise DiamondException(e,sys)
@@ -34,7 +51,8 @@ class TrainingPipeline:
         """
         
         try:
-            train_data_path,test_data_path = self.data_ingestion.initiate_data_ingestion()
+            with metrics.timer('stage.data_ingestion'), metrics.peak_memory('stage.data_ingestion'), profile_stage('data_ingestion'):
+                train_data_path,test_data_path = self.data_ingestion.initiate_data_ingestion()
             return train_data_path,test_data_path
         except Exception as e:
             raise DiamondException(e,sys)
@@ -47,7 +65,8 @@ class TrainingPipeline:
         Raises: DiamondException
         """
         try:
-            return self.data_transformation.initialize_data_transformation(train_path=train_data_path,test_path=test_data_path) 
+            with metrics.timer('stage.data_transformation'), metrics.peak_memory('stage.data_transformation'), profile_stage('data_transformation'):
+                return self.data_transformation.initialize_data_transformation(train_path=train_data_path,test_path=test_data_path)
         except Exception as e:
             raise DiamondException(e,sys)
     def initiate_model_trainer(self,train_array, test_array):   
@@ -58,22 +77,32 @@ class TrainingPipeline:
         Raises: DiamondException
         """
         try:
-            return self.model_trainer.initiate_model_trainer(train_array=train_array,test_array=test_array)
+            with metrics.timer('stage.model_trainer'), metrics.peak_memory('stage.model_trainer'), profile_stage('model_trainer'):
+                return self.model_trainer.initiate_model_trainer(train_array=train_array,test_array=test_array)
         
         except Exception as e:
             raise DiamondException(e,sys)
         
     def initiate_model_evaluation(self, train_array, test_array):
         """
-        initiate_model_evaluation method will start the model evaluation process
+        initiate_model_evaluation method will start the model evaluation process, scoring the
+        registry version registered by the last training when there is one
         Args: train_array, test_array
         Returns: None
         Raises: DiamondException
         """
         try:
-            return self.model_evaluation.initiate_model_evaluation(train_array=train_array, test_array=test_array)
+            version = self.model_trainer.model_version
+            model_path = self.model_trainer.model_registry.path(version, 'model.pkl') if version else None
+            with metrics.timer('stage.model_evaluation'), metrics.peak_memory('stage.model_evaluation'), profile_stage('model_evaluation'):
+                return self.model_evaluation.initiate_model_evaluation(train_array=train_array, test_array=test_array,
+                                                                       model_path=model_path)
         except Exception as e:
             raise DiamondException(e,sys)
+    def _code_modules(self, *modules):
+        # Shared helpers are part of every stage's code version
+        return [Diamond.utils, Diamond.utils.artifact_store, Diamond.constants, *modules]
+
     def run_pipeline(self):
         """
         run_pipeline method will start the entire pipeline from data ingestion to model evaluation
@@ -81,28 +110,163 @@ class TrainingPipeline:
         Raises: DiamondException
         """
         try:
+            ingestion_config = self.data_ingestion.ingestion_config
+            transformation_config = self.data_transformation.data_transformation_config
+            trainer_config = self.model_trainer.model_trainer_config
+
         # Step 1: Data Ingestion
             logging.info('Pipeline has been started')
             logging.info('Data Ingestion Initiated')
-            train_data_path, test_data_path = self.initiate_data_ingestion()  # Correct unpacking
+            key = self.stage_cache.stage_key(
+                input_paths=[ingestion_config.source_data_path],
+                configs=[ingestion_config],
+                code_modules=self._code_modules(data_ingestion)
+            )
+            self.stage_cache.run(
+                'data_ingestion', key,
+                output_paths=[ingestion_config.raw_data_path, ingestion_config.train_data_path, ingestion_config.test_data_path],
+                func=self.initiate_data_ingestion
+            )
+            train_data_path, test_data_path = ingestion_config.train_data_path, ingestion_config.test_data_path
             logging.info('Data Ingestion Completed')
             
             logging.info('Data Transformation Initiated')
             # Step 2: Data Transformation
-            train_arr, test_arr= self.initiate_data_transformation(train_data_path=train_data_path, test_data_path=test_data_path)
+            key = self.stage_cache.stage_key(
+                input_paths=[train_data_path, test_data_path],
+                configs=[transformation_config],
+                code_modules=self._code_modules(data_transformation)
+            )
+            self.stage_cache.run(
+                'data_transformation', key,
+                output_paths=[transformation_config.preprocessor_obj_file_path,
+                              transformation_config.train_array_file_path,
+                              transformation_config.test_array_file_path],
+                func=lambda: self.initiate_data_transformation(train_data_path=train_data_path, test_data_path=test_data_path)
+            )
+            # Later stages share the saved arrays memory-mapped instead of holding copies
+            train_arr = load_numpy_array(transformation_config.train_array_file_path)
+            test_arr = load_numpy_array(transformation_config.test_array_file_path)
             logging.info('Data Transformation Completed')
             
             # Step 3: Model Training
             logging.info('Model Training Initiated')
-            self.initiate_model_trainer(train_array=train_arr, test_array=test_arr)
+            key = self.stage_cache.stage_key(
+                input_paths=[transformation_config.train_array_file_path, transformation_config.test_array_file_path,
+                             transformation_config.preprocessor_obj_file_path],
+                configs=[trainer_config, self.model_trainer.model_search.model_search_config,
+                         self.model_trainer.hyperparameter_search.hyperparameter_search_config,
+                         self.model_trainer.cross_validation.cross_validation_config],
+                code_modules=self._code_modules(model_trainer, model_search, hyperparameter_search,
+                                                cross_validation, Diamond.utils.model_export)
+            )
+            self.stage_cache.run(
+                'model_trainer', key,
+                output_paths=[trainer_config.trained_model_file_path],
+                func=lambda: self.initiate_model_trainer(train_array=train_arr, test_array=test_arr),
+                optional_paths=[trainer_config.exported_model_file_path]
+            )
             logging.info('Model Training Completed')
             
             # Step 4: Model Evaluation
             logging.info('Model Evaluation Initiated')
-            self.initiate_model_evaluation(train_array=train_arr, test_array=test_arr)
+            key = self.stage_cache.stage_key(
+                input_paths=[trainer_config.trained_model_file_path, transformation_config.test_array_file_path],
+                configs=[],
+                code_modules=self._code_modules(model_evaluation)
+            )
+            self.stage_cache.run(
+                'model_evaluation', key,
+                output_paths=[],
+                func=lambda: self.initiate_model_evaluation(train_array=train_arr, test_array=test_arr)
+            )
             logging.info('Model Evaluation Completed')
-    
-            
-            logging.info('Data transformation completed')
+
+            self.stage_cache.write_report()
+            # the new model saw every ingested row, the next incremental run starts after them
+            self.incremental_trainer.reset()
+            metrics.export_json(self.metrics_file_path)
+            logging.info('Pipeline completed')
+        except Exception as e:
+            raise DiamondException(e, sys)
+
+    def run_incremental_pipeline(self):
+        """
+        run_incremental_pipeline updates the saved preprocessor and model with the rows added
+        since the last run, falling back to a full run_pipeline when the model cannot be warm-started
+        Returns: incremental training report
+        Raises: DiamondException
+        """
+        try:
+            logging.info('Incremental pipeline has been started')
+            report = self.incremental_trainer.initiate_incremental_training()
+            if report['mode'] == 'full_retrain_required':
+                logging.info('Falling back to a full retrain')
+                self.run_pipeline()
+            logging.info('Incremental pipeline completed')
+            return report
+        except Exception as e:
+            raise DiamondException(e, sys)
+
+    def run_out_of_core_pipeline(self):
+        """
+        run_out_of_core_pipeline trains on data larger than memory: ingestion streams the
+        source in chunks, the preprocessor is fitted from batches and the incremental
+        candidates learn from memory-mapped mini-batches
+        Returns: out-of-core training report
+        Raises: DiamondException
+        """
+        try:
+            logging.info('Out-of-core pipeline has been started')
+            self.data_ingestion.ingestion_config.streaming = True
+            train_data_path, test_data_path = self.initiate_data_ingestion()
+            with metrics.timer('stage.data_transformation'), metrics.peak_memory('stage.data_transformation'):
+                train_arr, test_arr = self.out_of_core_trainer.initiate_out_of_core_transformation(
+                    train_path=train_data_path, test_path=test_data_path)
+            with metrics.timer('stage.model_trainer'), metrics.peak_memory('stage.model_trainer'):
+                report = self.out_of_core_trainer.initiate_out_of_core_training(train_arr=train_arr, test_arr=test_arr)
+            self.incremental_trainer.reset()
+            metrics.export_json(self.metrics_file_path)
+            logging.info('Out-of-core pipeline completed')
+            return report
+        except Exception as e:
+            raise DiamondException(e, sys)
+
+    def run_feature_store_pipeline(self):
+        """
+        run_feature_store_pipeline trains from the feature store: only the rows added to the
+        source since the last run are transformed, with the saved preprocessor, and the
+        train/test arrays are assembled from the stored partitions. Unless the store was
+        built with the saved preprocessor, the preprocessor is fitted again through the
+        streaming ingestion, whose is_test_row split is the one FeatureStore.assemble uses,
+        so no test row contributes to the imputer and scaler statistics.
+        Returns: feature store update report
+        Raises: DiamondException
+        """
+        try:
+            logging.info('Feature store pipeline has been started')
+            ingestion_config = self.data_ingestion.ingestion_config
+            transformation_config = self.data_transformation.data_transformation_config
+            if not self.feature_store.is_current(transformation_config.preprocessor_obj_file_path):
+                logging.info('Fitting the preprocessor on the rows is_test_row assigns to training')
+                streaming = ingestion_config.streaming
+                ingestion_config.streaming = True
+                try:
+                    train_data_path, test_data_path = self.initiate_data_ingestion()
+                finally:
+                    ingestion_config.streaming = streaming
+                self.initiate_data_transformation(train_data_path=train_data_path, test_data_path=test_data_path)
+
+            with metrics.timer('stage.feature_store'), metrics.peak_memory('stage.feature_store'):
+                report = self.feature_store.update(ingestion_config.source_data_path,
+                                                   transformation_config.preprocessor_obj_file_path)
+                train_arr, test_arr = self.feature_store.assemble(ingestion_config.test_size,
+                                                                  transformation_config.train_array_file_path,
+                                                                  transformation_config.test_array_file_path)
+            self.initiate_model_trainer(train_array=train_arr, test_array=test_arr)
+            self.initiate_model_evaluation(train_array=train_arr, test_array=test_arr)
+            metrics.export_json(self.metrics_file_path)
+            logging.info('Feature store pipeline completed')
+            return report
         except Exception as e:
             raise DiamondException(e, sys)
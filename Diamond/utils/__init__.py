@@ -1,11 +1,12 @@
 import os
 import sys
 import pickle
-import numpy as np
-import pandas as pd
 from Diamond.logger import logging
 from Diamond.exception import DiamondException
-from sklearn.metrics import r2_score, mean_absolute_error,mean_squared_error
+from Diamond.utils.instrumentation import metrics
+
+# Only inference helpers are imported at module load, sklearn is imported where it is used
+# so the serving process does not pay for it before the first prediction
 
 def save_object(file_path, obj):
     try:
@@ -13,13 +14,18 @@ def save_object(file_path, obj):
 
         os.makedirs(dir_path, exist_ok=True)
 
-        with open(file_path, "wb") as file_obj:
+        # Write to a temporary file first so readers never see a half written pickle
+        tmp_file_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(tmp_file_path, "wb") as file_obj:
             pickle.dump(obj, file_obj)
+        os.replace(tmp_file_path, file_path)
 
     except Exception as e:
         raise DiamondException(e, sys)
     
 def evaluate_model(X_train,y_train,X_test,y_test,models):
+    from sklearn.metrics import r2_score
+
     try:
         report = {}
         for i in range(len(models)):
@@ -46,7 +52,7 @@ def evaluate_model(X_train,y_train,X_test,y_test,models):
     
 def load_object(file_path):
     try:
-        with open(file_path,'rb') as file_obj:
+        with metrics.timer('pickle.load'), open(file_path,'rb') as file_obj:
             return pickle.load(file_obj)
     except Exception as e:
         logging.info('Exception Occured in load_object function utils')
@@ -0,0 +1,131 @@
+import os
+import sys
+import hashlib
+import threading
+from Diamond.logger import logging
+from Diamond.exception import DiamondException
+
+
+def file_digest(file_path, chunk_size=1 << 20):
+    """
+    Function to compute the sha256 content hash of a file
+
+    file_path: path of the file to hash
+    chunk_size: number of bytes read per iteration
+
+    Returns:
+        string: hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file_obj:
+        for block in iter(lambda: file_obj.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    def __init__(self, file_paths, loader=None):
+        """
+        ArtifactCache keeps a set of pickled artifacts loaded once per process and
+        reloads all of them together when any of the files changes on disk.
+
+        :param file_paths: list of artifact paths loaded with load_object
+        :param loader: optional callable receiving the loaded objects in the order of
+                       file_paths and returning the value to cache
+        """
+        self.file_paths = list(file_paths)
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._value = None
+        self._stats = None
+        self._digests = None
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def _stat(self):
+        stats = []
+        for file_path in self.file_paths:
+            st = os.stat(file_path)
+            stats.append((st.st_mtime_ns, st.st_size))
+        return tuple(stats)
+
+    def _load(self, stats):
+        # Imported here to avoid a circular import with Diamond.utils
+        from Diamond.utils import load_object
+
+        digests = tuple(file_digest(file_path) for file_path in self.file_paths)
+        if self._value is not None and digests == self._digests:
+            # Files were touched but their content is unchanged
+            self._stats = stats
+            return False
+
+        objects = [load_object(file_path) for file_path in self.file_paths]
+        value = self.loader(*objects) if self.loader is not None else tuple(objects)
+
+        # Swap every attribute at once so readers never see a mixed generation
+        self._value = value
+        self._stats = stats
+        self._digests = digests
+        self.version = hashlib.sha256(''.join(digests).encode()).hexdigest()[:16]
+        return True
+
+    def get(self):
+        """
+        Return the cached artifacts, reloading them if the files on disk changed
+
+        Returns:
+            object: value produced by loader, or tuple of loaded objects
+        """
+        return self.get_versioned()[0]
+
+    def get_versioned(self):
+        """
+        Return the cached artifacts together with the version they were loaded as
+
+        Returns:
+            tuple: (value, version)
+        """
+        try:
+            with self._lock:
+                stats = self._stat()
+                if self._value is not None and stats == self._stats:
+                    self.hits += 1
+                    return self._value, self.version
+
+                first_load = self._value is None
+                if self._load(stats):
+                    if first_load:
+                        self.misses += 1
+                    else:
+                        self.reloads += 1
+                    logging.info(f'Artifacts loaded into cache, version {self.version}')
+                else:
+                    self.hits += 1
+                return self._value, self.version
+        except Exception as e:
+            logging.info('Exception occured while loading artifacts into cache')
+            raise DiamondException(e, sys)
+
+    def clear(self):
+        with self._lock:
+            self._value = None
+            self._stats = None
+            self._digests = None
+            self.version = None
+
+    def stats(self):
+        """
+        Return the hit/miss/reload counters of the cache
+
+        Returns:
+            dict: counters and current artifact version
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'reloads': self.reloads,
+                'version': self.version
+            }
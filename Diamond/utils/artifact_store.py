@@ -0,0 +1,261 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+from Diamond.logger import logging
+from Diamond.exception import DiamondException
+from Diamond.constants import DATASET_DTYPES
+from Diamond.utils.instrumentation import metrics
+
+
+def _dtypes_for(columns):
+    return {column: dtype for column, dtype in DATASET_DTYPES.items() if column in columns}
+
+
+class ArtifactStore:
+    """
+    Base class of the tabular artifact formats written by the pipeline stages
+    """
+    format_name = None
+    extension = None
+
+    def path(self, directory, name):
+        return os.path.join(directory, f'{name}.{self.extension}')
+
+    def write(self, df, file_path):
+        raise NotImplementedError
+
+    def read(self, file_path, columns=None):
+        raise NotImplementedError
+
+    def open_writer(self, file_path):
+        """
+        Return a writer appending DataFrame chunks to file_path, used by streaming ingestion
+        """
+        raise NotImplementedError
+
+    def iter_batches(self, file_path, columns=None, batch_size=100_000, dtypes=True):
+        """
+        Yield the artifact as DataFrames of at most batch_size rows, used by out-of-core training.
+        dtypes=False keeps the values of text formats as found instead of casting them to
+        DATASET_DTYPES, so a malformed cell reaches the validator instead of failing the read
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def apply_dtypes(df):
+        return df.astype(_dtypes_for(df.columns))
+
+
+class _CsvChunkWriter:
+    def __init__(self, file_path):
+        self.file_obj = open(file_path, 'w', newline='')
+        self.header = True
+
+    def write(self, df):
+        df.to_csv(self.file_obj, index=False, header=self.header)
+        self.header = False
+
+    def close(self):
+        self.file_obj.close()
+
+
+class _ArrowChunkWriter:
+    def __init__(self, file_path, open_writer):
+        self.file_path = file_path
+        self.open_writer = open_writer
+        self.writer = None
+        self.schema = None
+
+    def write(self, df):
+        import pyarrow as pa
+
+        # Categories differ between chunks, so categorical columns are written as plain strings
+        df = ArtifactStore.apply_dtypes(df)
+        df = df.astype({column: 'object' for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)})
+        table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        if self.writer is None:
+            self.schema = table.schema
+            self.writer = self.open_writer(self.file_path, self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class CsvArtifactStore(ArtifactStore):
+    format_name = 'csv'
+    extension = 'csv'
+
+    def write(self, df, file_path):
+        df.to_csv(file_path, index=False)
+
+    def read(self, file_path, columns=None):
+        header = pd.read_csv(file_path, nrows=0).columns
+        return pd.read_csv(file_path, usecols=columns, dtype=_dtypes_for(columns or header))
+
+    def open_writer(self, file_path):
+        return _CsvChunkWriter(file_path)
+
+    def iter_batches(self, file_path, columns=None, batch_size=100_000, dtypes=True):
+        header = pd.read_csv(file_path, nrows=0).columns
+        dtype = _dtypes_for(columns or header) if dtypes else None
+        yield from pd.read_csv(file_path, usecols=columns, dtype=dtype, chunksize=batch_size)
+
+
+class ParquetArtifactStore(ArtifactStore):
+    format_name = 'parquet'
+    extension = 'parquet'
+
+    def write(self, df, file_path):
+        self.apply_dtypes(df).to_parquet(file_path, index=False)
+
+    def read(self, file_path, columns=None):
+        return pd.read_parquet(file_path, columns=columns)
+
+    def open_writer(self, file_path):
+        from pyarrow import parquet
+        return _ArrowChunkWriter(file_path, parquet.ParquetWriter)
+
+    def iter_batches(self, file_path, columns=None, batch_size=100_000, dtypes=True):
+        from pyarrow import parquet
+        for batch in parquet.ParquetFile(file_path).iter_batches(batch_size=batch_size, columns=columns):
+            yield batch.to_pandas()
+
+
+class FeatherArtifactStore(ArtifactStore):
+    format_name = 'feather'
+    extension = 'feather'
+
+    def write(self, df, file_path):
+        # Written uncompressed so reads can memory-map the file instead of decoding it
+        self.apply_dtypes(df).reset_index(drop=True).to_feather(file_path, compression='uncompressed')
+
+    def read(self, file_path, columns=None):
+        from pyarrow import feather
+        return feather.read_table(file_path, columns=columns, memory_map=True).to_pandas()
+
+    def open_writer(self, file_path):
+        import pyarrow as pa
+        return _ArrowChunkWriter(
+            file_path,
+            lambda path, schema: pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(compression=None))
+        )
+
+    def iter_batches(self, file_path, columns=None, batch_size=100_000, dtypes=True):
+        from pyarrow import feather
+        table = feather.read_table(file_path, columns=columns, memory_map=True)
+        for batch in table.to_batches(max_chunksize=batch_size):
+            yield batch.to_pandas()
+
+
+ARTIFACT_STORES = {
+    store.format_name: store for store in (CsvArtifactStore, ParquetArtifactStore, FeatherArtifactStore)
+}
+
+
+def get_artifact_store(format_name):
+    """
+    Function to get the artifact store for a format name
+
+    format_name: one of csv, parquet, feather
+
+    Returns:
+        ArtifactStore instance
+    """
+    if format_name not in ARTIFACT_STORES:
+        raise ValueError(f'Unknown artifact format {format_name!r}, expected one of {list(ARTIFACT_STORES)}')
+    return ARTIFACT_STORES[format_name]()
+
+
+def get_artifact_store_for_path(file_path):
+    extension = os.path.splitext(file_path)[1].lstrip('.')
+    for store in ARTIFACT_STORES.values():
+        if store.extension == extension:
+            return store()
+    raise ValueError(f'No artifact store for {file_path}')
+
+
+def iter_artifact(file_path, columns=None, batch_size=100_000, dtypes=True):
+    """
+    Function to stream a tabular artifact in batches without loading it whole
+
+    file_path: path of a csv, parquet or feather artifact
+    columns: optional list of columns to read
+    batch_size: maximum number of rows per batch
+    dtypes: False to read csv values without casting them to DATASET_DTYPES, for untrusted input
+
+    Returns:
+        generator of DataFrames
+    """
+    try:
+        return get_artifact_store_for_path(file_path).iter_batches(file_path, columns=columns, batch_size=batch_size,
+                                                                  dtypes=dtypes)
+    except Exception as e:
+        logging.info('Exception Occured in iter_artifact function utils')
+        raise DiamondException(e, sys)
+
+
+def read_artifact(file_path, columns=None):
+    """
+    Function to read a tabular artifact, only loading the requested columns
+
+    file_path: path of a csv, parquet or feather artifact
+    columns: optional list of columns to read
+
+    Returns:
+        DataFrame
+    """
+    try:
+        store = get_artifact_store_for_path(file_path)
+        with metrics.timer(f'artifact.read.{store.format_name}'):
+            return store.read(file_path, columns=columns)
+    except Exception as e:
+        logging.info('Exception Occured in read_artifact function utils')
+        raise DiamondException(e, sys)
+
+
+def save_numpy_array(file_path, array):
+    """
+    Function to save an array as .npy so it can be reopened memory-mapped
+    """
+    try:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_file_path = f"{file_path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_file_path, array)
+        os.replace(tmp_file_path, file_path)
+    except Exception as e:
+        raise DiamondException(e, sys)
+
+
+@contextmanager
+def numpy_array_writer(file_path, shape, dtype=np.float64):
+    """
+    Context manager yielding a preallocated .npy array mapped from disk, so a stage can
+    fill its output in place. The file is moved to file_path only when the block succeeds.
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_file_path = f"{file_path}.{os.getpid()}.tmp.npy"
+    array = np.lib.format.open_memmap(tmp_file_path, mode='w+', dtype=dtype, shape=shape)
+    try:
+        yield array
+        array.flush()
+    except Exception as e:
+        del array
+        os.remove(tmp_file_path)
+        raise DiamondException(e, sys)
+    del array
+    os.replace(tmp_file_path, file_path)
+
+
+def load_numpy_array(file_path, mmap_mode='r'):
+    """
+    Function to load a .npy array, memory-mapped read-only by default so callers share the page cache
+    """
+    try:
+        return np.load(file_path, mmap_mode=mmap_mode)
+    except Exception as e:
+        logging.info('Exception Occured in load_numpy_array function utils')
+        raise DiamondException(e, sys)
@@ -0,0 +1,192 @@
+import sys
+import numpy as np
+from Diamond.logger import logging
+from Diamond.exception import DiamondException
+
+
+class CompiledPreprocessor:
+    def __init__(self, preprocessor):
+        """
+        CompiledPreprocessor flattens a fitted ColumnTransformer made of
+        SimpleImputer -> OrdinalEncoder -> StandardScaler pipelines into NumPy
+        arrays so rows can be transformed without pandas or sklearn validation.
+
+        :param preprocessor: fitted ColumnTransformer from DataTransformation
+        """
+        self.blocks = []
+        self.n_features_out = 0
+        # column -> ordered labels of the OrdinalEncoder, to accept precomputed codes
+        self.categories = {}
+        for name, pipeline, columns in preprocessor.transformers_:
+            if name == 'remainder':
+                if pipeline != 'drop':
+                    raise ValueError(f'Unsupported remainder {pipeline!r}')
+                continue
+            steps = [step for _, step in pipeline.steps] if hasattr(pipeline, 'steps') else [pipeline]
+            block = {'columns': list(columns), 'categorical': False, 'ops': []}
+            for step in steps:
+                block['ops'].append(self._compile_step(step, block))
+                if type(step).__name__ == 'OrdinalEncoder':
+                    for column, categories in zip(block['columns'], step.categories_):
+                        self.categories[column] = [str(category) for category in categories]
+            self.blocks.append(block)
+            self.n_features_out += len(block['columns'])
+
+    @staticmethod
+    def _compile_step(step, block):
+        step_type = type(step).__name__
+        if step_type == 'SimpleImputer':
+            if step.strategy not in ('median', 'mean', 'most_frequent', 'constant'):
+                raise ValueError(f'Unsupported imputer strategy {step.strategy!r}')
+            if not (isinstance(step.missing_values, float) and np.isnan(step.missing_values)):
+                raise ValueError('Only NaN missing values are supported')
+            if getattr(step, 'add_indicator', False):
+                raise ValueError('Imputer missing indicators are not supported')
+            statistics = np.asarray(step.statistics_)
+            if statistics.dtype == object:
+                block['categorical'] = True
+            return ('impute', statistics)
+        if step_type == 'OrdinalEncoder':
+            if step.handle_unknown != 'error':
+                raise ValueError('Only handle_unknown="error" is supported')
+            # Sorted lookup tables so a whole column is encoded with one searchsorted
+            tables = []
+            for categories in step.categories_:
+                categories = np.asarray(categories).astype(str)
+                order = np.argsort(categories)
+                tables.append((categories[order], order.astype(np.float64)))
+            return ('encode', tables)
+        if step_type == 'StandardScaler':
+            mean = step.mean_ if step.with_mean else None
+            scale = step.scale_ if step.with_std else None
+            return ('scale', (mean, scale))
+        raise ValueError(f'Unsupported preprocessing step {step_type}')
+
+    @staticmethod
+    def _impute(values, statistics):
+        # Same mask as SimpleImputer: only NaN counts as missing
+        missing = values != values
+        if missing.any():
+            values = values.copy()
+            values[missing] = np.broadcast_to(statistics, values.shape)[missing]
+        return values
+
+    @staticmethod
+    def _encode(values, tables):
+        encoded = np.empty(values.shape, dtype=np.float64)
+        for j, (sorted_categories, codes) in enumerate(tables):
+            column = values[:, j].astype(str)
+            position = np.searchsorted(sorted_categories, column)
+            position = np.minimum(position, len(sorted_categories) - 1)
+            unknown = sorted_categories[position] != column
+            if unknown.any():
+                raise ValueError(
+                    f'Found unknown categories {sorted(set(column[unknown]))} in column {j} during transform'
+                )
+            encoded[:, j] = codes[position]
+        return encoded
+
+    def probe(self):
+        """
+        Build a small DataFrame covering every category, the imputed values and
+        missing numeric values, used to check the compiled path against sklearn
+        """
+        import pandas as pd
+
+        n_rows = 1
+        for block in self.blocks:
+            for op, params in block['ops']:
+                if op == 'encode':
+                    n_rows = max(n_rows, max(len(categories) for categories, _ in params))
+        n_rows += 1
+        data = {}
+        rng = np.random.default_rng(0)
+        for block in self.blocks:
+            columns = block['columns']
+            encode = [params for op, params in block['ops'] if op == 'encode']
+            for j, column in enumerate(columns):
+                if encode:
+                    categories = encode[0][j][0]
+                    data[column] = [categories[i % len(categories)] for i in range(n_rows)]
+                else:
+                    values = rng.normal(size=n_rows) * 10
+                    values[-1] = np.nan
+                    data[column] = values
+        return pd.DataFrame(data)
+
+    def encodes_like(self, categories):
+        """
+        Return True when the encoder uses the label order of categories (column -> labels),
+        so ordinal codes computed with it can be passed to transform
+        """
+        own = getattr(self, 'categories', None)
+        return bool(own) and all(list(categories.get(column, ())) == labels for column, labels in own.items())
+
+    def transform(self, features, codes=None):
+        """
+        Transform features with the extracted statistics
+
+        features: DataFrame, or mapping of column name to a sequence of values
+        codes: optional mapping of categorical column to ordinal codes without missing or
+               unknown labels, such as ValidationResult.codes; those columns skip the
+               imputer and the encoder. See encodes_like.
+
+        Returns:
+            ndarray: transformed features, equal to preprocessor.transform(features)
+        """
+        try:
+            first_column = features[self.blocks[0]['columns'][0]]
+            n_rows = len(first_column)
+            output = np.empty((n_rows, self.n_features_out), dtype=np.float64)
+            offset = 0
+            for block in self.blocks:
+                columns = block['columns']
+                ops = block['ops']
+                if codes is not None and block['categorical'] and all(column in codes for column in columns):
+                    values = np.empty((n_rows, len(columns)), dtype=np.float64)
+                    for j, column in enumerate(columns):
+                        values[:, j] = codes[column]
+                    ops = [(op, params) for op, params in ops if op not in ('impute', 'encode')]
+                else:
+                    dtype = object if block['categorical'] else np.float64
+                    values = np.empty((n_rows, len(columns)), dtype=dtype)
+                    for j, column in enumerate(columns):
+                        values[:, j] = np.asarray(features[column], dtype=dtype)
+                for op, params in ops:
+                    if op == 'impute':
+                        values = self._impute(values, params)
+                    elif op == 'encode':
+                        values = self._encode(values, params)
+                    else:
+                        mean, scale = params
+                        values = np.asarray(values, dtype=np.float64)
+                        if mean is not None:
+                            values = values - mean
+                        if scale is not None:
+                            values = values / scale
+                output[:, offset:offset + len(columns)] = values
+                offset += len(columns)
+            return output
+        except Exception as e:
+            raise DiamondException(e, sys)
+
+
+def compile_preprocessor(preprocessor):
+    """
+    Function to build a CompiledPreprocessor and check it against sklearn
+
+    preprocessor: fitted ColumnTransformer
+
+    Returns:
+        CompiledPreprocessor or None when the preprocessor cannot be compiled exactly
+    """
+    try:
+        compiled = CompiledPreprocessor(preprocessor)
+        probe = compiled.probe()
+        if not np.array_equal(compiled.transform(probe), preprocessor.transform(probe)):
+            logging.info('Compiled preprocessor output differs from sklearn, using sklearn path')
+            return None
+        return compiled
+    except Exception as e:
+        logging.info(f'Preprocessor could not be compiled, using sklearn path: {e}')
+        return None
@@ -0,0 +1,186 @@
+import os
+import io
+import json
+import time
+import bisect
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from Diamond.logger import logging
+from Diamond.utils.memory import PeakMemorySampler
+
+# Upper bounds in seconds of the histogram buckets, the last bucket is unbounded
+BUCKET_BOUNDS = [
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0
+]
+
+PROFILE_DIR = os.path.join('artifacts', 'profiles')
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, value)] += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation, capped by the observed max
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKET_BOUNDS + [self.max], self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum_seconds': self.total,
+            'mean_seconds': self.total / self.count if self.count else 0.0,
+            'min_seconds': self.min if self.count else 0.0,
+            'max_seconds': self.max,
+            'p50_seconds': self.quantile(0.5),
+            'p99_seconds': self.quantile(0.99),
+            'buckets': dict(zip([str(bound) for bound in BUCKET_BOUNDS] + ['inf'], self.buckets))
+        }
+
+
+class Instrumentation:
+    def __init__(self):
+        """
+        Instrumentation aggregates counters, gauges and timing histograms in-process.
+        Timers use the monotonic perf_counter clock.
+        """
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Time the enclosed block and record it in the histogram called name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    @contextmanager
+    def peak_memory(self, name):
+        """
+        Record the peak RSS of the enclosed block and its growth over the RSS at entry
+        as the gauges name.peak_rss_mb and name.peak_increase_mb
+        """
+        with PeakMemorySampler() as sampler:
+            yield sampler
+        self.set_gauge(f'{name}.peak_rss_mb', sampler.peak_bytes / 2 ** 20)
+        self.set_gauge(f'{name}.peak_increase_mb', sampler.peak_increase_bytes / 2 ** 20)
+        logging.info(f'{name}: peak RSS {sampler.peak_bytes / 2 ** 20:.0f} MB, '
+                     f'+{sampler.peak_increase_bytes / 2 ** 20:.0f} MB over the start of the block')
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'timers': {name: histogram.as_dict() for name, histogram in self.histograms.items()}
+            }
+
+    def as_mlflow_metrics(self):
+        """
+        Flatten the timers and counters into MLflow metric names and values
+        """
+        snapshot = self.snapshot()
+        metrics = {f'counter.{name}': float(value) for name, value in snapshot['counters'].items()}
+        metrics.update({f'gauge.{name}': float(value) for name, value in snapshot['gauges'].items()})
+        for name, histogram in snapshot['timers'].items():
+            for field in ('count', 'sum_seconds', 'mean_seconds', 'p99_seconds'):
+                metrics[f'timer.{name}.{field}'] = float(histogram[field])
+        return metrics
+
+    def export_json(self, file_path):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as file_obj:
+            json.dump(self.snapshot(), file_obj, indent=4)
+        logging.info(f'Instrumentation metrics exported to {file_path}')
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+# Process wide instrumentation registry
+metrics = Instrumentation()
+
+
+@contextmanager
+def profile_stage(stage_name):
+    """
+    Capture a cProfile and tracemalloc snapshot of the block when stage_name is the
+    stage selected with the DIAMOND_PROFILE_STAGE environment variable
+    """
+    if os.environ.get('DIAMOND_PROFILE_STAGE') != stage_name:
+        yield
+        return
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler = cProfile.Profile()
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+
+        profile_path = os.path.join(PROFILE_DIR, f'{stage_name}.prof')
+        profiler.dump_stats(profile_path)
+        stats_text = io.StringIO()
+        pstats.Stats(profiler, stream=stats_text).sort_stats('cumulative').print_stats(30)
+
+        memory_path = os.path.join(PROFILE_DIR, f'{stage_name}_memory.txt')
+        with open(memory_path, 'w') as memory_file:
+            memory_file.write(f'Peak traced memory: {peak / 2 ** 20:.1f} MB\n')
+            for stat in snapshot.statistics('lineno')[:30]:
+                memory_file.write(f'{stat}\n')
+        with open(os.path.join(PROFILE_DIR, f'{stage_name}_cumulative.txt'), 'w') as stats_file:
+            stats_file.write(stats_text.getvalue())
+        logging.info(f'Profile of {stage_name} written to {profile_path} and {memory_path}')
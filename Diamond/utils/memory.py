@@ -0,0 +1,145 @@
+import os
+import sys
+import resource
+import threading
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss_bytes():
+    """
+    Function to get the resident set size of the current process
+
+    Returns:
+        int: RSS in bytes, falling back to the peak RSS where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    """
+    Function to get the peak resident set size of the current process since it started
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class PeakMemorySampler:
+    def __init__(self, interval=0.01):
+        """
+        PeakMemorySampler polls the RSS in a background thread while its block runs,
+        so the peak of a single stage can be measured inside a long running process.
+
+        :param interval: polling interval in seconds
+        """
+        self.interval = interval
+        self.start_bytes = 0
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_bytes = max(self.peak_bytes, current_rss_bytes())
+
+    def __enter__(self):
+        self.start_bytes = self.peak_bytes = current_rss_bytes()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, current_rss_bytes())
+        return False
+
+    @property
+    def peak_increase_bytes(self):
+        return self.peak_bytes - self.start_bytes
+
+
+def process_memory_breakdown(pid='self'):
+    """
+    Function to split the resident memory of a process into shared and unique pages
+    using /proc/<pid>/smaps_rollup (Linux only)
+
+    pid: process id, the current process by default
+
+    Returns:
+        dict: rss, pss, shared and unique sizes in bytes
+    """
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as smaps:
+        for line in smaps:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'shared': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+        'unique': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    }
+
+
+def child_pids(pid):
+    """
+    Function to list the direct children of a process by scanning /proc
+    """
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                # the command name may contain spaces, the parent pid follows its closing bracket
+                ppid = int(stat.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == int(pid):
+            children.append(int(entry))
+    return sorted(children)
+
+
+def worker_memory_report(master_pid):
+    """
+    Function to report the shared and unique memory of a pre-fork master and its workers
+
+    master_pid: pid of the serving master process
+
+    Returns:
+        dict: per process breakdown and totals in bytes; total_pss is the memory the
+              whole group actually costs the host
+    """
+    processes = {'master': process_memory_breakdown(master_pid)}
+    for pid in child_pids(master_pid):
+        try:
+            processes[f'worker {pid}'] = process_memory_breakdown(pid)
+        except OSError:
+            # worker exited while the report was being collected
+            continue
+    return {
+        'processes': processes,
+        'workers': len(processes) - 1,
+        'total_rss': sum(breakdown['rss'] for breakdown in processes.values()),
+        'total_pss': sum(breakdown['pss'] for breakdown in processes.values()),
+        'total_unique': sum(breakdown['unique'] for breakdown in processes.values())
+    }
+
+
+if __name__ == '__main__':
+    # python -m Diamond.utils.memory <master pid>
+    report = worker_memory_report(sys.argv[1] if len(sys.argv) > 1 else os.getppid())
+    for name, breakdown in report['processes'].items():
+        print(f"{name:>14}: rss {breakdown['rss'] / 2 ** 20:8.1f} MB  "
+              f"shared {breakdown['shared'] / 2 ** 20:8.1f} MB  unique {breakdown['unique'] / 2 ** 20:8.1f} MB  "
+              f"pss {breakdown['pss'] / 2 ** 20:8.1f} MB")
+    print(f"{report['workers']} workers, total pss {report['total_pss'] / 2 ** 20:.1f} MB "
+          f"(sum of rss {report['total_rss'] / 2 ** 20:.1f} MB)")
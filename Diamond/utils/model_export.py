@@ -0,0 +1,245 @@
+import os
+import sys
+import json
+import numpy as np
+from Diamond.logger import logging
+from Diamond.exception import DiamondException
+from Diamond.utils import save_object
+from Diamond.utils.compiled_preprocessor import compile_preprocessor
+
+LINEAR_MODELS = ('LinearRegression', 'Ridge', 'Lasso', 'ElasticNet', 'SGDRegressor')
+SKLEARN_TREE_MODELS = ('DecisionTreeRegressor', 'RandomForestRegressor', 'ExtraTreesRegressor',
+                       'GradientBoostingRegressor')
+
+
+class ExportedModel:
+    def __init__(self, kind, source, **arrays):
+        """
+        ExportedModel is the NumPy-only inference form of a fitted regressor. Linear
+        models keep their coefficients, tree ensembles keep every tree flattened into
+        shared node arrays that are walked for all rows and trees at once.
+
+        :param kind: 'linear' or 'trees'
+        :param source: class name of the exported model
+        :param arrays: coef/intercept for linear models; feature, threshold, children,
+                       value, default_left, roots, weights, base, max_depth and strict for trees
+        """
+        self.kind = kind
+        self.source = source
+        for name, value in arrays.items():
+            setattr(self, name, value)
+
+    def predict(self, X, chunk_size=4096):
+        X = np.asarray(X, dtype=np.float64)
+        if self.kind == 'linear':
+            return X @ self.coef + self.intercept
+        # sklearn and XGBoost both split on float32 features
+        X = X.astype(np.float32)
+        output = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), chunk_size):
+            output[start:start + chunk_size] = self._predict_trees(X[start:start + chunk_size])
+        return output
+
+    def _predict_trees(self, X):
+        n_rows, n_features = X.shape
+        flat_X = X.ravel()
+        has_missing = bool(np.isnan(flat_X).any())
+        row_offsets = (np.arange(n_rows) * n_features)[:, None]
+        node = np.repeat(self.roots[None, :], n_rows, axis=0)
+        # leaves loop back to themselves, so every row can take max_depth steps
+        for _ in range(self.max_depth):
+            values = np.take(flat_X, row_offsets + np.take(self.feature, node))
+            threshold = np.take(self.threshold, node)
+            # XGBoost sends x < threshold left, sklearn x <= threshold
+            go_left = values < threshold if self.strict else values <= threshold
+            if has_missing:
+                go_left |= np.isnan(values) & np.take(self.default_left, node)
+            node = np.take(self.children, 2 * node + go_left)
+        return self.base + np.take(self.value, node) @ self.weights
+
+
+def _flatten_trees(trees, weights, base, strict):
+    """
+    trees: list of (feature, threshold, left, right, value, default_left) arrays per tree,
+           with feature -1 on leaves and child indices local to the tree
+    """
+    feature, threshold, left, right, value, default_left, roots = [], [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for tree_feature, tree_threshold, tree_left, tree_right, tree_value, tree_default_left in trees:
+        n_nodes = len(tree_feature)
+        roots.append(offset)
+        leaf = tree_feature < 0
+        # leaves test feature 0 and point at themselves on both sides, so finished rows stay put
+        feature.append(np.where(leaf, 0, tree_feature))
+        threshold.append(tree_threshold)
+        left.append(np.where(leaf, np.arange(n_nodes), tree_left) + offset)
+        right.append(np.where(leaf, np.arange(n_nodes), tree_right) + offset)
+        value.append(tree_value)
+        default_left.append(tree_default_left)
+        max_depth = max(max_depth, _tree_depth(tree_left, tree_right))
+        offset += n_nodes
+    # children[2 * node] is the right child and children[2 * node + 1] the left one
+    children = np.stack([np.concatenate(right), np.concatenate(left)], axis=1).ravel()
+    return ExportedModel(
+        'trees', None,
+        feature=np.concatenate(feature).astype(np.int64),
+        threshold=np.concatenate(threshold).astype(np.float32 if strict else np.float64),
+        children=children.astype(np.int64),
+        value=np.concatenate(value).astype(np.float64),
+        default_left=np.concatenate(default_left).astype(bool),
+        roots=np.asarray(roots, dtype=np.int64),
+        weights=np.asarray(weights, dtype=np.float64),
+        base=float(base),
+        max_depth=max_depth,
+        strict=strict
+    )
+
+
+def _tree_depth(left, right):
+    left, right = np.asarray(left), np.asarray(right)
+    depth, level = 0, np.zeros(1, dtype=np.int64)
+    while level.size:
+        children = np.concatenate([left[level], right[level]])
+        level = children[children >= 0]
+        depth += 1
+    return depth - 1
+
+
+def _sklearn_tree(estimator):
+    tree = estimator.tree_
+    leaf = tree.children_left < 0
+    missing_go_to_left = getattr(tree, 'missing_go_to_left', np.zeros(tree.node_count, dtype=bool))
+    return (
+        np.where(leaf, -1, tree.feature),
+        tree.threshold,
+        tree.children_left,
+        tree.children_right,
+        tree.value[:, 0, 0],
+        np.asarray(missing_go_to_left, dtype=bool)
+    )
+
+
+def _export_sklearn_trees(model):
+    model_type = type(model).__name__
+    if model_type == 'DecisionTreeRegressor':
+        return _flatten_trees([_sklearn_tree(model)], [1.0], 0.0, strict=False)
+    if model_type in ('RandomForestRegressor', 'ExtraTreesRegressor'):
+        trees = [_sklearn_tree(estimator) for estimator in model.estimators_]
+        return _flatten_trees(trees, [1.0 / len(trees)] * len(trees), 0.0, strict=False)
+    # GradientBoostingRegressor: init prediction plus learning_rate times every stage
+    if model.init_ == 'zero':
+        base = 0.0
+    elif type(model.init_).__name__ == 'DummyRegressor':
+        base = float(np.ravel(model.init_.constant_)[0])
+    else:
+        raise ValueError(f'Unsupported GradientBoosting init {type(model.init_).__name__}')
+    trees = [_sklearn_tree(estimator) for estimator in model.estimators_[:, 0]]
+    return _flatten_trees(trees, [model.learning_rate] * len(trees), base, strict=False)
+
+
+def _export_xgboost(model):
+    learner = json.loads(model.get_booster().save_raw(raw_format='json'))['learner']
+    if learner['objective']['name'] not in ('reg:squarederror', 'reg:linear'):
+        raise ValueError(f"Unsupported XGBoost objective {learner['objective']['name']}")
+    if learner['gradient_booster']['name'] != 'gbtree':
+        raise ValueError(f"Unsupported XGBoost booster {learner['gradient_booster']['name']}")
+    if getattr(model, 'best_iteration', None) is not None and model.best_iteration + 1 < model.n_estimators:
+        raise ValueError('XGBoost models trained with early stopping are not supported')
+    trees = []
+    for tree in learner['gradient_booster']['model']['trees']:
+        if tree.get('categories_nodes'):
+            raise ValueError('XGBoost categorical splits are not supported')
+        left = np.asarray(tree['left_children'])
+        # leaves store their output in split_conditions
+        split_conditions = np.asarray(tree['split_conditions'], dtype=np.float32)
+        trees.append((
+            np.where(left < 0, -1, tree['split_indices']),
+            split_conditions,
+            left,
+            np.asarray(tree['right_children']),
+            np.where(left < 0, split_conditions, 0.0),
+            np.asarray(tree['default_left'], dtype=bool)
+        ))
+    base = float(learner['learner_model_param']['base_score'].strip('[]'))
+    return _flatten_trees(trees, [1.0] * len(trees), base, strict=True)
+
+
+def export_model(model):
+    """
+    Function to convert a fitted regressor into an ExportedModel
+
+    model: fitted model returned by ModelTrainer
+
+    Returns:
+        ExportedModel
+
+    Raises:
+        ValueError: when the model type cannot be exported
+    """
+    model_type = type(model).__name__
+    if model_type in LINEAR_MODELS:
+        exported = ExportedModel('linear', None, coef=np.ravel(model.coef_).astype(np.float64),
+                                 intercept=float(np.ravel(model.intercept_)[0]))
+    elif model_type in SKLEARN_TREE_MODELS:
+        exported = _export_sklearn_trees(model)
+    elif model_type == 'XGBRegressor':
+        exported = _export_xgboost(model)
+    else:
+        raise ValueError(f'No compact export for {model_type}')
+    exported.source = model_type
+    return exported
+
+
+def parity_error(model, exported, X):
+    """
+    Function to measure how far an ExportedModel is from the original model
+
+    model: fitted regressor
+    exported: ExportedModel built from model
+    X: transformed rows
+
+    Returns:
+        float: largest absolute difference relative to the largest prediction. XGBoost
+               sums its trees in float32, so it is not bit identical to the export.
+    """
+    expected = np.asarray(model.predict(X), dtype=np.float64)
+    actual = exported.predict(X)
+    return float(np.max(np.abs(actual - expected)) / max(float(np.max(np.abs(expected))), 1.0))
+
+
+def export_inference_artifacts(model, preprocessor, file_path, X_check, tolerance=1e-5):
+    """
+    Function to write the compiled preprocessor and the exported model to file_path after
+    checking that the exported model reproduces model.predict on X_check. A stale export
+    is removed when the model cannot be exported, so PredictPipeline falls back to the pickle.
+
+    model: fitted regressor
+    preprocessor: fitted ColumnTransformer
+    file_path: destination of the export
+    X_check: transformed rows used for the parity check
+    tolerance: largest accepted parity_error
+
+    Returns:
+        bool: True when the export was written
+    """
+    try:
+        try:
+            compiled = compile_preprocessor(preprocessor)
+            if compiled is None:
+                raise ValueError('preprocessor could not be compiled')
+            exported = export_model(model)
+            error = parity_error(model, exported, X_check)
+            if error > tolerance:
+                raise ValueError(f'exported {exported.source} differs from the original by {error:.2e}')
+        except ValueError as e:
+            logging.info(f'Model not exported, serving will use the pickled model: {e}')
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            return False
+
+        save_object(file_path=file_path, obj={'preprocessor': compiled, 'model': exported})
+        logging.info(f'Exported {exported.source} to {file_path}, parity error {error:.2e} on {len(X_check)} rows')
+        return True
+    except Exception as e:
+        raise DiamondException(e, sys)
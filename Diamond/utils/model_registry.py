@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import stat
+import shutil
+import threading
+from datetime import datetime
+from Diamond.logger import logging
+from Diamond.exception import DiamondException
+
+REGISTRY_DIR = os.path.join('artifacts', 'model_registry')
+
+# Pointer files holding the version served to users and the version scored in shadow
+ACTIVE_POINTER = 'ACTIVE'
+CANDIDATE_POINTER = 'CANDIDATE'
+
+
+class ModelRegistry:
+    def __init__(self, root=REGISTRY_DIR):
+        """
+        ModelRegistry keeps every trained model in its own immutable version directory
+        (root/versions/v0001, ...) with a metadata.json. The active and candidate versions
+        are named by small pointer files that are replaced atomically, so serving switches
+        from one complete version to another and never sees a half written model.
+
+        :param root: directory of the registry
+        """
+        self.root = root
+        self.versions_dir = os.path.join(root, 'versions')
+        self._lock = threading.Lock()
+        # pointer name -> ((mtime_ns, size), version), re-read only when the file changes
+        self._pointers = {}
+
+    def version_dir(self, version):
+        return os.path.join(self.versions_dir, version)
+
+    def path(self, version, file_name):
+        return os.path.join(self.version_dir(version), file_name)
+
+    def list_versions(self):
+        if not os.path.isdir(self.versions_dir):
+            return []
+        return sorted(name for name in os.listdir(self.versions_dir) if not name.startswith('.'))
+
+    def metadata(self, version):
+        with open(self.path(version, 'metadata.json')) as metadata_file:
+            return json.load(metadata_file)
+
+    def register(self, files, metadata=None):
+        """
+        register copies files into a new version directory and makes them read-only
+        Args: files dict of file name in the version -> source path, metadata dict stored with it
+        Returns: the new version name
+        Raises: DiamondException
+        """
+        try:
+            os.makedirs(self.versions_dir, exist_ok=True)
+            with self._lock:
+                versions = self.list_versions()
+                version = f'v{int(versions[-1][1:]) + 1 if versions else 1:04d}'
+                # Built under a hidden name and renamed, so a version directory is always complete
+                tmp_dir = os.path.join(self.versions_dir, f'.{version}.tmp')
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                os.makedirs(tmp_dir)
+                for file_name, source_path in files.items():
+                    shutil.copyfile(source_path, os.path.join(tmp_dir, file_name))
+                with open(os.path.join(tmp_dir, 'metadata.json'), 'w') as metadata_file:
+                    json.dump(dict(metadata or {}, version=version, files=sorted(files),
+                                   created_at=datetime.now().isoformat(timespec='seconds')),
+                              metadata_file, indent=4)
+                for file_name in os.listdir(tmp_dir):
+                    os.chmod(os.path.join(tmp_dir, file_name), stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                os.rename(tmp_dir, self.version_dir(version))
+            logging.info(f'Model registered as version {version}')
+            return version
+        except Exception as e:
+            logging.info('Exception occured while registering a model')
+            raise DiamondException(e, sys)
+
+    def _read_pointer(self, name):
+        file_path = os.path.join(self.root, name)
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        signature = (st.st_mtime_ns, st.st_size)
+        cached = self._pointers.get(name)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        with open(file_path) as pointer_file:
+            version = pointer_file.read().strip() or None
+        self._pointers[name] = (signature, version)
+        return version
+
+    def _write_pointer(self, name, version):
+        if version is not None and not os.path.isdir(self.version_dir(version)):
+            raise ValueError(f'Unknown model version {version}')
+        os.makedirs(self.root, exist_ok=True)
+        file_path = os.path.join(self.root, name)
+        if version is None:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            return
+        tmp_path = f'{file_path}.tmp'
+        with open(tmp_path, 'w') as pointer_file:
+            pointer_file.write(version)
+            pointer_file.flush()
+            os.fsync(pointer_file.fileno())
+        os.replace(tmp_path, file_path)
+
+    def active_version(self):
+        return self._read_pointer(ACTIVE_POINTER)
+
+    def candidate_version(self):
+        return self._read_pointer(CANDIDATE_POINTER)
+
+    def activate(self, version):
+        """
+        activate points serving at version, the candidate pointer is cleared when it named version
+        """
+        try:
+            self._write_pointer(ACTIVE_POINTER, version)
+            if self.candidate_version() == version:
+                self._write_pointer(CANDIDATE_POINTER, None)
+            logging.info(f'Model version {version} activated')
+        except Exception as e:
+            raise DiamondException(e, sys)
+
+    def set_candidate(self, version):
+        """
+        set_candidate selects the version scored in shadow next to the active one, None clears it
+        """
+        try:
+            self._write_pointer(CANDIDATE_POINTER, version)
+            logging.info(f'Shadow candidate set to {version}')
+        except Exception as e:
+            raise DiamondException(e, sys)
+
+
+if __name__ == '__main__':
+    # python -m Diamond.utils.model_registry [list | activate <version> | candidate <version> | clear-candidate]
+    registry = ModelRegistry()
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+    if command == 'activate':
+        registry.activate(sys.argv[2])
+    elif command == 'candidate':
+        registry.set_candidate(sys.argv[2])
+    elif command == 'clear-candidate':
+        registry.set_candidate(None)
+    active, candidate = registry.active_version(), registry.candidate_version()
+    for version in registry.list_versions():
+        metadata = registry.metadata(version)
+        flag = 'active' if version == active else 'candidate' if version == candidate else ''
+        print(f"{version}  {metadata.get('model_name', ''):<18} r2 {metadata.get('r2', float('nan')):.4f}  "
+              f"{metadata['created_at']}  {flag}")
@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from Diamond.logger import logging
+from Diamond.exception import DiamondException
+
+
+class SqlitePredictionStore:
+    def __init__(self, file_path, max_entries=1_000_000):
+        """
+        SqlitePredictionStore is a file backed prediction store shared by every worker
+        process on the host. Entries are keyed on the model version and the feature key.
+        Like the in-process cache it is bounded: expired rows and the least recently used
+        rows beyond max_entries are deleted every prune_every writes of a process, so the
+        table can exceed max_entries by at most prune_every rows per worker.
+
+        :param file_path: path of the SQLite database file
+        :param max_entries: maximum number of rows kept in the table
+        """
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.prune_every = max(1, min(1000, max_entries // 10))
+        self._writes = 0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS predictions ('
+            'version TEXT, key TEXT, price REAL, expires_at REAL, last_used REAL DEFAULT 0, '
+            'PRIMARY KEY (version, key))'
+        )
+        columns = [row[1] for row in connection.execute('PRAGMA table_info(predictions)')]
+        if 'last_used' not in columns:
+            # stores created before the row cap
+            connection.execute('ALTER TABLE predictions ADD COLUMN last_used REAL DEFAULT 0')
+        connection.execute('CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)')
+        connection.commit()
+
+    def _connection(self):
+        # SQLite connections cannot be shared between threads, keep one per thread
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.file_path, timeout=1.0)
+            connection.execute('PRAGMA synchronous=OFF')
+            self._local.connection = connection
+        return connection
+
+    def get(self, version, key):
+        connection = self._connection()
+        row = connection.execute(
+            'SELECT price, expires_at FROM predictions WHERE version = ? AND key = ?', (version, key)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        # shared lookups only happen on a local miss, so this write stays rare
+        connection.execute('UPDATE predictions SET last_used = ? WHERE version = ? AND key = ?',
+                           (time.time(), version, key))
+        connection.commit()
+        return row[0]
+
+    def put(self, version, key, price, expires_at):
+        connection = self._connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO predictions (version, key, price, expires_at, last_used) VALUES (?, ?, ?, ?, ?)',
+            (version, key, price, expires_at, time.time())
+        )
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune(connection)
+        connection.commit()
+
+    def prune(self, connection=None):
+        """
+        Delete expired rows and the least recently used rows beyond max_entries
+        """
+        connection = connection or self._connection()
+        connection.execute('DELETE FROM predictions WHERE expires_at < ?', (time.time(),))
+        connection.execute(
+            'DELETE FROM predictions WHERE rowid IN '
+            '(SELECT rowid FROM predictions ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,)
+        )
+        connection.commit()
+
+    def count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+
+    def drop_other_versions(self, version):
+        connection = self._connection()
+        connection.execute('DELETE FROM predictions WHERE version != ? OR expires_at < ?', (version, time.time()))
+        connection.commit()
+
+
+class PredictionCache:
+    def __init__(self, max_entries=100_000, ttl_seconds=3600, shared_store=None):
+        """
+        PredictionCache is a bounded LRU/TTL cache of predicted prices keyed on the
+        canonical feature tuple of a diamond. It is emptied when the model version changes.
+
+        :param max_entries: maximum number of entries kept in process memory
+        :param ttl_seconds: lifetime of an entry
+        :param shared_store: optional SqlitePredictionStore shared between workers
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared_store = shared_store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.version = None
+        self.memory_bytes = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _entry_size(key):
+        # key tuple and its items, plus the (price, expires_at) tuple stored as the value
+        return (sys.getsizeof(key) + sum(sys.getsizeof(item) for item in key)
+                + sys.getsizeof((0.0, 0.0)) + 2 * sys.getsizeof(0.0))
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self.version is not None:
+                logging.info(f'Model version changed to {version}, clearing prediction cache')
+            self._entries.clear()
+            self.memory_bytes = 0
+            self.version = version
+            if self.shared_store is not None:
+                self.shared_store.drop_other_versions(version)
+
+    def get(self, version, key):
+        """
+        Return the cached price for key under model version, or None
+        """
+        try:
+            with self._lock:
+                self._check_version(version)
+                entry = self._entries.get(key)
+                if entry is not None:
+                    if entry[1] >= time.monotonic():
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        return entry[0]
+                    self._remove(key)
+            if self.shared_store is not None:
+                price = self.shared_store.get(version, json.dumps(key))
+                if price is not None:
+                    with self._lock:
+                        self.shared_hits += 1
+                        self._insert(key, price)
+                    return price
+            with self._lock:
+                self.misses += 1
+            return None
+        except Exception as e:
+            raise DiamondException(e, sys)
+
+    def put(self, version, key, price):
+        try:
+            with self._lock:
+                self._check_version(version)
+                self._insert(key, price)
+            if self.shared_store is not None:
+                self.shared_store.put(version, json.dumps(key), price, time.time() + self.ttl_seconds)
+        except Exception as e:
+            raise DiamondException(e, sys)
+
+    def _insert(self, key, price):
+        if key not in self._entries:
+            self.memory_bytes += self._entry_size(key)
+        self._entries[key] = (price, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        del self._entries[key]
+        self.memory_bytes -= self._entry_size(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            stats = {
+                'entries': len(self._entries),
+                'memory_bytes': self.memory_bytes,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+                'version': self.version
+            }
+        if self.shared_store is not None:
+            stats['shared_entries'] = self.shared_store.count()
+        return stats
@@ -0,0 +1,95 @@
+import sys
+import numpy as np
+import pandas as pd
+from Diamond.logger import logging
+from Diamond.exception import DiamondException
+
+
+class StreamingPreprocessorStatistics:
+    def __init__(self, numerical_cols, categorical_cols):
+        """
+        StreamingPreprocessorStatistics keeps exact value counts per column so the
+        imputer medians and most frequent categories can be updated chunk by chunk.
+        The gemstone measurements have few distinct values, so the counts stay small.
+
+        :param numerical_cols: columns imputed with the median
+        :param categorical_cols: columns imputed with the most frequent value
+        """
+        self.numerical_cols = list(numerical_cols)
+        self.categorical_cols = list(categorical_cols)
+        self.counts = {column: pd.Series(dtype='float64') for column in self.numerical_cols + self.categorical_cols}
+        self.n_rows = 0
+
+    def update(self, df):
+        """
+        Add the value counts of a chunk of rows
+        """
+        try:
+            for column, counts in self.counts.items():
+                chunk_counts = df[column].dropna().astype(object if column in self.categorical_cols else 'float64').value_counts()
+                self.counts[column] = counts.add(chunk_counts, fill_value=0)
+            self.n_rows += len(df)
+        except Exception as e:
+            raise DiamondException(e, sys)
+
+    def median(self, column):
+        # Same value as np.median over every non missing row seen so far
+        counts = self.counts[column].sort_index()
+        if counts.empty:
+            return np.nan
+        total = int(counts.sum())
+        cumulative = np.cumsum(counts.to_numpy())
+        values = counts.index.to_numpy(dtype='float64')
+        upper = values[np.searchsorted(cumulative, total // 2 + 1)]
+        if total % 2:
+            return upper
+        lower = values[np.searchsorted(cumulative, total // 2)]
+        return np.mean([lower, upper])
+
+    def most_frequent(self, column):
+        # Ties resolve to the smallest value, as in SimpleImputer(strategy='most_frequent')
+        counts = self.counts[column]
+        if counts.empty:
+            return np.nan
+        return min(counts.index[counts.to_numpy() == counts.max()])
+
+    @staticmethod
+    def reset_scalers(preprocessor):
+        """
+        Forget what the StandardScalers of a fitted ColumnTransformer have seen, so the
+        next update_preprocessor calls fit them from scratch with partial_fit
+        """
+        for name, pipeline, columns in preprocessor.transformers_:
+            if name == 'remainder':
+                continue
+            for step_name, step in pipeline.steps:
+                if type(step).__name__ == 'StandardScaler' and hasattr(step, 'n_samples_seen_'):
+                    del step.n_samples_seen_
+        return preprocessor
+
+    def update_preprocessor(self, preprocessor, df):
+        """
+        update_preprocessor refreshes the imputer statistics of a fitted
+        ColumnTransformer from the counts and feeds df to the scalers with partial_fit
+        Args: preprocessor fitted ColumnTransformer from DataTransformation, df new rows already passed to update
+        Returns: preprocessor
+        """
+        try:
+            for name, pipeline, columns in preprocessor.transformers_:
+                if name == 'remainder':
+                    continue
+                values = df[columns]
+                for step_name, step in pipeline.steps:
+                    step_type = type(step).__name__
+                    if step_type == 'SimpleImputer':
+                        if step.strategy == 'median':
+                            step.statistics_ = np.array([self.median(column) for column in columns])
+                        elif step.strategy == 'most_frequent':
+                            step.statistics_ = np.array([self.most_frequent(column) for column in columns], dtype=object)
+                    elif step_type == 'StandardScaler':
+                        step.partial_fit(values)
+                    values = step.transform(values)
+                logging.info(f'Updated {name} statistics with {len(df)} rows')
+            return preprocessor
+        except Exception as e:
+            raise DiamondException(e, sys)
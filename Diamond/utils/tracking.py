@@ -0,0 +1,243 @@
+import os
+import sys
+import time
+import queue
+import atexit
+import shutil
+import tempfile
+import threading
+import itertools
+from Diamond.logger import logging
+from Diamond.exception import DiamondException
+
+# Limits of one MlflowClient.log_batch call
+MAX_METRICS_PER_BATCH = 1000
+MAX_PARAMS_PER_BATCH = 100
+MAX_ENTITIES_PER_BATCH = 1000
+
+
+class TrackedRun:
+    def __init__(self, key):
+        """
+        Handle of a run created by AsyncTracker.start_run, the MLflow run id is filled in
+        by the background thread once the run exists
+        """
+        self.key = key
+        self.run_id = None
+        self.created = threading.Event()
+
+
+class AsyncTracker:
+    def __init__(self, flush_interval=None, enabled=None):
+        """
+        AsyncTracker buffers MLflow runs, metrics, params, tags, artifacts and models and
+        writes them from a background thread. Consecutive metrics, params and tags of a run
+        are coalesced into MlflowClient.log_batch calls, so callers only pay for a queue put.
+        Everything queued is written before the interpreter exits.
+
+        :param flush_interval: seconds the thread waits to gather a batch, DIAMOND_TRACKING_FLUSH_SECONDS
+        :param enabled: write asynchronously, DIAMOND_TRACKING_ASYNC=0 writes in the caller instead
+        """
+        self.flush_interval = (float(os.environ.get('DIAMOND_TRACKING_FLUSH_SECONDS', 0.5))
+                               if flush_interval is None else flush_interval)
+        self.enabled = os.environ.get('DIAMOND_TRACKING_ASYNC', '1') == '1' if enabled is None else enabled
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._keys = itertools.count()
+        self._thread = None
+        self._pid = None
+        self._client = None
+        self._experiments = {}
+        self.batches = 0
+        self.errors = 0
+        atexit.register(self.close)
+
+    # Producer side, called on the pipeline's critical path
+
+    def _submit(self, op, *args):
+        if not self.enabled:
+            self._execute([(op, args)])
+            return
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Threads do not survive fork, each process gets its own writer
+                    self._queue = queue.Queue()
+                    self._thread = threading.Thread(target=self._run, name='async_tracker', daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+        self._queue.put((op, args))
+
+    def start_run(self, experiment_name=None, run_name=None, tags=None):
+        """
+        Queue the creation of a run
+        Returns: TrackedRun passed to the other logging methods
+        """
+        run = TrackedRun(next(self._keys))
+        self._submit('create_run', run, experiment_name, run_name, dict(tags or {}))
+        return run
+
+    def log_metrics(self, run, metrics, step=0):
+        timestamp = int(time.time() * 1000)
+        for key, value in metrics.items():
+            self._submit('metric', run, key, float(value), timestamp, step)
+
+    def log_metric(self, run, key, value, step=0):
+        self.log_metrics(run, {key: value}, step=step)
+
+    def log_params(self, run, params):
+        for key, value in params.items():
+            self._submit('param', run, key, str(value))
+
+    def log_param(self, run, key, value):
+        self.log_params(run, {key: value})
+
+    def set_tags(self, run, tags):
+        for key, value in tags.items():
+            self._submit('tag', run, key, str(value))
+
+    def log_artifact(self, run, local_path, artifact_path=None):
+        self._submit('artifact', run, local_path, artifact_path)
+
+    def log_model(self, run, model, artifact_path='model', registered_model_name=None):
+        """
+        Queue an sklearn compatible model, it is saved with mlflow.sklearn in the background
+        thread. The caller must not modify the model afterwards.
+        """
+        self._submit('model', run, model, artifact_path, registered_model_name)
+
+    def end_run(self, run, status='FINISHED'):
+        self._submit('end_run', run, status)
+
+    def flush(self):
+        """
+        Block until every queued operation has been written
+        """
+        if self.enabled and self._pid == os.getpid() and self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logging.info(f'Tracking data could not be flushed: {e}')
+
+    # Writer side, runs in the background thread
+
+    def _run(self):
+        while True:
+            ops = [self._queue.get()]
+            # Gather what arrives within flush_interval into one batch
+            deadline = time.monotonic() + self.flush_interval
+            while len(ops) < MAX_ENTITIES_PER_BATCH:
+                timeout = deadline - time.monotonic()
+                try:
+                    ops.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._execute(ops)
+            except Exception as e:
+                # the thread must survive, close() waits for it at exit
+                self.errors += 1
+                logging.info(f'MLflow tracking failed: {DiamondException(e, sys)}')
+            finally:
+                for _ in ops:
+                    self._queue.task_done()
+
+    def _get_client(self):
+        if self._client is None:
+            from mlflow.tracking import MlflowClient
+            self._client = MlflowClient()
+        return self._client
+
+    def _experiment_id(self, experiment_name):
+        name = experiment_name or os.environ.get('MLFLOW_EXPERIMENT_NAME')
+        if name is None:
+            return '0'
+        if name not in self._experiments:
+            client = self._get_client()
+            experiment = client.get_experiment_by_name(name)
+            self._experiments[name] = experiment.experiment_id if experiment else client.create_experiment(name)
+        return self._experiments[name]
+
+    def _execute(self, ops):
+        from mlflow.entities import Metric, Param, RunTag
+
+        # run key -> (run, metrics, params, tags) waiting for a log_batch call
+        buffers = {}
+
+        def flush_buffers():
+            # popped first, so a failed log_batch is not sent again with the next operation
+            for key in list(buffers):
+                run, metrics, params, tags = buffers.pop(key)
+                if run.run_id is None:
+                    continue
+                while metrics or params or tags:
+                    n_params = min(len(params), MAX_PARAMS_PER_BATCH)
+                    n_tags = min(len(tags), MAX_PARAMS_PER_BATCH - n_params)
+                    n_metrics = min(len(metrics), MAX_METRICS_PER_BATCH, MAX_ENTITIES_PER_BATCH - n_params - n_tags)
+                    self._get_client().log_batch(run.run_id, metrics=metrics[:n_metrics],
+                                                 params=params[:n_params], tags=tags[:n_tags])
+                    del metrics[:n_metrics], params[:n_params], tags[:n_tags]
+                    self.batches += 1
+
+        def try_flush_buffers():
+            # a failed log_batch must not skip the operation that follows, e.g. end_run
+            try:
+                flush_buffers()
+            except Exception as e:
+                self.errors += 1
+                logging.info(f'MLflow tracking log_batch failed: {DiamondException(e, sys)}')
+
+        for op, args in ops:
+            run = args[0]
+            if op in ('metric', 'param', 'tag'):
+                _, metrics, params, tags = buffers.setdefault(run.key, (run, [], [], []))
+                if op == 'metric':
+                    metrics.append(Metric(*args[1:]))
+                elif op == 'param':
+                    params.append(Param(*args[1:]))
+                else:
+                    tags.append(RunTag(*args[1:]))
+                continue
+
+            # Anything else is written after the buffered values that were queued before it
+            try_flush_buffers()
+            try:
+                if op == 'create_run':
+                    _, experiment_name, run_name, tags = args
+                    run.run_id = self._get_client().create_run(
+                        self._experiment_id(experiment_name), run_name=run_name, tags=tags
+                    ).info.run_id
+                    run.created.set()
+                elif run.run_id is None:
+                    continue
+                elif op == 'artifact':
+                    self._get_client().log_artifact(run.run_id, *args[1:])
+                elif op == 'model':
+                    self._log_model(run, *args[1:])
+                elif op == 'end_run':
+                    self._get_client().set_terminated(run.run_id, args[1])
+            except Exception as e:
+                self.errors += 1
+                logging.info(f'MLflow tracking {op} failed: {DiamondException(e, sys)}')
+        try_flush_buffers()
+
+    def _log_model(self, run, model, artifact_path, registered_model_name):
+        import mlflow
+        import mlflow.sklearn
+
+        local_dir = tempfile.mkdtemp()
+        try:
+            model_dir = os.path.join(local_dir, artifact_path)
+            mlflow.sklearn.save_model(model, model_dir)
+            self._get_client().log_artifacts(run.run_id, model_dir, artifact_path)
+            if registered_model_name is not None:
+                mlflow.register_model(f'runs:/{run.run_id}/{artifact_path}', registered_model_name)
+        finally:
+            shutil.rmtree(local_dir, ignore_errors=True)
+
+
+# Process wide tracker
+tracker = AsyncTracker()
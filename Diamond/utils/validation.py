@@ -0,0 +1,151 @@
+import sys
+import numpy as np
+from Diamond.constants import NUMERICAL_COLUMNS, CATEGORICAL_COLUMNS, FEATURE_COLUMNS, NUMERICAL_RANGES, CATEGORIES
+
+# Batches from this size use the pandas hash table lookup when pandas is already loaded
+HASHED_LOOKUP_MIN_ROWS = 10_000
+
+
+def _as_float(values):
+    try:
+        array = np.asarray(values, dtype=np.float64)
+        if array.ndim == 1:
+            return array
+    except (TypeError, ValueError):
+        pass
+
+    # Some entries are not numbers, only this slower path converts them one by one
+    def to_float(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return np.nan
+    return np.fromiter((to_float(value) for value in values), dtype=np.float64, count=len(values))
+
+
+def _as_object(values):
+    array = np.asarray(values, dtype=object)
+    if array.ndim != 1:
+        # nested sequences in JSON input, keep one entry per row
+        array = np.empty(len(values), dtype=object)
+        for index, value in enumerate(values):
+            array[index] = value
+    return array
+
+
+class ValidationResult:
+    def __init__(self, columns, codes, valid, errors):
+        """
+        ValidationResult holds a validated batch: the converted feature columns, the
+        ordinal codes of the categorical columns (-1 when unknown) that the compiled
+        preprocessor reuses instead of encoding the labels again, the mask of valid rows
+        and one error message per row, None for valid rows.
+        """
+        self.columns = columns
+        self.codes = codes
+        self.valid = valid
+        self.errors = errors
+
+    def __len__(self):
+        return len(self.errors)
+
+    @property
+    def all_valid(self):
+        return bool(self.valid.all())
+
+    def valid_features(self):
+        """
+        Return the valid rows as a mapping of column name to array, accepted by PredictPipeline.predict
+        """
+        if self.all_valid:
+            return self.columns
+        return {column: values[self.valid] for column, values in self.columns.items()}
+
+    def valid_codes(self):
+        """
+        Return the ordinal codes of the valid rows, passed to PredictPipeline.predict so
+        the labels are not encoded a second time
+        """
+        if self.all_valid:
+            return self.codes
+        return {column: codes[self.valid] for column, codes in self.codes.items()}
+
+
+class DiamondValidator:
+    def __init__(self, ranges=None, categories=None):
+        """
+        DiamondValidator checks whole batches of prediction inputs with array operations:
+        numbers must be finite and inside NUMERICAL_RANGES, categorical labels must be one
+        of CATEGORIES. Invalid rows are reported in the result instead of raising, so they
+        never abort the batch or reach the OrdinalEncoder.
+
+        :param ranges: dict column -> (min, max), NUMERICAL_RANGES by default
+        :param categories: dict column -> ordered labels, CATEGORIES by default
+        """
+        self.ranges = ranges or NUMERICAL_RANGES
+        self.categories = categories or CATEGORIES
+        # Sorted labels with their ordinal rank, so a column is looked up with one searchsorted
+        self.lookup_tables = {}
+        for column, labels in self.categories.items():
+            labels = np.asarray(labels, dtype=str)
+            order = np.argsort(labels)
+            self.lookup_tables[column] = (labels[order], order.astype(np.int8))
+
+    def encode(self, column, values):
+        """
+        Return the ordinal codes of a categorical column, -1 for unknown labels
+        """
+        if len(values) >= HASHED_LOOKUP_MIN_ROWS and 'pandas' in sys.modules:
+            # large batches come from pandas callers, its hash table lookup beats sorting strings
+            import pandas as pd
+            try:
+                return pd.Categorical(values, categories=self.categories[column]).codes.astype(np.int8)
+            except TypeError:
+                pass
+        sorted_labels, ranks = self.lookup_tables[column]
+        values = _as_object(values)
+        try:
+            values = values.astype(str)
+        except ValueError:
+            # sequences nested in the input cannot be cast as a whole
+            values = np.array([str(value) for value in values], dtype=str)
+        position = np.minimum(np.searchsorted(sorted_labels, values), len(sorted_labels) - 1)
+        return np.where(sorted_labels[position] == values, ranks[position], np.int8(-1))
+
+    def validate(self, features):
+        """
+        validate converts and checks a batch of diamonds
+        Args: features DataFrame or mapping of column name to a sequence of values
+        Returns: ValidationResult
+        Raises: ValueError when features has none of the FEATURE_COLUMNS
+        """
+        present = [column for column in FEATURE_COLUMNS if column in features]
+        if not present:
+            raise ValueError(f'validate needs at least one of the columns {FEATURE_COLUMNS}')
+        n_rows = len(features[present[0]])
+        columns, codes, checks = {}, {}, []
+        for column in NUMERICAL_COLUMNS:
+            values = _as_float(features[column]) if column in features else np.full(n_rows, np.nan)
+            low, high = self.ranges[column]
+            checks.append((~np.isfinite(values), f'{column} must be a number'))
+            # NaN compares False, so missing values are only reported once
+            checks.append(((values < low) | (values > high), f'{column} must be between {low} and {high}'))
+            columns[column] = values
+        for column in CATEGORICAL_COLUMNS:
+            values = _as_object(features[column]) if column in features else np.full(n_rows, None, dtype=object)
+            codes[column] = self.encode(column, values)
+            checks.append((codes[column] < 0, f'{column} must be one of {self.categories[column]}'))
+            columns[column] = values
+
+        valid = np.ones(n_rows, dtype=bool)
+        errors = np.full(n_rows, None, dtype=object)
+        # Applied last to first so every row reports its first failed check
+        for mask, message in reversed(checks):
+            if mask.any():
+                errors[mask] = message
+                valid &= ~mask
+        return ValidationResult(columns, codes, valid, errors.tolist())
+
+
+# Shared instance, the lookup tables are built once per process
+validator = DiamondValidator()
@@ -1,10 +1,20 @@
     
+import time
+_startup_begin=time.perf_counter()
+
+import os
+import json
+from Diamond.logger import logging, hot_path_logger
 from Diamond.pipelines.prediction_pipeline import DiamondData,PredictPipeline
+from Diamond.constants import FEATURE_COLUMNS
+from Diamond.utils.validation import validator
+from Diamond.utils.instrumentation import metrics
 
-from flask import Flask,request,render_template,jsonify
+from flask import Flask,request,render_template,jsonify,Response,stream_with_context
 
 
 app=Flask(__name__)
+app.config['PREDICT_BATCH_CHUNK_SIZE']=int(os.environ.get('DIAMOND_BATCH_CHUNK_SIZE',10000))
 
 
 @app.route('/')
@@ -18,29 +28,74 @@ def predict_datapoint():
         return render_template("form.html")
     
     else:
-        data=DiamondData(
-            
-            carat=float(request.form.get('carat')),
-            depth = float(request.form.get('depth')),
-            table = float(request.form.get('table')),
-            x = float(request.form.get('x')),
-            y = float(request.form.get('y')),
-            z = float(request.form.get('z')),
-            cut = request.form.get('cut'),
-            color= request.form.get('color'),
-            clarity = request.form.get('clarity')
-        )
-        # this is my final data
-        final_data=data.get_data_as_dataframe()
-        
+        form={column:[request.form.get(column)] for column in FEATURE_COLUMNS}
+        result=validator.validate(form)
+        if not result.all_valid:
+            return render_template("form.html",error=result.errors[0]),400
+        data=DiamondData(**{column:values[0] for column,values in result.columns.items()})
         predict_pipeline=PredictPipeline()
         
-        pred=predict_pipeline.predict(final_data)
+        # repeated specs are served from the prediction cache
+        pred=predict_pipeline.predict_data(data)
         
-        result=round(pred[0],2)
+        result=round(pred,2)
         
         return render_template("result.html",final_result=result)
 
+
+@app.route("/stats",methods=["GET"])
+def stats():
+    return jsonify(PredictPipeline().cache_stats())
+
+
+@app.route("/predict_batch",methods=["POST"])
+def predict_batch():
+    # Accept either a JSON array / {"diamonds": [...]} body or NDJSON with one diamond per line
+    if request.mimetype in ("application/x-ndjson","application/ndjson"):
+        try:
+            records=[json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        except ValueError as e:
+            return jsonify(error=f"invalid NDJSON body: {e}"),400
+    else:
+        payload=request.get_json(silent=True)
+        records=payload.get("diamonds") if isinstance(payload,dict) else payload
+        if not isinstance(records,list):
+            return jsonify(error="expected a JSON array of diamonds or an object with a 'diamonds' array"),400
+    if not all(isinstance(record,dict) for record in records):
+        return jsonify(error="every diamond must be a JSON object"),400
+
+    chunk_size=request.args.get("chunk_size",app.config['PREDICT_BATCH_CHUNK_SIZE'],type=int)
+    if chunk_size is None or chunk_size<=0:
+        return jsonify(error="chunk_size must be a positive integer"),400
+
+    # one vectorized validation for the whole body, invalid rows are reported and skipped
+    result=validator.validate(DiamondData.records_as_columns(records))
+    hot_path_logger.info('Batch validated with %d rows, %d invalid',len(result),len(result)-int(result.valid.sum()))
+    predict_pipeline=PredictPipeline()
+
+    def generate():
+        for start in range(0,len(result),chunk_size):
+            chunk_errors=result.errors[start:start+chunk_size]
+            valid=result.valid[start:start+chunk_size]
+            chunk={column:values[start:start+chunk_size][valid] for column,values in result.columns.items()}
+            codes={column:values[start:start+chunk_size][valid] for column,values in result.codes.items()}
+            # one transform and one predict call for all valid rows of the chunk
+            preds=iter(predict_pipeline.predict(chunk,shadow=True,codes=codes) if valid.any() else [])
+            lines=[]
+            for offset,error in enumerate(chunk_errors):
+                if error is None:
+                    lines.append(json.dumps({"index":start+offset,"price":round(float(next(preds)),2)}))
+                else:
+                    lines.append(json.dumps({"index":start+offset,"error":error}))
+            yield "\n".join(lines)+"\n"
+
+    return Response(stream_with_context(generate()),mimetype="application/x-ndjson")
+
+# time spent importing the serving modules and creating the app, tracked by benchmarks/run_benchmarks.py
+app.config['STARTUP_SECONDS']=time.perf_counter()-_startup_begin
+metrics.observe('serving.startup',app.config['STARTUP_SECONDS'])
+logging.info(f"Serving app started in {app.config['STARTUP_SECONDS']:.3f}s")
+
 #execution begin
 if __name__ == '__main__':
-    app.run(host="0.0.0.0",port=80)
\ No newline at end of file
+    app.run(host="0.0.0.0",port=80)
@@ -0,0 +1,99 @@
+"""
+ASGI serving mode with request micro-batching.
+
+Concurrent /predict calls are collected for up to DIAMOND_BATCH_MAX_WAIT_MS
+milliseconds or DIAMOND_BATCH_MAX_SIZE rows and scored with one vectorized
+predict call in a worker thread.
+
+Run with: uvicorn asgi:app --host 0.0.0.0 --port 80
+"""
+import os
+import json
+from Diamond.logger import logging
+from Diamond.constants import NUMERICAL_COLUMNS, CATEGORICAL_COLUMNS, FEATURE_COLUMNS
+from Diamond.pipelines.prediction_pipeline import PredictPipeline
+from Diamond.pipelines.micro_batcher import MicroBatcher
+from Diamond.utils.instrumentation import metrics
+from Diamond.utils.validation import validator
+
+micro_batcher = MicroBatcher(
+    PredictPipeline(),
+    max_batch_size=int(os.environ.get('DIAMOND_BATCH_MAX_SIZE', 64)),
+    max_wait_ms=float(os.environ.get('DIAMOND_BATCH_MAX_WAIT_MS', 5))
+)
+
+
+def parse_diamond(payload):
+    """
+    Convert a JSON object into the feature row expected by the micro-batcher
+    Raises ValueError with a message for the client on invalid input
+    """
+    if not isinstance(payload, dict):
+        raise ValueError('expected a JSON object describing one diamond')
+    for column in CATEGORICAL_COLUMNS:
+        if not isinstance(payload.get(column), str):
+            raise ValueError(f'{column} must be a string')
+    result = validator.validate({column: [payload.get(column)] for column in FEATURE_COLUMNS})
+    if not result.all_valid:
+        raise ValueError(result.errors[0])
+    return {column: values[0].item() if column in NUMERICAL_COLUMNS else values[0]
+            for column, values in result.columns.items()}
+
+
+async def read_body(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await micro_batcher.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await micro_batcher.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    path, method = scope['path'], scope['method']
+    if path == '/health' and method == 'GET':
+        return await send_json(send, 200, {'status': 'ok', 'metrics': metrics.snapshot()['counters']})
+    if path != '/predict':
+        return await send_json(send, 404, {'error': 'not found'})
+    if method != 'POST':
+        return await send_json(send, 405, {'error': 'method not allowed'})
+
+    try:
+        row = parse_diamond(json.loads(await read_body(receive)))
+    except ValueError as e:
+        return await send_json(send, 400, {'error': str(e)})
+
+    try:
+        prediction = await micro_batcher.predict(row)
+    except Exception as e:
+        logging.error(f'Prediction failed: {e}')
+        return await send_json(send, 422, {'error': 'prediction failed for this diamond'})
+    return await send_json(send, 200, {'price': round(prediction, 2)})
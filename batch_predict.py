@@ -0,0 +1,21 @@
+"""
+Score a whole file of diamonds with the trained artifacts.
+
+Usage:
+    python batch_predict.py inventory.csv predictions.parquet --workers 8 --chunk-size 100000
+"""
+import argparse
+from Diamond.pipelines.batch_prediction_pipeline import BatchPredictionPipeline, BatchPredictionConfig
+
+parser = argparse.ArgumentParser(description='Bulk diamond price prediction')
+parser.add_argument('input_path', help='csv, parquet or feather file with the diamond features')
+parser.add_argument('output_path', help='destination, the input rows plus a prediction column')
+parser.add_argument('--workers', type=int, default=BatchPredictionConfig.n_workers)
+parser.add_argument('--chunk-size', type=int, default=BatchPredictionConfig.chunk_size)
+parser.add_argument('--result-timeout', type=float, default=BatchPredictionConfig.result_timeout,
+                    help='seconds to wait for a chunk before failing the run')
+args = parser.parse_args()
+
+config = BatchPredictionConfig(chunk_size=args.chunk_size, n_workers=args.workers, result_timeout=args.result_timeout)
+summary = BatchPredictionPipeline(config).predict_file(args.input_path, args.output_path)
+print(f"{summary['rows']} rows in {summary['seconds']:.1f}s ({summary['rows_per_second']:.0f} rows/s)")
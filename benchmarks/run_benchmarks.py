@@ -0,0 +1,229 @@
+"""
+Benchmark suite for the training and prediction pipelines.
+
+Synthetic gemstone-shaped datasets are generated at each requested scale and every
+TrainingPipeline stage, PredictPipeline latency (single row and batch) and the peak
+RSS of each step are measured. Results are written as JSON and compared against a
+stored baseline; the script exits with status 1 when a metric regresses by more
+than the tolerance.
+
+Usage:
+    python benchmarks/run_benchmarks.py --scales 10000 1000000 10000000
+    python benchmarks/run_benchmarks.py --update-baseline
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Diamond.constants import CUT_CATEGORIES, COLOR_CATEGORIES, CLARITY_CATEGORIES
+from Diamond.utils.memory import PeakMemorySampler
+
+DEFAULT_SCALES = [10_000, 1_000_000, 10_000_000]
+DEFAULT_MODELS = ['LinearRegression', 'DecisionTree', 'XGBoost']
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE_PATH = os.path.join(REPO_DIR, 'benchmarks', 'baseline.json')
+
+# Heavy training libraries that the serving process must not import at startup
+TRAINING_ONLY_MODULES = ('sklearn', 'pandas', 'mlflow', 'catboost', 'xgboost')
+
+# Metrics compared against the baseline, lower is better for all of them
+COMPARED_METRICS = ('seconds', 'peak_rss_mb', 'p50_ms', 'p99_ms')
+
+
+def make_synthetic_gemstone(n_rows, file_path, chunk_size=1_000_000, seed=42):
+    """
+    Write a gemstone.csv shaped dataset of n_rows rows in chunks
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w') as file_obj:
+        file_obj.write('id,carat,cut,color,clarity,depth,table,x,y,z,price\n')
+        for start in range(0, n_rows, chunk_size):
+            n = min(chunk_size, n_rows - start)
+            carat = np.round(rng.gamma(2.0, 0.4, n) + 0.2, 2)
+            cut = np.asarray(CUT_CATEGORIES, dtype=object)[rng.integers(0, len(CUT_CATEGORIES), n)]
+            color = np.asarray(COLOR_CATEGORIES, dtype=object)[rng.integers(0, len(COLOR_CATEGORIES), n)]
+            clarity = np.asarray(CLARITY_CATEGORIES, dtype=object)[rng.integers(0, len(CLARITY_CATEGORIES), n)]
+            depth = np.round(rng.normal(61.8, 1.2, n), 1)
+            table = np.round(rng.normal(57.3, 2.0, n), 1)
+            x = np.round(6.4 * carat ** (1 / 3) + rng.normal(0, 0.05, n), 2)
+            y = np.round(x + rng.normal(0, 0.05, n), 2)
+            z = np.round(x * depth / 100, 2)
+            price = np.maximum(np.round(3500 * carat ** 1.7 + rng.normal(0, 300, n)), 300).astype(np.int64)
+            ids = np.arange(start, start + n)
+            lines = [
+                f'{i},{c},{cu},{co},{cl},{d},{t},{xx},{yy},{zz},{p}'
+                for i, c, cu, co, cl, d, t, xx, yy, zz, p
+                in zip(ids, carat, cut, color, clarity, depth, table, x, y, z, price)
+            ]
+            file_obj.write('\n'.join(lines) + '\n')
+
+
+def measure(results, name, func):
+    with PeakMemorySampler() as sampler:
+        start = time.perf_counter()
+        value = func()
+        seconds = time.perf_counter() - start
+    results[name] = {'seconds': seconds, 'peak_rss_mb': sampler.peak_bytes / 2 ** 20}
+    print(f'  {name}: {seconds:.2f}s, peak RSS {results[name]["peak_rss_mb"]:.0f} MB', flush=True)
+    return value
+
+
+def latency(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'p50_ms': float(np.percentile(timings, 50)), 'p99_ms': float(np.percentile(timings, 99))}
+
+
+def run_scale(n_rows, models, evaluate, predict_repeats, batch_size):
+    from Diamond.components.data_ingestion import DataIngestion
+    from Diamond.components.data_transformation import DataTransformation
+    from Diamond.components.model_trainer import ModelTrainer
+    from Diamond.components.model_search import ModelSearchConfig
+    from Diamond.pipelines.prediction_pipeline import PredictPipeline, DiamondData
+    from Diamond.utils.artifact_store import read_artifact
+
+    results = {}
+    data_ingestion = DataIngestion()
+    make_synthetic_gemstone(n_rows, data_ingestion.ingestion_config.source_data_path)
+
+    train_path, test_path = measure(results, 'data_ingestion', data_ingestion.initiate_data_ingestion)
+    train_arr, test_arr = measure(
+        results, 'data_transformation',
+        lambda: DataTransformation().initialize_data_transformation(train_path, test_path)
+    )
+    model_trainer = ModelTrainer(ModelSearchConfig(candidates=models))
+    measure(results, 'model_trainer', lambda: model_trainer.initiate_model_trainer(train_arr, test_arr))
+    if evaluate:
+        from Diamond.components.model_evaluation import ModelEvaluation
+        measure(results, 'model_evaluation',
+                lambda: ModelEvaluation().initiate_model_evaluation(train_arr, test_arr))
+
+    predict_pipeline = PredictPipeline()
+    measure(results, 'predict_first_load', lambda: predict_pipeline.predict(
+        DiamondData(0.9, 61.5, 57, 6.2, 6.2, 3.8, 'Ideal', 'E', 'VS1').get_data_as_dict()))
+
+    single = DiamondData(0.9, 61.5, 57, 6.2, 6.2, 3.8, 'Ideal', 'E', 'VS1').get_data_as_dict()
+    results['predict_single'] = latency(lambda: predict_pipeline.predict(single), predict_repeats)
+
+    batch = read_artifact(test_path).head(batch_size)
+    results['predict_batch'] = latency(lambda: predict_pipeline.predict(batch), max(predict_repeats // 10, 10))
+    results['predict_batch']['rows'] = len(batch)
+    print(f'  predict_single: {results["predict_single"]}', flush=True)
+    print(f'  predict_batch: {results["predict_batch"]}', flush=True)
+    return results
+
+
+def measure_startup(repeats=5):
+    """
+    Time a cold import of the serving app in fresh interpreters
+    """
+    code = (
+        'import sys, time, json\n'
+        't = time.perf_counter()\n'
+        'import app\n'
+        'print("STARTUP " + json.dumps({"import_seconds": time.perf_counter() - t, '
+        f'"training_modules": [m for m in {TRAINING_ONLY_MODULES!r} if m in sys.modules]}}))\n'
+    )
+    process_timings, import_timings = [], []
+    with tempfile.TemporaryDirectory(prefix='diamond_bench_') as log_dir:
+        env = dict(os.environ, DIAMOND_LOG_FILE=os.path.join(log_dir, 'startup.log'))
+        for _ in range(repeats):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR, env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            process_timings.append(time.perf_counter() - start)
+            line = next(line for line in output.splitlines() if line.startswith('STARTUP '))
+            measured = json.loads(line[len('STARTUP '):])
+            import_timings.append(measured['import_seconds'])
+    results = {
+        'process': {'seconds': float(np.median(process_timings))},
+        'import_app': {'seconds': float(np.median(import_timings)),
+                       'training_modules': measured['training_modules']}
+    }
+    print(f'  startup: {results}', flush=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return the list of metrics that regressed by more than tolerance against the baseline
+    """
+    regressions = []
+    for scale, stages in results.items():
+        for stage, metrics in stages.items():
+            for metric, value in metrics.items():
+                if metric not in COMPARED_METRICS:
+                    continue
+                reference = baseline.get(scale, {}).get(stage, {}).get(metric)
+                if reference and value > reference * (1 + tolerance):
+                    regressions.append(f'{scale}/{stage}/{metric}: {value:.3f} vs baseline {reference:.3f}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Diamond training and prediction pipelines')
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES[:1],
+                        help=f'dataset sizes in rows, e.g. {DEFAULT_SCALES}')
+    parser.add_argument('--models', nargs='+', default=DEFAULT_MODELS, help='ModelTrainer candidates to benchmark')
+    parser.add_argument('--evaluate', action='store_true', help='also benchmark ModelEvaluation (logs to MLflow)')
+    parser.add_argument('--predict-repeats', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=10_000)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=BASELINE_FILE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative slowdown or memory growth before failing')
+    parser.add_argument('--update-baseline', action='store_true', help='store these results as the new baseline')
+    args = parser.parse_args()
+
+    output_path = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline)
+    os.environ['DIAMOND_STAGE_CACHE'] = '0'
+
+    print('Benchmarking serving startup', flush=True)
+    results = {'startup': measure_startup()}
+    cwd = os.getcwd()
+    for n_rows in args.scales:
+        print(f'Benchmarking {n_rows} rows', flush=True)
+        with tempfile.TemporaryDirectory(prefix='diamond_bench_') as work_dir:
+            # Pipeline stages use paths relative to the working directory
+            os.chdir(work_dir)
+            try:
+                results[str(n_rows)] = run_scale(n_rows, args.models, args.evaluate,
+                                                 args.predict_repeats, args.batch_size)
+            finally:
+                os.chdir(cwd)
+
+    with open(output_path, 'w') as output_file:
+        json.dump(results, output_file, indent=4)
+    print(f'Results written to {output_path}')
+
+    if args.update_baseline:
+        with open(baseline_path, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=4)
+        print(f'Baseline updated at {baseline_path}')
+        return 0
+
+    if not os.path.exists(baseline_path):
+        print(f'No baseline at {baseline_path}, run with --update-baseline to create one')
+        return 0
+
+    with open(baseline_path) as baseline_file:
+        regressions = compare(results, json.load(baseline_file), args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
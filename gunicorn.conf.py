@@ -0,0 +1,35 @@
+"""
+Pre-fork serving configuration.
+
+The master imports app.py and loads the preprocessor and the model once before forking,
+so the workers share those pages copy-on-write instead of each unpickling a copy.
+
+Usage:
+    gunicorn -c gunicorn.conf.py app:app
+    python -m Diamond.utils.memory <master pid>     # per worker shared vs unique memory
+"""
+import gc
+import os
+import multiprocessing
+
+bind = os.environ.get('DIAMOND_BIND', '0.0.0.0:80')
+workers = int(os.environ.get('DIAMOND_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('DIAMOND_WORKER_THREADS', 1))
+timeout = 120
+
+# Import the app in the master so the artifacts are loaded before the fork
+preload_app = True
+
+
+def when_ready(server):
+    from Diamond.pipelines.prediction_pipeline import preload_inference_artifacts
+
+    preload_inference_artifacts()
+    # Move everything allocated so far out of the collector's reach, otherwise the first
+    # collection in each worker writes to every tracked object and unshares its page
+    gc.freeze()
+    server.log.info(f'Artifacts preloaded in master {os.getpid()}, {gc.get_freeze_count()} objects frozen')
+
+
+def post_fork(server, worker):
+    server.log.info(f'Worker {worker.pid} forked from master {server.pid}')
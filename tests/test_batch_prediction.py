@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+
+from Diamond.constants import CATEGORIES, FEATURE_COLUMNS
+from Diamond.components.data_transformation import DataTransformation
+from Diamond.pipelines.batch_prediction_pipeline import BatchPredictionPipeline, BatchPredictionConfig
+from Diamond.utils import save_object
+
+
+def make_diamonds(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'id': np.arange(n_rows),
+        'carat': rng.uniform(0.2, 3.0, n_rows),
+        'depth': rng.uniform(55.0, 70.0, n_rows),
+        'table': rng.uniform(50.0, 70.0, n_rows),
+        'x': rng.uniform(3.0, 9.0, n_rows),
+        'y': rng.uniform(3.0, 9.0, n_rows),
+        'z': rng.uniform(2.0, 6.0, n_rows),
+        'cut': rng.choice(CATEGORIES['cut'], n_rows),
+        'color': rng.choice(CATEGORIES['color'], n_rows),
+        'clarity': rng.choice(CATEGORIES['clarity'], n_rows),
+    })
+
+
+def test_malformed_number_does_not_abort_the_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('DIAMOND_MODEL_REGISTRY', '0')
+    df = make_diamonds(200)
+    preprocessor = DataTransformation().get_data_transformation()
+    X = preprocessor.fit_transform(df[FEATURE_COLUMNS])
+    model = LinearRegression().fit(X, 4000 * df['carat'])
+    save_object('artifacts/data_transformation/preprocessor.pkl', preprocessor)
+    save_object('artifacts/model_trainer/model.pkl', model)
+
+    df.to_csv('in.csv', index=False)
+    with open('in.csv', 'a') as file_obj:
+        file_obj.write('200,abc,61.0,57.0,4.0,4.0,2.5,Good,E,VS1\n')
+
+    config = BatchPredictionConfig(chunk_size=64, n_workers=1)
+    summary = BatchPredictionPipeline(config).predict_file('in.csv', 'out.csv')
+
+    out = pd.read_csv('out.csv')
+    assert summary['rows'] == len(out) == 201
+    assert out['prediction'][:200].notna().all()
+    assert np.isnan(out['prediction'].iloc[200])
+    assert out['prediction_error'].iloc[200] == 'carat must be a number'
+    assert out['prediction_error'][:200].isna().all()
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from Diamond.constants import CATEGORIES, FEATURE_COLUMNS
+from Diamond.components.data_transformation import DataTransformation
+from Diamond.utils import load_object
+from Diamond.utils.model_export import export_inference_artifacts
+
+
+def make_diamonds(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'carat': rng.uniform(0.2, 3.0, n_rows),
+        'depth': rng.uniform(55.0, 70.0, n_rows),
+        'table': rng.uniform(50.0, 70.0, n_rows),
+        'x': rng.uniform(3.0, 9.0, n_rows),
+        'y': rng.uniform(3.0, 9.0, n_rows),
+        'z': rng.uniform(2.0, 6.0, n_rows),
+        'cut': rng.choice(CATEGORIES['cut'], n_rows),
+        'color': rng.choice(CATEGORIES['color'], n_rows),
+        'clarity': rng.choice(CATEGORIES['clarity'], n_rows),
+    })
+    price = (4000 * df['carat'] ** 1.5 + 150 * df['cut'].map(CATEGORIES['cut'].index)
+             - 120 * df['color'].map(CATEGORIES['color'].index) + rng.normal(0, 200, n_rows))
+    return df[FEATURE_COLUMNS], price.to_numpy()
+
+
+def get_models():
+    from sklearn.linear_model import LinearRegression, Ridge, Lasso, ElasticNet, SGDRegressor
+    from sklearn.tree import DecisionTreeRegressor
+    from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+
+    models = {
+        'LinearRegression': LinearRegression(),
+        'Ridge': Ridge(),
+        'Lasso': Lasso(),
+        'ElasticNet': ElasticNet(),
+        'SGDRegressor': SGDRegressor(random_state=42),
+        'DecisionTree': DecisionTreeRegressor(random_state=42),
+        'RandomForest': RandomForestRegressor(n_estimators=20, random_state=42),
+        'GradientBoosting': GradientBoostingRegressor(n_estimators=50, random_state=42),
+    }
+    try:
+        from xgboost import XGBRegressor
+        models['XGBoost'] = XGBRegressor(n_estimators=50, max_depth=4)
+    except ImportError:
+        pass
+    return models
+
+
+@pytest.fixture(scope='module')
+def training_data():
+    features, price = make_diamonds(2000)
+    preprocessor = DataTransformation().get_data_transformation()
+    X_train = preprocessor.fit_transform(features)
+    # unseen rows with missing values, which take the imputer and default_left paths
+    new_features, _ = make_diamonds(500, seed=1)
+    new_features = new_features.copy()
+    new_features.loc[::7, 'carat'] = np.nan
+    new_features.loc[::11, 'cut'] = np.nan
+    return preprocessor, X_train, price, new_features
+
+
+@pytest.mark.parametrize('name', list(get_models()))
+def test_export_matches_original_predictions(tmp_path, training_data, name):
+    preprocessor, X_train, price, new_features = training_data
+    model = get_models()[name].fit(X_train, price)
+    file_path = tmp_path / 'model_export.pkl'
+
+    assert export_inference_artifacts(model, preprocessor, str(file_path), X_check=X_train[:500])
+
+    exported = load_object(str(file_path))
+    expected = model.predict(preprocessor.transform(new_features))
+    actual = exported['model'].predict(exported['preprocessor'].transform(new_features))
+    # XGBoost sums its trees in float32, the other models must match to rounding
+    rtol = 1e-5 if name == 'XGBoost' else 1e-9
+    np.testing.assert_allclose(actual, expected, rtol=rtol, atol=rtol * np.abs(expected).max())
+
+
+def test_unsupported_model_removes_stale_export(tmp_path, training_data):
+    from sklearn.neighbors import KNeighborsRegressor
+
+    preprocessor, X_train, price, _ = training_data
+    file_path = tmp_path / 'model_export.pkl'
+    file_path.write_bytes(b'stale')
+    model = KNeighborsRegressor().fit(X_train, price)
+
+    assert not export_inference_artifacts(model, preprocessor, str(file_path), X_check=X_train[:100])
+    assert not file_path.exists()